@@ -0,0 +1,323 @@
+"""
+Actor/learner training of the `ddq_learning` agents.
+
+	python -m algo.actor_learner --model "models/ddqn80 90 50 50 1 tuned on ddqn86.pth" -o "models/ddqn actor learner.pth" --actors 4 --enemy random
+
+Actor processes play `n_parallel` games at once on a `VectorBoard` against the enemy (a `algo.tournament` player spec),
+the agent takes the positive side in half of them. Moves are epsilon-greedy over the values of a local copy
+of the policy, refreshed from shared memory whenever the learner publishes new weights.
+Transitions span from a move of the agent to its next turn, with the rewards of `jupyter/double_q_learning.ipynb`,
+and are sent packed in tensors over a shared memory queue.
+
+The learner (the calling process) owns the `ReplayBuffer` and the `DDQNTrainer`: it drains the queue,
+takes the gradient steps, publishes the target net to the actors every `sync_every` updates
+and saves it to the output every `checkpoint_every` updates.
+"""
+
+import argparse
+import os
+import queue
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from dataclasses import dataclass
+from os import PathLike
+from typing import Callable, Optional
+
+from .board import GameState
+from .vector_board import VectorBoard, N_ACTIONS, segment_argmax
+from .ddq_learning import QLearning, DDQNTrainer
+from .replay import ReplayBuffer
+from .tournament import make_player, model_layer_sizes
+
+# Columns of the packed transitions sent by the actors, the rewards are sent separately
+_CODES, _MOVES_SINCE_LAST_CAPTURE, _ACTIONS, _NEXT_CODES, _NEXT_MOVES_SINCE_LAST_CAPTURE, _DONES = range(6)
+
+@dataclass
+class TrainingStats:
+	games: int = 0
+	transitions: int = 0
+	updates: int = 0
+	elapsed: float = 0.
+
+	@property
+	def games_per_second(self) -> float:
+		return self.games / max(self.elapsed, 1e-9)
+
+	@property
+	def transitions_per_second(self) -> float:
+		return self.transitions / max(self.elapsed, 1e-9)
+
+	@property
+	def updates_per_second(self) -> float:
+		return self.updates / max(self.elapsed, 1e-9)
+
+	def __str__(self) -> str:
+		return f"{self.games} games ({self.games_per_second:.1f}/s), " \
+			f"{self.transitions} transitions ({self.transitions_per_second:.0f}/s), " \
+			f"{self.updates} updates ({self.updates_per_second:.1f}/s)"
+
+def _terminal_rewards(pieces: np.ndarray, game_state: np.ndarray, sign: np.ndarray) -> np.ndarray:
+	# Same as the end of `make_environment_step` in the notebook, kings count twice
+	own = np.where(np.sign(pieces) == sign[:, None], np.abs(pieces), 0).sum(1)
+	enemy = np.where(np.sign(pieces) == -sign[:, None], np.abs(pieces), 0).sum(1)
+	return 3 * own / (enemy + 1) + np.where(game_state == sign, 40, -40)
+
+def _actor(
+	actor: int,
+	shared_model: QLearning.DQN,
+	version,
+	transitions: mp.Queue,
+	stop,
+	enemy_spec: str,
+	n_parallel: int,
+	chunk_size: int,
+	epsilon: tuple[float, float, float],
+	seed: int
+) -> None:
+	# Actors already run in parallel, extra torch threads only fight over the cores
+	torch.set_num_threads(1)
+	rng = np.random.default_rng([seed, actor])
+	enemy = make_player(enemy_spec, seed * 1000 + actor)
+
+	model = QLearning.DQN(torch.device("cpu"), [layer.in_features for layer in shared_model.layers] + [1])
+	model_version = -1
+	epsilon_start, epsilon_end, epsilon_decay = epsilon
+	moves = 0
+
+	boards = VectorBoard(n_parallel, auto_reset=False)
+	sign = np.where(np.arange(n_parallel) % 2 == 0, 1, -1).astype(np.int8)
+	# The transition of every game, which is waiting for the agent's next turn
+	pending = np.zeros(n_parallel, dtype=bool)
+	packed = np.zeros((n_parallel, 6), dtype=np.int64)
+	rewards = np.zeros(n_parallel, dtype=np.float32)
+
+	chunk: list[tuple[np.ndarray, np.ndarray]] = []
+	chunk_games = 0
+	while not stop.is_set():
+		if version.value != model_version:
+			with version.get_lock():
+				model.load_state_dict(shared_model.state_dict())
+				model_version = version.value
+
+		legal = boards.legal_moves()
+		actions = np.zeros(n_parallel, dtype=np.int64)
+		ours = np.flatnonzero(boards.turn == sign)
+		theirs = np.flatnonzero(boards.turn != sign)
+		if len(theirs):
+			actions[theirs] = enemy.decide_moves(boards, theirs)
+		if len(ours):
+			children = boards.children(ours)
+			with torch.inference_mode():
+				values = QLearning.children_values(model, children)
+			best = segment_argmax(values, torch.from_numpy(children.parent), len(ours)).numpy()
+			actions[ours] = children.action[best]
+
+			threshold = epsilon_end + (epsilon_start - epsilon_end) * np.exp(-moves / epsilon_decay)
+			explore = ours[rng.random(len(ours)) < threshold]
+			actions[explore] = np.where(legal[explore], rng.random((len(explore), N_ACTIONS)), -1).argmax(1)
+			moves += len(ours)
+
+			packed[ours, _CODES] = boards.codes()[ours].astype(np.int64)
+			packed[ours, _MOVES_SINCE_LAST_CAPTURE] = boards.moves_since_last_capture[ours]
+			packed[ours, _ACTIONS] = actions[ours]
+
+		result = boards.make_moves(actions)
+		move_rewards = result.captured + result.promoted * 2
+		rewards[ours] = move_rewards[ours] - 2 * (boards.moves_since_last_capture[ours] > 5)
+		rewards[theirs] -= move_rewards[theirs]
+		pending[ours] = True
+
+		finished = result.finished != GameState.NOT_OVER.value
+		ended = np.flatnonzero(pending & (finished | (boards.turn == sign)))
+		if len(ended):
+			done = finished[ended]
+			rewards[ended[done]] += _terminal_rewards(boards.pieces[ended[done]], result.finished[ended[done]], sign[ended[done]])
+			packed[ended, _NEXT_CODES] = boards.codes()[ended].astype(np.int64)
+			packed[ended, _NEXT_MOVES_SINCE_LAST_CAPTURE] = boards.moves_since_last_capture[ended]
+			packed[ended, _DONES] = done
+			chunk.append((packed[ended].copy(), rewards[ended].copy()))
+			pending[ended] = False
+
+		chunk_games += int(finished.sum())
+		boards.reset(np.flatnonzero(finished))
+
+		if sum(len(rows) for rows, _ in chunk) >= chunk_size:
+			message = (
+				chunk_games,
+				torch.from_numpy(np.concatenate([rows for rows, _ in chunk])),
+				torch.from_numpy(np.concatenate([values for _, values in chunk])),
+			)
+			chunk, chunk_games = [], 0
+			# The queue is bounded, a slow learner holds the actors back
+			while not stop.is_set():
+				try:
+					transitions.put(message, timeout=0.1)
+					break
+				except queue.Full:
+					pass
+
+def _save(model: QLearning.DQN, path: PathLike | str) -> None:
+	torch.save(model.state_dict(), f"{path}.tmp")
+	os.replace(f"{path}.tmp", path)
+
+def run_training(
+	output: PathLike | str,
+	model_path: Optional[PathLike | str] = None,
+	layer_sizes: list[int] = [90, 50, 50, 1],
+	enemy: str = "random",
+	actors: int = 2,
+	n_parallel: int = 64,
+	updates: int = 10000,
+	batch_size: int = 128,
+	capacity: int = 1 << 20,
+	buffer_path: Optional[PathLike | str] = None,
+	prioritized: bool = False,
+	warmup: int = 1000,
+	lr: float = 1e-4,
+	tau: float = 0.006,
+	sync_every: int = 50,
+	checkpoint_every: int = 1000,
+	epsilon: tuple[float, float, float] = (0.3, 0.01, 1000.),
+	chunk_size: int = 256,
+	seed: int = 0,
+	report_every: float = 10.,
+	on_report: Optional[Callable[[TrainingStats], None]] = None
+) -> TrainingStats:
+	"""
+	Trains for `updates` gradient steps, starting from `model_path` (or a new net of `layer_sizes`).
+	The target net is saved to `output`. `epsilon` is the exploration schedule of every actor
+	(start, end, decay in moves), `warmup` - transitions collected before the first update
+
+	Returns: counters of the whole run
+	"""
+	torch.manual_seed(seed)
+	device = torch.device("cpu")
+	if model_path is not None:
+		layer_sizes = model_layer_sizes(model_path)
+	online = QLearning.DQN(device, layer_sizes)
+	if model_path is not None:
+		online.load_state_dict(torch.load(model_path, map_location=device))
+
+	trainer = DDQNTrainer(online, lr=lr, tau=tau)
+	memory = ReplayBuffer(capacity, buffer_path, prioritized, seed=seed)
+
+	context = mp.get_context("spawn")
+	shared_model = QLearning.DQN(device, layer_sizes)
+	shared_model.load_state_dict(trainer.target.state_dict())
+	shared_model.share_memory()
+	version = context.Value("i", 0)
+	transitions = context.Queue(maxsize=4 * actors)
+	stop = context.Event()
+
+	processes = [
+		context.Process(
+			target=_actor,
+			args=(actor, shared_model, version, transitions, stop, enemy, n_parallel, chunk_size, epsilon, seed),
+			daemon=True
+		)
+		for actor in range(actors)
+	]
+	for process in processes:
+		process.start()
+
+	stats = TrainingStats()
+	start_time = last_report = time.perf_counter()
+
+	def receive(wait: bool) -> None:
+		"""
+		Takes a message of the actors into the memory, `wait` - waits for it while any actor is alive
+		"""
+		while True:
+			try:
+				games, rows, rewards = transitions.get(timeout=0.1 if wait else 0)
+				break
+			except queue.Empty:
+				if not wait:
+					return
+			# Actors only stop when told to, so a finished one has failed
+			if not any(process.is_alive() for process in processes):
+				exit_codes = ", ".join(str(process.exitcode) for process in processes)
+				raise RuntimeError(f"All the actors have stopped before the warmup was collected (exit codes {exit_codes})")
+		rows = rows.numpy()
+		memory.extend(
+			rows[:, _CODES].astype(np.uint64), rows[:, _MOVES_SINCE_LAST_CAPTURE], rows[:, _ACTIONS], rewards.numpy(),
+			rows[:, _NEXT_CODES].astype(np.uint64), rows[:, _NEXT_MOVES_SINCE_LAST_CAPTURE], rows[:, _DONES].astype(bool)
+		)
+		stats.games += games
+		stats.transitions += len(rows)
+
+	try:
+		while stats.updates < updates:
+			# Everything that is already waiting is taken, the learner only waits while it has nothing to learn from
+			receive(wait=len(memory) < max(warmup, batch_size))
+			for _ in range(4 * actors):
+				if transitions.empty():
+					break
+				receive(wait=False)
+			if len(memory) < max(warmup, batch_size):
+				continue
+
+			batch = memory.sample(batch_size, device)
+			errors = trainer.optimize(batch)
+			if prioritized:
+				memory.update_priorities(batch.indexes, errors)
+			trainer.soft_update()
+			stats.updates += 1
+
+			if stats.updates % sync_every == 0:
+				with version.get_lock():
+					shared_model.load_state_dict(trainer.target.state_dict())
+					version.value += 1
+			if stats.updates % checkpoint_every == 0:
+				_save(trainer.target, output)
+				memory.flush()
+
+			now = time.perf_counter()
+			if on_report is not None and now - last_report >= report_every:
+				stats.elapsed = now - start_time
+				on_report(stats)
+				last_report = now
+	finally:
+		stop.set()
+		# Actors blocked on a full queue need it drained to finish
+		while any(process.is_alive() for process in processes):
+			try:
+				transitions.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		for process in processes:
+			process.join()
+
+	_save(trainer.target, output)
+	memory.flush()
+	stats.elapsed = time.perf_counter() - start_time
+	return stats
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Trains a ddq_learning agent with parallel actors and a single learner")
+	parser.add_argument("--model", default=None, help="model to start from, a new one by default")
+	parser.add_argument("--layers", default="90,50,50,1", help="layer sizes of a new model")
+	parser.add_argument("-o", "--output", default="models/ddqn actor learner.pth")
+	parser.add_argument("--enemy", default="random", help="player spec, see algo.tournament")
+	parser.add_argument("--actors", type=int, default=2)
+	parser.add_argument("--parallel", type=int, default=64, help="games played at once by every actor")
+	parser.add_argument("--updates", type=int, default=10000)
+	parser.add_argument("--batch-size", type=int, default=128)
+	parser.add_argument("--capacity", type=int, default=1 << 20)
+	parser.add_argument("--buffer", default=None, help="directory of a memory mapped replay buffer")
+	parser.add_argument("--prioritized", action="store_true")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	stats = run_training(
+		args.output, args.model, [int(size) for size in args.layers.split(",")], args.enemy,
+		args.actors, args.parallel, args.updates, args.batch_size, args.capacity, args.buffer, args.prioritized,
+		seed=args.seed, on_report=lambda stats: print(stats, flush=True)
+	)
+	print(stats)
+
+if __name__ == "__main__":
+	main()
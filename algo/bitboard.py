@@ -0,0 +1,392 @@
+import numpy as np
+import torch
+
+from typing import Optional, Iterator
+
+from .board import Board, GameState, MoveResult, _s, _SQUARES, _INDEX, _STEP, _JUMP, _PIECE_DIRECTIONS, \
+	_ZOBRIST_PIECES, _zobrist_flags, _zobrist_key, MOVE_END_SHIFT, MOVE_CAPTURE
+
+_FULL = (1 << 18) - 1
+
+def _build_shifts(d: int) -> list[tuple[int, int]]:
+	# A step in a fixed direction is a constant bit shift within squares of the same row parity
+	ret = []
+	for parity in (0, 1):
+		src_mask = 0
+		delta = None
+		for k in range(18):
+			if (k // 3) % 2 != parity or _STEP[d][k] < 0:
+				continue
+			src_mask |= 1 << k
+			assert delta is None or delta == _STEP[d][k] - k
+			delta = _STEP[d][k] - k
+		ret.append((src_mask, delta or 0))
+	return ret
+
+_SHIFTS: list[list[tuple[int, int]]] = [_build_shifts(d) for d in range(4)]
+
+def _shift(mask: int, d: int) -> int:
+	ret = 0
+	for src_mask, delta in _SHIFTS[d]:
+		if delta > 0:
+			ret |= (mask & src_mask) << delta
+		else:
+			ret |= (mask & src_mask) >> -delta
+	return ret
+
+
+class BitBoard(Board):
+	"""
+	Drop-in replacement of `Board` that stores the position as per-side man/king bit masks.
+
+	Moves, captures, promotions and the should capture rule follow `Board` exactly,
+	so both could be used interchangeably (e.g. `IPlayer.do_round(enemy, BitBoard)`).
+	"""
+
+	def __init__(self) -> None:
+		# Indexed by `piece + 2`, index 2 (empty) is never set.
+		# Negative men fill the two top rows, positive men the two bottom ones
+		self.__masks: list[int] = [0, 0b111111, 0, 0b111111 << 12, 0]
+
+		self.__should_capture = {1: False, -1: False}
+		self.__enable_update_should_capture = True
+		self.__moves_since_last_capture = 0
+
+		self.__turn_sign = 1
+		self.__game_state_cache: Optional[GameState] = GameState.NOT_OVER
+		self.__zobrist = self.__compute_zobrist()
+
+	def __compute_zobrist(self) -> int:
+		return _zobrist_key(self.__pieces(), self.__turn_sign, self.__should_capture)
+
+	def __occupied(self, sign: int) -> int:
+		if sign > 0:
+			return self.__masks[3] | self.__masks[4]
+		return self.__masks[0] | self.__masks[1]
+
+	def __piece(self, k: int) -> int:
+		masks = self.__masks
+		for i in (0, 1, 3, 4):
+			if masks[i] >> k & 1:
+				return i - 2
+		return 0
+
+	def __set(self, k: int, piece: int) -> None:
+		masks = self.__masks
+		clear = ~(1 << k)
+		for i in (0, 1, 3, 4):
+			masks[i] &= clear
+		if piece:
+			masks[piece + 2] |= 1 << k
+
+	def __has_capture(self, sign: int) -> bool:
+		men, kings = self.__masks[2 + sign], self.__masks[2 + 2 * sign]
+		enemy = self.__occupied(-sign)
+		empty = ~(enemy | men | kings) & _FULL
+		for d in range(4):
+			movers = kings | men if d in _PIECE_DIRECTIONS[2 + sign] else kings
+			if _shift(_shift(movers, d) & enemy, d) & empty:
+				return True
+		return False
+
+	def __has_step(self, sign: int) -> bool:
+		men, kings = self.__masks[2 + sign], self.__masks[2 + 2 * sign]
+		empty = ~(self.__occupied(1) | self.__occupied(-1)) & _FULL
+		for d in range(4):
+			movers = kings | men if d in _PIECE_DIRECTIONS[2 + sign] else kings
+			if _shift(movers, d) & empty:
+				return True
+		return False
+
+	def __update_should_capture(self) -> None:
+		self.__should_capture = {
+			-1: self.__has_capture(-1),
+			1: self.__has_capture(1)
+		}
+
+	def check_should_capture(self, sign: int) -> bool:
+		return self.__should_capture[sign]
+
+	def __moves_from(self, k: int) -> Iterator[int]:
+		piece = self.__piece(k)
+		if not piece:
+			return
+
+		sign = _s(piece)
+		enemy = self.__occupied(-sign)
+		empty = ~(enemy | self.__occupied(sign)) & _FULL
+		can_step = not self.__should_capture[sign]
+
+		for d in _PIECE_DIRECTIONS[piece + 2]:
+			n = _STEP[d][k]
+			if n < 0:
+				continue
+			if enemy >> n & 1:
+				j = _JUMP[d][k]
+				if j >= 0 and empty >> j & 1:
+					yield j
+			elif can_step and empty >> n & 1:
+				yield n
+
+	def is_move_correct(self, start: tuple[int, int], end: tuple[int, int]) -> bool:
+		k = _INDEX.get((start[0], start[1]))
+		e = _INDEX.get((end[0], end[1]))
+		if k is None or e is None:
+			return False
+		return e in self.__moves_from(k)
+
+	def get_correct_moves(self, start: tuple[int, int]) -> Iterator[tuple[int, int]]:
+		k = _INDEX.get((start[0], start[1]))
+		if k is None:
+			return
+		for e in self.__moves_from(k):
+			yield _SQUARES[e]
+
+	def get_possible_pos(self) -> Iterator[tuple[int, int]]:
+		occupied = self.__occupied(self.__turn_sign)
+		for k in range(18):
+			if occupied >> k & 1:
+				yield _SQUARES[k]
+
+	def legal_moves(self) -> np.ndarray:
+		occupied = self.__occupied(self.__turn_sign)
+		# Captures are the moves two rows away
+		ret = np.array([
+			k | e << MOVE_END_SHIFT | (MOVE_CAPTURE if abs(e // 3 - k // 3) == 2 else 0)
+			for k in range(18) if occupied >> k & 1
+			for e in self.__moves_from(k)
+		], dtype=np.int16)
+		ret.flags.writeable = False
+		return ret
+
+	def make_move(self, start: tuple[int, int], end: tuple[int, int]) -> MoveResult:
+		"""
+		**Warning**: No checks are performed, see `Board.make_move`
+		"""
+
+		had_to_capture = self.check_should_capture(self.__turn_sign)
+
+		self.__game_state_cache = None
+
+		s = _INDEX[(start[0], start[1])]
+		e = _INDEX[(end[0], end[1])]
+		piece = self.__piece(s)
+
+		ret = MoveResult(
+			0, False, (start[0], start[1]), (end[0], end[1]),
+			self.__turn_sign, self.__moves_since_last_capture, self.__should_capture, self.__zobrist
+		)
+		zobrist = self.__zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture) ^ _ZOBRIST_PIECES[s][piece + 2]
+
+		if had_to_capture:
+			enemy_k = _INDEX[(start[0] + _s(end[0] - start[0]), start[1] + _s(end[1] - start[1]))]
+			enemy = self.__piece(enemy_k)
+			assert _s(piece) == -_s(enemy)
+			ret.captured = abs(enemy)
+			self.__set(enemy_k, 0)
+			zobrist ^= _ZOBRIST_PIECES[enemy_k][enemy + 2]
+
+			self.__moves_since_last_capture = 0
+		else:
+			self.__moves_since_last_capture += 1
+
+		self.__set(s, 0)
+
+		if (end[1] == 0 and piece == 1) or (end[1] == self.SIZE - 1 and piece == -1):
+			piece *= 2
+			ret.promoted = True
+		self.__set(e, piece)
+		zobrist ^= _ZOBRIST_PIECES[e][piece + 2]
+
+		if self.__enable_update_should_capture:
+			self.__update_should_capture()
+
+		if had_to_capture and self.check_should_capture(self.__turn_sign) and \
+				next(self.__moves_from(e), None) is not None:
+			self.__zobrist = zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture)
+			return ret
+
+		self.__turn_sign = -self.__turn_sign
+		self.__zobrist = zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture)
+		return ret
+
+	def undo_move(self, move: MoveResult) -> None:
+		"""
+		Rolls back the move, that `make_move` returned `move` for, see `Board.undo_move`
+		"""
+
+		self.__game_state_cache = None
+
+		start, end = move.start, move.end
+		e = _INDEX[end]
+		piece = self.__piece(e)
+		if move.promoted:
+			piece = _s(piece)
+		self.__set(e, 0)
+		self.__set(_INDEX[start], piece)
+
+		if move.captured:
+			enemy_k = _INDEX[(start[0] + _s(end[0] - start[0]), start[1] + _s(end[1] - start[1]))]
+			self.__set(enemy_k, -_s(piece) * move.captured)
+
+		self.__turn_sign = move.turn_sign
+		self.__moves_since_last_capture = move.moves_since_last_capture
+		self.__should_capture = move.should_capture or {1: False, -1: False}
+		self.__zobrist = move.zobrist
+
+	def copy(self) -> 'BitBoard':
+		ret = type(self).__new__(type(self))
+		ret.__masks = self.__masks[:]
+
+		ret.__should_capture = dict(self.__should_capture)
+		ret.__enable_update_should_capture = self.__enable_update_should_capture
+		ret.__moves_since_last_capture = self.__moves_since_last_capture
+
+		ret.__turn_sign = self.__turn_sign
+		ret.__game_state_cache = self.__game_state_cache
+		ret.__zobrist = self.__zobrist
+		return ret
+
+	@property
+	def game_state(self) -> GameState:
+		if self.__game_state_cache:
+			return self.__game_state_cache
+
+		ret = self.__compute_game_state()
+		self.__game_state_cache = ret
+		return ret
+
+	@property
+	def turn_sign(self) -> int:
+		return self.__turn_sign
+
+	@property
+	def moves_since_last_capture(self) -> int:
+		return self.__moves_since_last_capture
+
+	def __compute_game_state(self) -> GameState:
+		if self.__moves_since_last_capture >= self.DRAW_NON_CAPTURE_MOVES:
+			return GameState.DRAW
+
+		turn_sign = self.__turn_sign
+		if not self.__occupied(turn_sign):
+			return GameState(-turn_sign)
+		elif not self.__occupied(-turn_sign):
+			return GameState(turn_sign)
+
+		if self.__has_capture(turn_sign) or \
+				(not self.__should_capture[turn_sign] and self.__has_step(turn_sign)):
+			return GameState.NOT_OVER
+
+		return GameState(-turn_sign)
+
+	def __getitem__(self, pos: tuple[int, int]) -> int:
+		k = _INDEX.get((pos[0], pos[1]))
+		return 0 if k is None else self.__piece(k)
+
+	@property
+	def board(self) -> list[list[int]]:
+		return [[self[x, y] for y in range(self.SIZE)] for x in range(self.SIZE)]
+
+	@property
+	def enable_update_should_capture(self) -> bool:
+		return self.__enable_update_should_capture
+
+	@enable_update_should_capture.setter
+	def enable_update_should_capture(self, value: bool) -> None:
+		if value == self.__enable_update_should_capture:
+			return
+
+		self.__enable_update_should_capture = value
+		self.__game_state_cache = None
+
+		if value:
+			self.__update_should_capture()
+		else:
+			self.__should_capture = {1: False, -1: False}
+		self.__zobrist = self.__compute_zobrist()
+
+	def __pieces(self) -> list[int]:
+		return [self.__piece(k) for k in range(18)]
+
+	def __bare_byte_repr(self) -> bytes:
+		return bytes([
+			int(self.__turn_sign == 1),
+			self.__should_capture[-1],
+			self.__should_capture[1]
+		] + [piece + 2 for piece in self.__pieces()])
+
+	def __int__(self) -> int:
+		return int.from_bytes(self.__bare_byte_repr(), byteorder="big")
+
+	def __bytes__(self) -> bytes:
+		return bytes([
+			self.__enable_update_should_capture,
+			self.__moves_since_last_capture,
+		]) + self.__bare_byte_repr()
+
+	def __iter__(self) -> Iterator[tuple[tuple[int, int], int]]:
+		"""
+		Returns pair pos and piece
+		"""
+		for k, piece in enumerate(self.__pieces()):
+			yield _SQUARES[k], piece
+
+	def __one_hot_pieces(self, flipped: bool) -> list[int]:
+		pieces = self.__pieces()
+		if flipped:
+			# Rotating the board by 180 degrees maps square k onto 17 - k
+			return [-piece for piece in reversed(pieces)]
+		return pieces
+
+	def to_tensor(self, device, flipped = False) -> torch.Tensor:
+		ret = torch.zeros(90, dtype=torch.float32, device=device)
+		ret[[k * 5 + piece + 2 for k, piece in enumerate(self.__one_hot_pieces(flipped))]] = 1
+		return ret
+
+	def to_tensor3d(self, device, flipped = False) -> torch.Tensor:
+		ret = torch.zeros(3, 6, 5, dtype=torch.float32, device=device)
+		ret.view(-1)[[
+			(k % 3) * 30 + (k // 3) * 5 + piece + 2
+			for k, piece in enumerate(self.__one_hot_pieces(flipped))
+		]] = 1
+		return ret
+
+	@property
+	def code(self) -> int:
+		masks = self.__masks
+		return masks[3] | masks[4] | (masks[0] | masks[1]) << 18 | (masks[0] | masks[4]) << 36 | \
+			(self.__turn_sign == 1) << 54 | self.__should_capture[-1] << 55 | self.__should_capture[1] << 56
+
+	@property
+	def zobrist(self) -> int:
+		return self.__zobrist
+
+	def __hash__(self) -> int:
+		return self.__zobrist
+
+	@classmethod
+	def from_num_repr(cls, value: int | bytes) -> 'BitBoard':
+		ret = cls()
+
+		if isinstance(value, int):
+			arr = value.to_bytes(21, "big")
+		elif isinstance(value, bytes):
+			ret.__enable_update_should_capture = bool(value[0])
+			ret.__moves_since_last_capture = value[1]
+			arr = value[2:]
+
+		ret.__turn_sign = 1 if arr[0] else -1
+		ret.__should_capture = {1: bool(arr[2]), -1: bool(arr[1])}
+
+		ret.__masks = [0] * 5
+		for k in range(18):
+			ret.__set(k, arr[k + 3] - 2)
+		ret.__game_state_cache = None
+		ret.__zobrist = ret.__compute_zobrist()
+
+		return ret
+
+	def get_correct_moves_cache(self) -> dict[tuple[tuple[int, int], tuple[int, int]], bool]:
+		# Moves are generated straight from the masks, there is nothing cached
+		return {}
@@ -1,10 +1,13 @@
+import numpy as np
 import torch
 
-from typing import Optional, Iterator
+from typing import Optional, Iterator, Iterable
 from dataclasses import dataclass
 from enum import Enum
-import itertools
 import copy
+import random
+
+from .encoding import encode_batch
 
 def _s(x: int) -> int:
 	if x > 0:
@@ -13,39 +16,98 @@ def _s(x: int) -> int:
 		return -1
 	return 0
 
-@dataclass
-class _c:
-	x: int
-	y: int
-
-	def s(self) -> '_c':
-		return _c(_s(self.x), _s(self.y))
-
-	def __add__(self, other: '_c') -> '_c':
-		return _c(self.x + other.x, self.y + other.y)
-	
-	def __sub__(self, other: '_c') -> '_c':
-		return _c(self.x - other.x, self.y - other.y)
-	
-	def __eq__(self, value: '_c') -> bool:
-		return self.x == value.x and self.y == value.y
-	
-	def __getitem__(self, index: int) -> int:
-		if index == 0:
-			return self.x
-		elif index == 1:
-			return self.y
-		raise IndexError("Invalid index")
-	
-	def __hash__(self) -> int:
-		# https://stackoverflow.com/a/4005376/8302811
-		return hash((self.x, self.y))
-	
-	def __repr__(self) -> str:
-		return f"({self.x}, {self.y})"
-
-	def tuple(self) -> tuple[int, int]:
-		return (self.x, self.y)
+# The 18 dark squares are numbered in the order `Board.__iter__` walks them:
+# square k lies on row k // 3, so every row holds 3 consecutive squares
+_SQUARES: list[tuple[int, int]] = [
+	(2 * (k % 3) + (k // 3) % 2, k // 3)
+	for k in range(18)
+]
+_INDEX: dict[tuple[int, int], int] = {pos: k for k, pos in enumerate(_SQUARES)}
+
+_DIRECTIONS = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+
+def _target(k: int, dx: int, dy: int) -> int:
+	x, y = _SQUARES[k]
+	return _INDEX.get((x + dx, y + dy), -1)
+
+# _STEP[d][k] / _JUMP[d][k] - square reached from k by one / two steps in direction d, -1 if off board
+_STEP: list[list[int]] = [[_target(k, dx, dy) for k in range(18)] for dx, dy in _DIRECTIONS]
+_JUMP: list[list[int]] = [[_target(k, 2 * dx, 2 * dy) for k in range(18)] for dx, dy in _DIRECTIONS]
+
+# Directions a piece may move in, indexed by `piece + 2`.
+# Simple positive pieces go up the board, simple negative ones go down
+_PIECE_DIRECTIONS: list[tuple[int, ...]] = [
+	(0, 1, 2, 3),
+	(2, 3),
+	(),
+	(0, 1),
+	(0, 1, 2, 3),
+]
+
+# _MOVE_TABLE[piece + 2][k] - (step, jump) positions for every direction the piece may move in.
+# Directions leading off board are skipped, jump is None if only the step fits on the board
+_MOVE_TABLE: list[list[tuple[tuple[tuple[int, int], Optional[tuple[int, int]]], ...]]] = [
+	[
+		tuple(
+			(_SQUARES[_STEP[d][k]], _SQUARES[_JUMP[d][k]] if _JUMP[d][k] >= 0 else None)
+			for d in directions if _STEP[d][k] >= 0
+		)
+		for k in range(18)
+	]
+	for directions in _PIECE_DIRECTIONS
+]
+
+# Compact moves of `Board.legal_moves`: start square | end square << 5 | capture bit, squares in the `_SQUARES` order
+MOVE_END_SHIFT = 5
+MOVE_SQUARE_MASK = (1 << MOVE_END_SHIFT) - 1
+MOVE_CAPTURE = 1 << (2 * MOVE_END_SHIFT)
+
+# _MOVE_CODES[piece + 2][k] - (step square, jump square, step move, jump move) for every direction the piece
+# may move in, in the `_MOVE_TABLE` order. Jump square is -1 if only the step fits on the board
+_MOVE_CODES: list[list[tuple[tuple[int, int, int, int], ...]]] = [
+	[
+		tuple(
+			(_STEP[d][k], _JUMP[d][k], k | _STEP[d][k] << MOVE_END_SHIFT, k | _JUMP[d][k] << MOVE_END_SHIFT | MOVE_CAPTURE)
+			for d in directions if _STEP[d][k] >= 0
+		)
+		for k in range(18)
+	]
+	for directions in _PIECE_DIRECTIONS
+]
+
+# _AFFECTED[k] - squares whose moves could change, when square k changes:
+# k itself and every square that steps or jumps onto k in any direction
+_AFFECTED: list[frozenset[int]] = [
+	frozenset([k] + [
+		src
+		for d in range(4)
+		for src in range(18)
+		if _STEP[d][src] == k or _JUMP[d][src] == k
+	])
+	for k in range(18)
+]
+
+# Random keys of the Zobrist hash: _ZOBRIST_PIECES[k][piece + 2] (0 for the empty square),
+# the positive turn and the should capture flags. The seed is fixed, so keys are the same in every process
+_zobrist_random = random.Random(0x5EED)
+_ZOBRIST_PIECES: list[list[int]] = [
+	[0 if piece == 0 else _zobrist_random.getrandbits(64) for piece in range(-2, 3)]
+	for _ in range(18)
+]
+_ZOBRIST_TURN = _zobrist_random.getrandbits(64)
+_ZOBRIST_SHOULD_CAPTURE: dict[int, int] = {-1: _zobrist_random.getrandbits(64), 1: _zobrist_random.getrandbits(64)}
+
+def _zobrist_flags(turn_sign: int, should_capture: dict[int, bool]) -> int:
+	return (_ZOBRIST_TURN if turn_sign == 1 else 0) ^ \
+		(_ZOBRIST_SHOULD_CAPTURE[-1] if should_capture[-1] else 0) ^ \
+		(_ZOBRIST_SHOULD_CAPTURE[1] if should_capture[1] else 0)
+
+def _zobrist_key(pieces: Iterable[int], turn_sign: int, should_capture: dict[int, bool]) -> int:
+	# `pieces` in the `_SQUARES` order
+	ret = _zobrist_flags(turn_sign, should_capture)
+	for k, piece in enumerate(pieces):
+		ret ^= _ZOBRIST_PIECES[k][piece + 2]
+	return ret
 
 class GameState(Enum):
 	NOT_OVER = 0
@@ -61,16 +123,18 @@ class MoveResult:
 	captured: int
 	promoted: bool
 
+	# State before the move, so that `Board.undo_move` could roll it back
+	start: tuple[int, int] = (0, 0)
+	end: tuple[int, int] = (0, 0)
+	turn_sign: int = 1
+	moves_since_last_capture: int = 0
+	should_capture: Optional[dict[int, bool]] = None
+	zobrist: int = 0
+
 class Board():
 	SIZE = 6
 	TILING_PARITY = 0
 	DRAW_NON_CAPTURE_MOVES = 50
-	__directions = [
-		_c(-1, -1),
-		_c(1, -1),
-		_c(1, 1),
-		_c(-1, 1)
-	]
 	
 	def __init__(self) -> None:
 		# https://stackoverflow.com/a/6473724/8302811
@@ -87,111 +151,82 @@ class Board():
 		self.__enable_update_should_capture = True
 		self.__moves_since_last_capture = 0
 
-		self.__correct_moves_cache: dict[_c, dict[_c, bool]] = {}
+		self.__correct_moves_cache: dict[tuple[int, int], dict[tuple[int, int], bool]] = {}
 		self.__tensor_cache: dict[tuple[bool, bool], torch.Tensor] = {}
+		self.__legal_moves_cache: Optional[np.ndarray] = None
 
 		self.__turn_sign = 1
 		self.__game_state_cache: Optional[GameState] = GameState.NOT_OVER
+		self.__zobrist = self.__compute_zobrist()
+
+		# Per-side counters, kept up to date by `make_move`:
+		#   number of pieces, possible captures and possible non-capture steps
+		self.__pieces_count: dict[int, int]
+		self.__captures_count: dict[int, int]
+		self.__steps_count: dict[int, int]
+		self.__recount()
 
 	def check_should_capture(self, sign: int) -> bool:
 		return self.__should_capture[sign]
 
-	def __invalid(self, pos: _c) -> bool:
-		return pos.x not in range(self.SIZE) or pos.y not in range(self.SIZE)
-	
-	def __empty(self, pos: _c) -> bool:
-		return self[pos] == 0
-	
-	def __enemy(self, pos1: _c, pos2: _c) -> bool:
-		return _s(self[pos1]) == -_s(self[pos2])
-	
-	@staticmethod
-	def __faster_iteration_end(pos: _c, i: int) -> _c:
-		return Board.__faster_iteration_start(pos, i + 1)
-	
-	@staticmethod
-	def __faster_iteration_start(pos: _c, i: int) -> _c:
-		if i % 3 == 0:
-			pos.y += 1
-			return _c(pos.y % 2, pos.y)
-		else:
-			return _c(pos.x + 2, pos.y)
-	
-	def __get_simple_directions(self, sign: int) -> list[_c]:
-		if sign > 0:
-			return self.__directions[:2]
-		else:
-			return self.__directions[2:]
+	def __compute_zobrist(self) -> int:
+		return _zobrist_key((self.__board[x][y] for x, y in _SQUARES), self.__turn_sign, self.__should_capture)
+
+	def __count_moves(self, k: int, delta: int) -> None:
+		# Adds (or removes with delta = -1) the moves of the piece on square k to the counters
+		board = self.__board
+		x, y = _SQUARES[k]
+		piece = board[x][y]
+		if piece == 0:
+			return
+		sign = _s(piece)
+
+		for (step_x, step_y), jump in _MOVE_TABLE[piece + 2][k]:
+			target = board[step_x][step_y]
+			if target == 0:
+				self.__steps_count[sign] += delta
+			elif _s(target) == -sign and jump and board[jump[0]][jump[1]] == 0:
+				self.__captures_count[sign] += delta
+
+	def __recount(self) -> None:
+		self.__pieces_count = {1: 0, -1: 0}
+		self.__captures_count = {1: 0, -1: 0}
+		self.__steps_count = {1: 0, -1: 0}
+		for k, (x, y) in enumerate(_SQUARES):
+			piece = self.__board[x][y]
+			if piece:
+				self.__pieces_count[_s(piece)] += 1
+				self.__count_moves(k, 1)
 	
 	def __update_should_capture(self) -> None:
 		# Determine if a player should capture
-		self.__should_capture = {-1: False, 1: False}
-		should_capture = self.__should_capture
-		# We are iterating over signs first, so that we can break preliminary
-		for sign in [-1, 1]:
-			simple_directions = self.__get_simple_directions(sign)
-
-			pos = _c(0, -1)
-			for i in range(18):
-				pos = self.__faster_iteration_start(pos, i)
-				piece = self[pos]
-				if _s(piece) != sign:
-					continue
-				t = abs(piece)
-
-				# Simple piece
-				for direction in (simple_directions if t == 1 else self.__directions):
-					enemy_pos = pos + direction
-					empty_pos = enemy_pos + direction
-					if not (
-						self.__invalid(empty_pos) or \
-						not self.__empty(empty_pos) or \
-						not self.__enemy(pos, enemy_pos)
-					):
-						should_capture[sign] = True
-						break
-
-				if should_capture[sign]:
-					break
-
-	def __compute_correct_move(self, s: _c, e: _c) -> bool:
-		if self.__invalid(s) or self.__empty(s) or self.__invalid(e) or not self.__empty(e):
+		self.__should_capture = {
+			-1: self.__captures_count[-1] > 0,
+			1: self.__captures_count[1] > 0
+		}
+
+	def __compute_correct_move(self, s: tuple[int, int], e: tuple[int, int]) -> bool:
+		# Light squares are never reachable, so they are as invalid as the ones outside of the board
+		k = _INDEX.get(s)
+		if k is None or e not in _INDEX or self[s] == 0 or self[e] != 0:
 			return False
 		
 		piece = self[s]
-		t = abs(piece)
 		sign = _s(piece)
 
-		# Piece check
-		if t != 1 and t != 2:
-			return False
-		
-		# Diagonality check
-		delta = e - s
-		if abs(delta[0]) != abs(delta[1]):
-			return False
-		
-		direction = delta.s()
-
-		# Simple piece
-		direction_index = self.__directions.index(direction)
-		# Incorrect direction, if it's a simple piece
-		if t == 1 and (direction_index < 2) != (sign > 0):
-			return False
-		
-		# Non-capture move
-		next_pos = s + direction
-		if next_pos == e:
-			return not self.check_should_capture(sign)
-		
-		# Capture move
-		next_next_pos = next_pos + direction
-		if next_next_pos == e and self.__enemy(s, next_pos):
-			return True
+		# Only the directions allowed for the piece are in the table
+		for step, jump in _MOVE_TABLE[piece + 2][k]:
+			# Non-capture move
+			if step == e:
+				return not self.check_should_capture(sign)
+			
+			# Capture move
+			if jump == e:
+				return _s(self[step]) == -sign
 		
 		return False
 	
-	def __is_move_correct(self, s: _c, e: _c) -> bool:
+	def __is_move_correct(self, s: tuple[int, int], e: tuple[int, int]) -> bool:
 		if s in self.__correct_moves_cache and e in self.__correct_moves_cache[s]:
 			return self.__correct_moves_cache[s][e]
 	
@@ -203,46 +238,84 @@ class Board():
 		return ret
 
 	def is_move_correct(self, start: tuple[int, int], end: tuple[int, int]) -> bool:
-		return self.__is_move_correct(_c(*start), _c(*end))
+		return self.__is_move_correct(tuple(start), tuple(end))
 
 	def get_correct_moves(self, start: tuple[int, int]) -> Iterator[tuple[int, int]]:
-		s = _c(*start)
-		if self.__invalid(s) or self.__empty(s):
+		s = tuple(start)
+		k = _INDEX.get(s)
+		if k is None:
 			return
 		
-		piece = self[s]
-		t = abs(piece)
-		sign = _s(piece)
-
-		if t != 1 and t != 2:
+		board = self.__board
+		piece = board[s[0]][s[1]]
+		if piece == 0:
 			return
+		sign = _s(piece)
 		
-		for direction in (self.__get_simple_directions(sign) if t == 1 else self.__directions):
-			e = s + direction
-
+		for step, jump in _MOVE_TABLE[piece + 2][k]:
 			# Moving a bit more forward, if there is an enemy
-			if self.__invalid(e):
-				continue
-			if self.__enemy(s, e):
-				e += direction
+			e = step
+			if _s(board[step[0]][step[1]]) == -sign:
+				if not jump:
+					continue
+				e = jump
 			
 			if self.__is_move_correct(s, e):
-				yield e.tuple()
+				yield e
 	
 	def __get_possible_pos(self, sign: int) -> Iterator[tuple[int, int]]:
-		pos = _c(0, 0)
-		for i in range(18):
-			if _s(self[pos]) == sign:
-				yield pos.tuple()
-			pos = self.__faster_iteration_end(pos, i)
-		
-		return
+		board = self.__board
+		for pos in _SQUARES:
+			if _s(board[pos[0]][pos[1]]) == sign:
+				yield pos
 
 	def get_possible_pos(self) -> Iterator[tuple[int, int]]:
 		return self.__get_possible_pos(self.__turn_sign)
 
+	def legal_moves(self) -> np.ndarray:
+		"""
+		All the correct moves of the side to move, in the order of `get_possible_pos` and `get_correct_moves`.
+		Every move is `start | end << MOVE_END_SHIFT`, with `MOVE_CAPTURE` set for captures,
+		where the squares are numbered in the `Board.__iter__` order, see `decode_move`
+
+		Returns: read-only int16 array of the moves
+		"""
+		if self.__legal_moves_cache is not None:
+			return self.__legal_moves_cache
+
+		sign = self.__turn_sign
+		can_step = not self.__should_capture[sign]
+		board = self.__board
+		pieces = [board[x][y] for x, y in _SQUARES]
+
+		moves: list[int] = []
+		for k, piece in enumerate(pieces):
+			if piece * sign <= 0:
+				continue
+			for step, jump, step_move, jump_move in _MOVE_CODES[piece + 2][k]:
+				target = pieces[step]
+				if target == 0:
+					if can_step:
+						moves.append(step_move)
+				elif target * sign < 0 and jump >= 0 and pieces[jump] == 0:
+					moves.append(jump_move)
+
+		ret = np.array(moves, dtype=np.int16)
+		ret.flags.writeable = False
+		self.__legal_moves_cache = ret
+		return ret
+
+	@staticmethod
+	def decode_move(move: int) -> tuple[tuple[int, int], tuple[int, int]]:
+		"""
+		Returns: (start, end) positions of a `legal_moves` move
+		"""
+		move = int(move)
+		return _SQUARES[move & MOVE_SQUARE_MASK], _SQUARES[move >> MOVE_END_SHIFT & MOVE_SQUARE_MASK]
+
 	def __invalidate_cache(self) -> None:
 		self.__correct_moves_cache.clear()
+		self.__legal_moves_cache = None
 		self.__game_state_cache = None
 		self.__tensor_cache.clear()
 
@@ -261,15 +334,29 @@ class Board():
 
 		piece = self[start]
 
-		ret = MoveResult(0, False)
+		ret = MoveResult(
+			0, False, tuple(start), tuple(end),
+			self.__turn_sign, self.__moves_since_last_capture, self.__should_capture, self.__zobrist
+		)
+
+		# The key is updated for the changed squares, the flags are added back once they are known
+		zobrist = self.__zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture)
+		zobrist ^= _ZOBRIST_PIECES[_INDEX[start[0], start[1]]][piece + 2]
+
+		# Only the moves around the changed squares have to be recounted
+		affected = self.__affected_squares(start, end, had_to_capture)
+		enemy_x = start[0] + _s(end[0] - start[0])
+		enemy_y = start[1] + _s(end[1] - start[1])
+		for k in affected:
+			self.__count_moves(k, -1)
 
 		if had_to_capture:
 			# We should determine the enemy and capture
-			s = _c(*start)
-			enemy_pos = s + (_c(*end) - s).s()
-			assert self.__enemy(s, enemy_pos)
-			ret.captured = abs(self.__board[enemy_pos.x][enemy_pos.y])
-			self.__board[enemy_pos.x][enemy_pos.y] = 0
+			assert _s(piece) == -_s(self.__board[enemy_x][enemy_y])
+			ret.captured = abs(self.__board[enemy_x][enemy_y])
+			self.__pieces_count[_s(self.__board[enemy_x][enemy_y])] -= 1
+			zobrist ^= _ZOBRIST_PIECES[_INDEX[enemy_x, enemy_y]][self.__board[enemy_x][enemy_y] + 2]
+			self.__board[enemy_x][enemy_y] = 0
 
 			self.__moves_since_last_capture = 0
 		else:
@@ -286,6 +373,10 @@ class Board():
 		elif end[1] == self.SIZE - 1 and self[end] == -1:
 			self.__board[end[0]][end[1]] = -2
 			ret.promoted = True
+		zobrist ^= _ZOBRIST_PIECES[_INDEX[end[0], end[1]]][self[end] + 2]
+
+		for k in affected:
+			self.__count_moves(k, 1)
 		
 		# Check if the piece should capture again
 		if self.__enable_update_should_capture:
@@ -295,10 +386,76 @@ class Board():
 		#    If we should and can capture with the same piece, we should not change the turn
 		if had_to_capture and self.check_should_capture(self.__turn_sign) and \
 				next(self.get_correct_moves(end), None):
+			self.__zobrist = zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture)
 			return ret
 		
 		# 	Otherwise, change the turn
 		self.__turn_sign = -self.__turn_sign
+		self.__zobrist = zobrist ^ _zobrist_flags(self.__turn_sign, self.__should_capture)
+		return ret
+
+	@staticmethod
+	def __affected_squares(start: tuple[int, int], end: tuple[int, int], captured: bool) -> frozenset[int]:
+		affected = _AFFECTED[_INDEX[start[0], start[1]]] | _AFFECTED[_INDEX[end[0], end[1]]]
+		if captured:
+			affected |= _AFFECTED[_INDEX[start[0] + _s(end[0] - start[0]), start[1] + _s(end[1] - start[1])]]
+		return affected
+
+	def undo_move(self, move: MoveResult) -> None:
+		"""
+		Rolls back the move, that `make_move` returned `move` for.
+		Moves should be undone in the reverse order they were made
+		"""
+
+		self.__invalidate_cache()
+
+		start, end = move.start, move.end
+		affected = self.__affected_squares(start, end, bool(move.captured))
+		for k in affected:
+			self.__count_moves(k, -1)
+
+		piece = self.__board[end[0]][end[1]]
+		if move.promoted:
+			piece = _s(piece)
+		self.__board[start[0]][start[1]] = piece
+		self.__board[end[0]][end[1]] = 0
+
+		if move.captured:
+			self.__board[start[0] + _s(end[0] - start[0])][start[1] + _s(end[1] - start[1])] = \
+				-_s(piece) * move.captured
+			self.__pieces_count[-_s(piece)] += 1
+
+		for k in affected:
+			self.__count_moves(k, 1)
+
+		self.__turn_sign = move.turn_sign
+		self.__moves_since_last_capture = move.moves_since_last_capture
+		self.__should_capture = move.should_capture or {1: False, -1: False}
+		self.__zobrist = move.zobrist
+
+	def copy(self) -> 'Board':
+		"""
+		Much cheaper alternative to `copy.deepcopy`, the copy shares nothing mutable and starts with empty caches
+		"""
+
+		ret = type(self).__new__(type(self))
+		ret.__board = [column[:] for column in self.__board]
+
+		ret.__should_capture = dict(self.__should_capture)
+		ret.__enable_update_should_capture = self.__enable_update_should_capture
+		ret.__moves_since_last_capture = self.__moves_since_last_capture
+
+		ret.__correct_moves_cache = {}
+		ret.__tensor_cache = {}
+		ret.__legal_moves_cache = self.__legal_moves_cache
+
+		ret.__turn_sign = self.__turn_sign
+		ret.__game_state_cache = self.__game_state_cache
+		ret.__zobrist = self.__zobrist
+
+		ret.__pieces_count = dict(self.__pieces_count)
+		ret.__captures_count = dict(self.__captures_count)
+		ret.__steps_count = dict(self.__steps_count)
 		return ret
 
 	@property
@@ -323,22 +480,19 @@ class Board():
 			return GameState.DRAW
 
 		turn_sign = self.__turn_sign
-		opp_turn_has_pieces = next(self.__get_possible_pos(-turn_sign), None)
-		turns_pieces = self.__get_possible_pos(turn_sign)
-		first_piece = next(turns_pieces, None)
-		
-		if not first_piece:
+		if not self.__pieces_count[turn_sign]:
 			return GameState(-turn_sign)
-		elif not opp_turn_has_pieces:
+		elif not self.__pieces_count[-turn_sign]:
 			return GameState(turn_sign)
 		
-		for pos in itertools.chain([first_piece], turns_pieces):
-			if next(self.get_correct_moves(pos), None):
-				return GameState.NOT_OVER
+		# Captures are always allowed, simple steps only if there is nothing to capture
+		if self.__captures_count[turn_sign] or \
+				(not self.check_should_capture(turn_sign) and self.__steps_count[turn_sign]):
+			return GameState.NOT_OVER
 		
 		return GameState(-turn_sign)
 
-	def __getitem__(self, pos: _c | tuple[int, int]) -> int:
+	def __getitem__(self, pos: tuple[int, int]) -> int:
 		return self.__board[pos[0]][pos[1]]
 
 	@property
@@ -364,6 +518,7 @@ class Board():
 			self.__update_should_capture()
 		elif not value:
 			self.__should_capture = {1: False, -1: False}
+		self.__zobrist = self.__compute_zobrist()
 
 	def __repr__(self) -> str:
 		ret = ""
@@ -379,10 +534,9 @@ class Board():
 			self.__should_capture[-1],
 			self.__should_capture[1]
 		]
-		pos = _c(0, 0)
-		for i in range(18):
-			arr.append(int(self[pos]) + 2)
-			pos = self.__faster_iteration_end(pos, i)
+		board = self.__board
+		for x, y in _SQUARES:
+			arr.append(board[x][y] + 2)
 		
 		return bytes(arr)
 
@@ -402,60 +556,79 @@ class Board():
 		"""
 		Returns pair pos and piece
 		"""
-		pos = _c(0, 0)
-		for i in range(18):
-			yield pos.tuple(), self[pos]
-			pos = self.__faster_iteration_end(pos, i)
+		for pos in _SQUARES:
+			yield pos, self[pos]
 
 	
 	@staticmethod
-	def __flip_board(board: list[list[int]]) -> list[list[int]]:
-		# https://stackoverflow.com/a/6473742/8302811
-		s = Board.SIZE - 1
-		return [
-			[
-				-board[s - x][s - y]
-				for y in range(Board.SIZE)
-			]
-			for x in range(Board.SIZE)
-		]
+	def to_tensor_batch(reprs: list[bytes], device, flipped: bool | list[bool] = False) -> torch.Tensor:
+		"""
+		Stacked `to_tensor` of many boards built at once, `reprs` are `bytes(board)` values.
+		`flipped` could be given for every board separately
+
+		Returns: tensor of shape (len(reprs), 90)
+		"""
+		codes = np.frombuffer(b"".join(reprs), dtype=np.uint8).reshape(len(reprs), -1)
+		return encode_batch(codes, device, flipped)
 
 	def to_tensor(self, device, flipped = False) -> torch.Tensor:
 		cache_index = (flipped, False)
-		if cache_index in self.__tensor_cache:
-			return self.__tensor_cache[cache_index].clone()
-		
-		self.__tensor_cache[cache_index] = torch.zeros(90, dtype=torch.float32, device=device)
-
-		board = self.__board
-		if flipped:
-			board = self.__flip_board(board)
-		
-		pos = _c(0, 0)
-		for i in range(18):
-			#       possition coding                   piece coding
-			index = ((pos.x + self.SIZE * pos.y) // 2) * 5 + (board[pos.x][pos.y] + 2)
-			self.__tensor_cache[cache_index][index] = 1
-			pos = self.__faster_iteration_end(pos, i)
+		if cache_index not in self.__tensor_cache:
+			self.__tensor_cache[cache_index] = encode_batch(
+				np.frombuffer(self.__bare_byte_repr(), dtype=np.uint8)[None], device, flipped
+			)[0]
 		return self.__tensor_cache[cache_index].clone()
 	
 	def to_tensor3d(self, device, flipped = False) -> torch.Tensor:
 		cache_index = (flipped, True)
-		if cache_index in self.__tensor_cache:
-			return self.__tensor_cache[cache_index].clone()
-		
-		self.__tensor_cache[cache_index] = torch.zeros(3, 6, 5, dtype=torch.float32, device=device)
-
-		board = self.__board
-		if flipped:
-			board = self.__flip_board(board)
-		
-		pos = _c(0, 0)
-		for i in range(18):
-			self.__tensor_cache[cache_index][pos.x // 2][pos.y][board[pos.x][pos.y] + 2] = 1
-			pos = self.__faster_iteration_end(pos, i)
+		if cache_index not in self.__tensor_cache:
+			self.__tensor_cache[cache_index] = encode_batch(
+				np.frombuffer(self.__bare_byte_repr(), dtype=np.uint8)[None], device, flipped, three_d=True
+			)[0]
 		return self.__tensor_cache[cache_index].clone()
-	
+
+	@property
+	def code(self) -> int:
+		"""
+		`int(board)` packed into 64 bits:
+		bits 0-17 - positive pieces, 18-35 - negative pieces, 36-53 - kings (squares in `__iter__` order),
+		bit 54 - positive turn, 55 / 56 - should capture of the negative / positive player
+		"""
+		ret = (self.__turn_sign == 1) << 54 | self.__should_capture[-1] << 55 | self.__should_capture[1] << 56
+		for k, (x, y) in enumerate(_SQUARES):
+			piece = self.__board[x][y]
+			if piece:
+				ret |= 1 << (k if piece > 0 else k + 18)
+				if abs(piece) == 2:
+					ret |= 1 << (k + 36)
+		return ret
+
+	@property
+	def zobrist(self) -> int:
+		"""
+		64-bit Zobrist key of the same state as `code` (pieces, turn and should capture flags),
+		kept up to date by `make_move` and `undo_move`
+		"""
+		return self.__zobrist
+
+	def __hash__(self) -> int:
+		# The key changes with every move, boards should not be moved while they are in a set or a dict
+		return self.__zobrist
+
+	def __eq__(self, other: object) -> bool:
+		# Same position, the draw counter is not compared, same as in `code`
+		if not isinstance(other, Board):
+			return NotImplemented
+		return self.zobrist == other.zobrist and self.code == other.code
+
+	@classmethod
+	def from_code(cls, code: int) -> 'Board':
+		arr = [code >> 54 & 1, code >> 55 & 1, code >> 56 & 1]
+		for k in range(18):
+			piece = (code >> k & 1) - (code >> (k + 18) & 1)
+			arr.append(piece * (1 + (code >> (k + 36) & 1)) + 2)
+		return cls.from_num_repr(int.from_bytes(bytes(arr), byteorder="big"))
+
 	@classmethod
 	def from_num_repr(cls, value: int | bytes) -> 'Board':
 		ret = cls()
@@ -473,17 +646,19 @@ class Board():
 		ret.__turn_sign = 1 if arr[0] else -1
 		ret.__should_capture = {1: bool(arr[2]), -1: bool(arr[1])}
 
-		pos = _c(0, 0)
-		for i in range(18):
-			ret.__board[pos.x][pos.y] = arr[i + 3] - 2
-			pos = cls.__faster_iteration_end(pos, i)
+		for k, (x, y) in enumerate(_SQUARES):
+			ret.__board[x][y] = arr[k + 3] - 2
+		ret.__recount()
+		ret.__game_state_cache = None
+		ret.__legal_moves_cache = None
+		ret.__zobrist = ret.__compute_zobrist()
 
 		return ret
 
 	# Debugging methods
 	def get_correct_moves_cache(self) -> dict[tuple[tuple[int, int], tuple[int, int]], bool]:
 		return {
-			(s.tuple(), e.tuple()): v
+			(s, e): v
 			for s in self.__correct_moves_cache
 			for e, v in self.__correct_moves_cache[s].items()
 		}
\ No newline at end of file
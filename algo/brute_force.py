@@ -1,49 +1,244 @@
-import copy
-import concurrent.futures
-import pickle
+"""
+Breadth-first enumeration of all the positions reachable from the starting one.
+
+	python -m algo.brute_force states --workers 8
+
+A position is a `Board.code` (pieces, turn and should capture flags, the draw counter is not a part of it).
+Layer d holds the positions first reached after d moves, frontiers are expanded in chunks by worker processes.
+
+The graph is written into the output directory as raw arrays, opened with `StateGraph`:
+* `codes.bin` - uint64 code of every node, nodes are numbered layer by layer, sorted by code within a layer
+* `offsets.bin`, `children.bin`, `actions.bin` - CSR edges, children of node i are
+`children[offsets[i]:offsets[i + 1]]`, reached with the `VectorBoard` actions at the same positions
+* `parent_offsets.bin`, `parents.bin` - the same for the parents, written when the enumeration is finished
+* `sorted_codes.bin`, `sorted_index.bin` - codes in sorted order and their node indexes, for lookups by code
+* `meta.json` - layer boundaries and sizes
+
+Every expanded layer is committed to `meta.json`, an interrupted enumeration continues from the last finished layer.
+"""
+
+import argparse
+import json
+import os
 import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+from .board import Board
+from .vector_board import VectorBoard
+
+def _expand(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Returns: number of children of every position, codes of the children and their actions
+	"""
+	boards = VectorBoard.from_codes(codes)
+	children = boards.children(np.arange(len(codes)))
+	return np.bincount(children.parent, minlength=len(codes)), children.codes(), children.action.astype(np.uint8)
+
+class StateGraph:
+	"""
+	Enumerated graph, all the arrays are memory mapped
+	"""
+
+	def __init__(self, path: PathLike | str) -> None:
+		self.path = Path(path)
+		with open(self.path / "meta.json") as f:
+			meta = json.load(f)
+
+		self.layers = np.array(meta["layers"], dtype=np.int64)
+		self.finished: bool = meta["finished"]
+		n_nodes = int(self.layers[-1])
+		n_expanded = int(self.layers[meta["expanded_layers"]])
+
+		self.codes = self.__open("codes", np.uint64, n_nodes)
+		self.offsets = self.__open("offsets", np.int64, n_expanded + 1)
+		self.children = self.__open("children", np.int64, meta["n_edges"])
+		self.actions = self.__open("actions", np.uint8, meta["n_edges"])
+		if self.finished:
+			self.parent_offsets = self.__open("parent_offsets", np.int64, n_nodes + 1)
+			self.parents = self.__open("parents", np.int64, meta["n_edges"])
+			self.sorted_codes = self.__open("sorted_codes", np.uint64, n_nodes)
+			self.sorted_index = self.__open("sorted_index", np.int64, n_nodes)
+
+	def __open(self, name: str, dtype, size: int) -> np.ndarray:
+		if not size:
+			return np.zeros(0, dtype=dtype)
+		return np.memmap(self.path / f"{name}.bin", dtype=dtype, mode="r", shape=(size,))
+
+	def __len__(self) -> int:
+		return len(self.codes)
+
+	def index(self, codes: np.ndarray) -> np.ndarray:
+		"""
+		Returns: node index of every code, -1 for the unknown ones
+		"""
+		codes = np.asarray(codes, dtype=np.uint64)
+		positions = np.minimum(np.searchsorted(self.sorted_codes, codes), len(self) - 1)
+		return np.where(self.sorted_codes[positions] == codes, self.sorted_index[positions], -1)
+
+	def depth(self, node: int) -> int:
+		return int(np.searchsorted(self.layers, node, side="right")) - 1
+
+	def children_of(self, node: int) -> np.ndarray:
+		return self.children[self.offsets[node]:self.offsets[node + 1]]
+
+	def parents_of(self, node: int) -> np.ndarray:
+		return self.parents[self.parent_offsets[node]:self.parent_offsets[node + 1]]
+
+	def board(self, node: int) -> Board:
+		return Board.from_code(int(self.codes[node]))
+
+class Enumerator:
+	def __init__(self, path: PathLike | str, chunk_size: int = 1 << 16, workers: Optional[int] = None, root: Optional[int] = None) -> None:
+		"""
+		`root` - code of the position to start from, the starting position by default.
+		It is only used by a new enumeration
+		"""
+		self.path = Path(path)
+		self.chunk_size = chunk_size
+		self.workers = workers
+		self.path.mkdir(parents=True, exist_ok=True)
+
+		if (self.path / "meta.json").exists():
+			with open(self.path / "meta.json") as f:
+				meta = json.load(f)
+		else:
+			meta = {"layers": [0, 1], "expanded_layers": 0, "n_edges": 0, "finished": False}
+			self.__write("codes", np.array([Board().code if root is None else root], dtype=np.uint64), "wb")
+			self.__write("offsets", np.zeros(1, dtype=np.int64), "wb")
+			for name in ("children", "actions"):
+				self.__write(name, np.zeros(0), "wb")
+			self.__save_meta(meta)
+
+		self.layers: list[int] = meta["layers"]
+		self.expanded_layers: int = meta["expanded_layers"]
+		self.n_edges: int = meta["n_edges"]
+		self.finished: bool = meta["finished"]
+
+		# Anything written after the last committed layer is thrown away
+		for name, itemsize, size in (
+			("codes", 8, self.layers[-1]),
+			("offsets", 8, self.layers[self.expanded_layers] + 1),
+			("children", 8, self.n_edges),
+			("actions", 1, self.n_edges),
+		):
+			os.truncate(self.path / f"{name}.bin", itemsize * size)
+
+		codes = self.__read("codes", np.uint64)
+		order = np.argsort(codes, kind="stable")
+		self.seen_codes = codes[order]
+		self.seen_index = order.astype(np.int64)
+
+	def __read(self, name: str, dtype) -> np.ndarray:
+		return np.fromfile(self.path / f"{name}.bin", dtype=dtype)
+
+	def __write(self, name: str, values: np.ndarray, mode: str = "ab") -> None:
+		with open(self.path / f"{name}.bin", mode) as f:
+			values.tofile(f)
+			f.flush()
+			os.fsync(f.fileno())
+
+	def __save_meta(self, meta: dict) -> None:
+		# Written aside first, so an interrupted run never leaves a broken file
+		with open(self.path / "meta.json.tmp", "w") as f:
+			json.dump(meta, f)
+		os.replace(self.path / "meta.json.tmp", self.path / "meta.json")
+
+	def __commit(self) -> None:
+		self.__save_meta({
+			"layers": self.layers,
+			"expanded_layers": self.expanded_layers,
+			"n_edges": self.n_edges,
+			"finished": self.finished,
+		})
+
+	def __expand_layer(self, executor: ProcessPoolExecutor) -> None:
+		start, stop = self.layers[self.expanded_layers], self.layers[self.expanded_layers + 1]
+		frontier = np.fromfile(self.path / "codes.bin", dtype=np.uint64, count=stop - start, offset=8 * start)
+		chunks = [frontier[i:i + self.chunk_size] for i in range(0, len(frontier), self.chunk_size)]
+		# `map` keeps the order of the chunks, so the edges are written in the order of the nodes
+		results = list(executor.map(_expand, chunks))
+
+		counts = np.concatenate([result[0] for result in results])
+		child_codes = np.concatenate([result[1] for result in results])
+		actions = np.concatenate([result[2] for result in results])
+
+		# Positions not seen before form the next layer, numbered in the order of their codes
+		unique_codes = np.unique(child_codes)
+		positions = np.searchsorted(self.seen_codes, unique_codes)
+		known = self.seen_codes[np.minimum(positions, len(self.seen_codes) - 1)] == unique_codes
+		new_codes = unique_codes[~known]
+		new_index = np.arange(self.layers[-1], self.layers[-1] + len(new_codes), dtype=np.int64)
+
+		insert_at = positions[~known]
+		self.seen_codes = np.insert(self.seen_codes, insert_at, new_codes)
+		self.seen_index = np.insert(self.seen_index, insert_at, new_index)
+		children = self.seen_index[np.searchsorted(self.seen_codes, child_codes)]
+
+		self.__write("codes", new_codes)
+		self.__write("offsets", self.n_edges + np.cumsum(counts))
+		self.__write("children", children)
+		self.__write("actions", actions)
+
+		self.layers.append(self.layers[-1] + len(new_codes))
+		self.expanded_layers += 1
+		self.n_edges += len(children)
+		self.__commit()
+
+	def __finish(self) -> None:
+		n_nodes = self.layers[-1]
+		offsets = self.__read("offsets", np.int64)
+		children = self.__read("children", np.int64)
+
+		sources = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(offsets))
+		order = np.argsort(children, kind="stable")
+		self.__write("parent_offsets", np.concatenate([[0], np.cumsum(np.bincount(children, minlength=n_nodes))]), "wb")
+		self.__write("parents", sources[order], "wb")
+		self.__write("sorted_codes", self.seen_codes, "wb")
+		self.__write("sorted_index", self.seen_index, "wb")
+
+		self.finished = True
+		self.__commit()
+
+	def run(self, max_layers: Optional[int] = None, verbose: bool = True) -> None:
+		"""
+		Expands layers until there is nothing left, or `max_layers` layers were expanded by this call
+		"""
+		with ProcessPoolExecutor(self.workers) as executor:
+			expanded = 0
+			while not self.finished and (max_layers is None or expanded < max_layers):
+				if self.layers[-1] == self.layers[self.expanded_layers]:
+					self.__finish()
+					break
+
+				layer_time = time.perf_counter()
+				frontier = self.layers[self.expanded_layers + 1] - self.layers[self.expanded_layers]
+				self.__expand_layer(executor)
+				expanded += 1
 
-from board import Board, GameState
+				if verbose:
+					layer_time = time.perf_counter() - layer_time
+					print(
+						f"layer {self.expanded_layers - 1}: {frontier} states expanded, "
+						f"{self.layers[-1] - self.layers[-2]} new, {self.layers[-1]} total, {self.n_edges} edges, "
+						f"{frontier / layer_time:.0f} states/s",
+						flush=True
+					)
 
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Enumerates all the reachable positions")
+	parser.add_argument("output", nargs="?", default="states")
+	parser.add_argument("--chunk-size", type=int, default=1 << 16, help="positions expanded by a worker at once")
+	parser.add_argument("--workers", type=int, default=None)
+	parser.add_argument("--max-layers", type=int, default=None, help="stop after expanding this many layers")
+	parser.add_argument("--root", type=lambda value: int(value, 0), default=None, help="code of the position to start from")
+	args = parser.parse_args()
 
-def process_board(board_int: int, board: Board, depth: int) -> tuple[int, list[tuple[int, Board]], int]:
-	possible_moves: list[tuple[int, Board]] = []
-	for start in board.get_possible_pos():
-		for end in board.get_correct_moves(start):
-			new_board = copy.deepcopy(board)
-			new_board.make_move(start, end)
-			possible_moves.append((int(new_board), new_board))
-	
-	return board_int, possible_moves, depth
+	Enumerator(args.output, args.chunk_size, args.workers, args.root).run(args.max_layers)
 
 if __name__ == "__main__":
-	executor = concurrent.futures.ProcessPoolExecutor(max_workers=8)
-	root_board = Board()
-	jobs = [executor.submit(process_board, int(root_board), root_board, 0)]
-	parent_tree: dict[int, set[int]] = {}
-	depths: dict[int, int] = {}
-	prev_len = 0
-
-	while jobs:
-		last_job = jobs.pop()
-
-		parent_board_int, possible_moves, depth = last_job.result()
-		depths[depth] = depths.get(depth, 0) + 1
-		for child_board_int, child_board in possible_moves:
-			if child_board_int in parent_tree:
-				parent_tree[child_board_int].add(parent_board_int)
-				continue
-
-			parent_tree[child_board_int] = {parent_board_int}
-
-			if child_board.game_state == GameState.NOT_OVER:
-				jobs.append(executor.submit(process_board, child_board_int, child_board, depth + 1))
-
-		l = len(parent_tree)
-		if l - prev_len > 5e4:
-			prev_len = l
-			print(len(parent_tree), len(jobs), time.strftime("%H:%M:%S"), depths)
-			with open("parent_tree.pickle", "wb") as f:
-				pickle.dump(parent_tree, f)
-
-	print(len(parent_tree))
+	main()
@@ -2,12 +2,18 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+import numpy as np
+
 import copy
 import pathlib
-from dataclasses import dataclass
+
+from typing import Optional
 
 from . import iplayer
+from .vector_board import VectorBoard, VectorChildren, segment_argmax
+from .encoding import encode_batch
 from .board import Board, GameState, MoveResult
+from .replay import ReplayBatch
 
 class QLearning(iplayer.IPlayer):
 	class DQN(nn.Module):
@@ -57,20 +63,25 @@ class QLearning(iplayer.IPlayer):
 			self.device = device
 
 		def forward(self, board: Board) -> torch.Tensor:
-			state = board.to_tensor(
+			return self.forward_tensor(board.to_tensor(
 				self.device,
-				board.turn_sign != -1
-			)
+				self.is_flipped(board)
+			))
+
+		def forward_tensor(self, state: torch.Tensor) -> torch.Tensor:
+			"""Works both for a single encoded board and for a batch of them"""
 			for layer in self.layers[:-1]:
 				state = F.relu(layer(state))
 			return self.layers[-1](state)
-	
-	@dataclass
-	class Action:
-		action: tuple[tuple[int, int], tuple[int, int]]
-		value: torch.Tensor
+
+		@staticmethod
+		def is_flipped(board: Board) -> bool:
+			return board.turn_sign != -1
 		
-	def __init__(self, model_path: str = "ddqn87 90 50 50 1 q_1 tuned on ddqn86.pth", layer_sizes: list[int] = [90, 50, 50, 1]) -> None:
+	def __init__(self, model_path: str = "ddqn87 90 50 50 1 q_1 tuned on ddqn86.pth", layer_sizes: list[int] = [90, 50, 50, 1], state_dict: Optional[dict] = None) -> None:
+		"""
+		`state_dict` - weights already loaded from `model_path`, the model uses them instead of copies
+		"""
 		super().__init__()
 
 		self.__model_path = model_path
@@ -79,7 +90,10 @@ class QLearning(iplayer.IPlayer):
 
 		self.device = torch.device("cpu")
 		self.model = self.DQN(device=self.device, layer_sizes=layer_sizes)
-		self.model.load_state_dict(torch.load(model_path))
+		if state_dict is None:
+			self.model.load_state_dict(torch.load(model_path))
+		else:
+			self.model.load_state_dict(state_dict, assign=True)
 
 	@staticmethod
 	def move_result_to_reward(move_result: MoveResult) -> float:
@@ -89,18 +103,150 @@ class QLearning(iplayer.IPlayer):
 	def state_to_reward(state: Board) -> float:
 		return -2 * (state.moves_since_last_capture > 5)
 	
+	def evaluate_moves(self, board: Board) -> tuple[list[tuple[tuple[int, int], tuple[int, int]]], torch.Tensor]:
+		"""
+		Returns all correct moves and their values, computed with a single forward pass
+		"""
+		moves: list[tuple[tuple[int, int], tuple[int, int]]] = []
+		children: list[bytes] = []
+		flipped: list[bool] = []
+		immediate_rewards: list[float] = []
+
+		# Children are visited in place on a single copy of the board
+		next_state = board.copy()
+		for s, e in map(Board.decode_move, board.legal_moves().tolist()):
+			move = next_state.make_move(s, e)
+			immediate_rewards.append(
+				self.move_result_to_reward(move) + 
+				self.state_to_reward(next_state)
+			)
+			children.append(bytes(next_state))
+			flipped.append(self.DQN.is_flipped(next_state))
+			next_state.undo_move(move)
+			moves.append((s, e))
+
+		with torch.inference_mode():
+			values = self.model.forward_tensor(Board.to_tensor_batch(children, self.device, flipped)).view(-1)
+			values = values * self.DQN.GAMMA + torch.tensor(immediate_rewards, device=self.device)
+		return moves, values
+
 	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
-		ret: list[QLearning.Action] = []
-		for s in board.get_possible_pos():
-			for e in board.get_correct_moves(s):
-				next_state = copy.deepcopy(board)
-				immediate_reward = torch.tensor([
-					self.move_result_to_reward(next_state.make_move(s, e)) + 
-					self.state_to_reward(next_state)
-				], device=self.device)
-				value = self.model(next_state) * self.DQN.GAMMA + immediate_reward
-				ret.append(self.Action((s, e), value))
-		return max(ret, key=lambda x: x.value.item()).action
+		moves, values = self.evaluate_moves(board)
+		return moves[int(values.argmax())]
+
+	def evaluate_children(self, boards: VectorBoard, games: np.ndarray) -> tuple[VectorChildren, torch.Tensor]:
+		"""
+		Batched `evaluate_moves` of the given games, computed with a single forward pass
+
+		Returns: all the children of the games and their values
+		"""
+		children = boards.children(games)
+		with torch.inference_mode():
+			values = self.children_values(self.model, children)
+		return children, values
+
+	@staticmethod
+	def children_values(model: 'QLearning.DQN', children: VectorChildren) -> torch.Tensor:
+		"""
+		Values of the moves into the children, as `evaluate_moves` computes them, with a single forward pass
+
+		Returns: value of every child
+		"""
+		immediate_rewards = children.captured + children.promoted * 2 - 2 * (children.moves_since_last_capture > 5)
+		# Same as `DQN.is_flipped` for every child
+		flipped = children.turn != -1
+
+		values = model.forward_tensor(encode_batch(children.pieces + 2, model.device, flipped)).view(-1)
+		return values * QLearning.DQN.GAMMA + torch.from_numpy(immediate_rewards.astype(np.float32)).to(model.device)
+
+	def decide_moves(self, boards: VectorBoard, games: np.ndarray) -> np.ndarray:
+		children, values = self.evaluate_children(boards, games)
+		best = segment_argmax(values, torch.from_numpy(children.parent).to(self.device), len(games))
+		return children.action[best.cpu().numpy()]
 
 	def __str__(self) -> str:
-		return f"{self.__model_file_name} ({self.__layer_sizes})"
\ No newline at end of file
+		return f"{self.__model_file_name} ({self.__layer_sizes})"
+
+class DDQNTrainer:
+	"""
+	Double Q-learning steps over `ReplayBuffer` batches, with the targets of `jupyter/double_q_learning.ipynb`:
+	the target net picks the best move after the enemy's reply and the online net values it.
+
+	All the children of all the sampled states go through one forward pass of the online net
+	and the children of the next states through one pass of the target net, instead of a pass per child
+	"""
+
+	def __init__(
+		self,
+		online: QLearning.DQN,
+		target: Optional[QLearning.DQN] = None,
+		lr: float = 1e-4,
+		tau: float = 0.006,
+		grad_clip: float = 100.
+	) -> None:
+		"""
+		`target` - copy of `online` by default, it is only changed by `soft_update`
+		"""
+		self.online = online
+		self.target = copy.deepcopy(online) if target is None else target
+		for param in self.target.parameters():
+			param.requires_grad = False
+
+		self.tau = tau
+		self.grad_clip = grad_clip
+		self.optimizer = torch.optim.AdamW(online.parameters(), lr=lr, amsgrad=True)
+
+	def optimize(self, batch: ReplayBatch) -> torch.Tensor:
+		"""
+		One gradient step of the online net, the loss of every transition is weighted by `batch.weights`
+
+		Returns: TD errors of the transitions, for `ReplayBuffer.update_priorities`
+		"""
+		device = self.online.device
+		n = len(batch.codes)
+		dones = batch.dones.cpu().numpy()
+
+		# The sampled states and the next states of the unfinished transitions share a single `VectorBoard`
+		boards = VectorBoard.from_codes(
+			np.concatenate([batch.codes, batch.next_codes]),
+			np.concatenate([batch.moves_since_last_capture, batch.next_moves_since_last_capture])
+		)
+		games = np.concatenate([np.arange(n), n + np.flatnonzero(~dones)])
+		children = boards.children(games)
+		values = QLearning.children_values(self.online, children)
+
+		# Value of the move that was made in every sampled state, children are ordered by their parent
+		own = np.flatnonzero(children.parent < n)
+		taken = own[children.action[own] == batch.actions.cpu().numpy()[children.parent[own]]]
+		if len(taken) != n:
+			raise ValueError("Some of the sampled actions are not correct moves")
+		q_values = values[torch.from_numpy(taken).to(device)]
+
+		# Finished games are worth nothing after their last reward
+		next_values = torch.zeros(n, device=device)
+		next_children = np.flatnonzero(children.parent >= n)
+		if len(next_children):
+			with torch.no_grad():
+				target_values = QLearning.children_values(self.target, children[next_children])
+				segments = torch.from_numpy(children.parent[next_children] - n).to(device)
+				best = segment_argmax(target_values, segments, len(games) - n)
+				chosen = torch.from_numpy(next_children).to(device)[best]
+				next_values[torch.from_numpy(np.flatnonzero(~dones)).to(device)] = values.detach()[chosen]
+
+		expected = next_values * QLearning.DQN.GAMMA + batch.rewards
+		errors = q_values - expected
+		loss = (batch.weights * errors ** 2).mean()
+
+		self.optimizer.zero_grad()
+		loss.backward()
+		torch.nn.utils.clip_grad_value_(self.online.parameters(), self.grad_clip)
+		self.optimizer.step()
+		return errors.detach()
+
+	def soft_update(self) -> None:
+		"""
+		Moves the target net `tau` of the way to the online one
+		"""
+		with torch.no_grad():
+			for target, online in zip(self.target.parameters(), self.online.parameters()):
+				target.mul_(1 - self.tau).add_(online, alpha=self.tau)
@@ -1,26 +1,145 @@
+"""
+The dynamic programming agent, its values of the moves are learned from the outcomes of the games.
+
+	python -m algo.dynamicProgramming models/dynamic_learning_agent
+
+converts a table pickled by the old `save_model` (`<path>.dynamicProgrammingSave`) into the columnar format
+(`<path>.dynamicTable`), which is memory mapped by `load_model` instead of unpickled.
+"""
+
 from . import iplayer
 
+import argparse
 import math
+import os
+import shutil
+import numpy as np
 from .board import Board, _s
+from .vector_board import VectorBoard
 
 import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+class DynamicTable:
+	"""
+	Saved values of the moves, in memory mapped columns sorted by the state and then by the move:
+	* `keys.bin` (uint64) - `Board.code` of the state
+	* `moves.bin` (uint8) - `VectorBoard` action of the move
+	* `values.bin` (float32) - value of the move
+	"""
+
+	def __init__(self, path: os.PathLike | str) -> None:
+		self.path = Path(path)
+		self.keys = self.__open("keys", np.uint64)
+		self.moves = self.__open("moves", np.uint8)
+		self.values = self.__open("values", np.float32)
+
+	def __open(self, name: str, dtype) -> np.ndarray:
+		size = os.path.getsize(self.path / f"{name}.bin") // np.dtype(dtype).itemsize
+		if not size:
+			return np.zeros(0, dtype=dtype)
+		return np.memmap(self.path / f"{name}.bin", dtype=dtype, mode="r", shape=(size,))
+
+	def __len__(self) -> int:
+		return len(self.keys)
+
+	def lookup(self, code: int) -> dict[int, float]:
+		"""
+		Returns: values of the saved moves of the state by their actions
+		"""
+		key = np.uint64(code)
+		start, end = int(np.searchsorted(self.keys, key, "left")), int(np.searchsorted(self.keys, key, "right"))
+		return dict(zip(self.moves[start:end].tolist(), self.values[start:end].tolist()))
+
+	@staticmethod
+	def write(path: os.PathLike | str, keys: np.ndarray, moves: np.ndarray, values: np.ndarray) -> None:
+		"""
+		Writes the columns in the sorted order, replacing the table at `path` only once they are all written
+		"""
+		path = Path(path)
+		order = np.lexsort((moves, keys))
+		tmp_path = path.with_name(path.name + ".tmp")
+		shutil.rmtree(tmp_path, ignore_errors=True)
+		tmp_path.mkdir(parents=True)
+		np.asarray(keys, dtype=np.uint64)[order].tofile(tmp_path / "keys.bin")
+		np.asarray(moves, dtype=np.uint8)[order].tofile(tmp_path / "moves.bin")
+		np.asarray(values, dtype=np.float32)[order].tofile(tmp_path / "values.bin")
+
+		# A directory could not replace a non-empty one, the old table is moved away first
+		old_path = path.with_name(path.name + ".old")
+		shutil.rmtree(old_path, ignore_errors=True)
+		if path.exists():
+			os.replace(path, old_path)
+		os.replace(tmp_path, path)
+		shutil.rmtree(old_path, ignore_errors=True)
+
+def _merge(table: Optional[DynamicTable], overlay: dict[tuple[int, int], float]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	# Columns of the table with the values of the overlay, which win over the saved ones
+	keys = np.array([key for key, _ in overlay], dtype=np.uint64)
+	moves = np.array([move for _, move in overlay], dtype=np.uint8)
+	values = np.array(list(overlay.values()), dtype=np.float32)
+	if table is not None:
+		keys = np.concatenate([keys, table.keys])
+		moves = np.concatenate([moves, table.moves])
+		values = np.concatenate([values, table.values])
+	# Actions fit into 7 bits and the codes into 57, `np.unique` keeps the first (overlay) value of every move
+	_, first = np.unique(keys << np.uint64(7) | moves.astype(np.uint64), return_index=True)
+	return keys[first], moves[first], values[first]
+
+def _pickle_to_moves(old: dict) -> dict[tuple[int, int], float]:
+	# Keys of the old pickled tables are (int(board), turn sign, start, end)
+	return {
+		(Board.from_num_repr(board_int).code, VectorBoard.action(start, end)): value
+		for (board_int, _, start, end), value in old.items()
+	}
+
+def convert(path: str) -> int:
+	"""
+	Converts `<path>.dynamicProgrammingSave` into `<path>.dynamicTable`
+
+	Returns: number of the converted moves
+	"""
+	with open(path + ".dynamicProgrammingSave", "rb") as f:
+		moves = _pickle_to_moves(pickle.load(f))
+	DynamicTable.write(path + ".dynamicTable", *_merge(None, moves))
+	return len(moves)
+
+# Table every training worker process starts its shards from, set once by `_init_shard_worker`
+_shard_table: Optional[DynamicTable] = None
+_shard_overlay: dict = {}
 
-class dynamicPlayer(iplayer.IRandomPlayer, iplayer.ITrainablePlayer):
+def _init_shard_worker(table_path: Optional[str], overlay: dict) -> None:
+	global _shard_table, _shard_overlay
+	_shard_table = None if table_path is None else DynamicTable(table_path)
+	_shard_overlay = overlay
+
+def _train_shard(seed: int, rounds: int, enemy_factory: Callable[[int], iplayer.IPlayer]) -> dict:
+	# Returns the value deltas of the shard
+	player = dynamicPlayer(startFresh=True, seed=seed)
+	player.table = _shard_table
+	player.memoryArr = dict(_shard_overlay)
+	enemy = enemy_factory(seed)
+	for _ in range(rounds):
+		player.do_training_round(enemy, 1)
+		player.do_training_round(enemy, -1)
+	return player.deltas
+
+class dynamicPlayer(iplayer.IRandomPlayer, iplayer.IParallelTrainablePlayer):
 	
 	# here is a dictionary we have, the first keys are the states of the game and the second keys are the moves that can be made from that state and then finally the value of the moves that can be max 100.
+	# the saved values are in `table`, the dictionary only holds the values changed since it was loaded.
 	"""
 	{
 		(
-			board_config,
-			turn_sign,
-			from,
-			to
+			Board.code,
+			VectorBoard action
 		):
 		value
 	}
 	"""
-	mem_key_type = tuple[int, int, tuple[int, int], tuple[int, int]]
-	memoryArr: dict[mem_key_type, float] = {}
+	mem_key_type = tuple[int, int]
 	
 	# here is how a game board usually looks like:
 		# 	self.__board: np.ndarray[tuple[int, int], np.dtype[np.int8]] = np.array([
@@ -34,6 +153,11 @@ class dynamicPlayer(iplayer.IRandomPlayer, iplayer.ITrainablePlayer):
 	
 	def __init__(self, startFresh:bool = False, seed:int = 0) -> None:
 		iplayer.IRandomPlayer.__init__(self, seed)
+		# every player has its own table, so that the training shards do not step on each other.
+		self.memoryArr: dict[dynamicPlayer.mem_key_type, float] = {}
+		self.table: Optional[DynamicTable] = None
+		# changes of the values made by this player's training, summed up by `join`.
+		self.deltas: dict[dynamicPlayer.mem_key_type, float] = {}
 		if startFresh:
 			# since we are doing a fresh start, we will create a new memory array full of all possible states and moves and give them a value of 100.
 			# we get a new Board object to get the possible states and moves.
@@ -46,19 +170,15 @@ class dynamicPlayer(iplayer.IRandomPlayer, iplayer.ITrainablePlayer):
 
 
 	def decide_move(self, board: iplayer.Board) -> tuple[tuple[int, int], tuple[int, int]]:
-		board_int = int(board)
-		turn_sign = board.turn_sign
-		possible_moves: list[tuple[float, tuple[tuple[int, int], tuple[int, int]]]] = [
-			(
-				math.exp(self.memoryArr.get(
-					(board_int, turn_sign, start, end),
-					0.
-				)),
+		code = board.code
+		saved = self.table.lookup(code) if self.table is not None else {}
+		possible_moves: list[tuple[float, tuple[tuple[int, int], tuple[int, int]]]] = []
+		for start, end in map(Board.decode_move, board.legal_moves().tolist()):
+			action = VectorBoard.action(start, end)
+			possible_moves.append((
+				math.exp(self.memoryArr.get((code, action), saved.get(action, 0.))),
 				(start, end)
-			)
-			for start in board.get_possible_pos()
-			for end in board.get_correct_moves(start)
-		]
+			))
 
 		exponents, moves = zip(*possible_moves)
 		r = self.random.random() * sum(exponents)
@@ -93,7 +213,7 @@ class dynamicPlayer(iplayer.IRandomPlayer, iplayer.ITrainablePlayer):
 		# we will play the game until it ends:
 		for player in player_order():
 			start,end = player.decide_move(board)
-			movesMade.add((int(board), board.turn_sign, start, end))
+			movesMade.add((board.code, VectorBoard.action(start, end), board.turn_sign))
 			board.make_move(start,end)
 			if board.game_state.value != 0:
 				break
@@ -101,31 +221,96 @@ class dynamicPlayer(iplayer.IRandomPlayer, iplayer.ITrainablePlayer):
 		abs_delta = 20 * 0.9 ** len(movesMade)
 		if board.game_state.value != -2:
 			delta = _s(board.game_state.value) * bot_sign * abs_delta
-			for move in movesMade:
-				if move not in self.memoryArr:
-					self.memoryArr[move] = 0
-				self.memoryArr[move] += delta * move[1]
+			for code, action, turn_sign in movesMade:
+				self.__add((code, action), delta * turn_sign)
 		else:
-			for move in movesMade:
-				if move not in self.memoryArr:
-					self.memoryArr[move] = 0
-				self.memoryArr[move] -= abs_delta
+			for code, action, _ in movesMade:
+				self.__add((code, action), -abs_delta)
 		# we will save the memory array to a file:
 		# self.saveTraining("")
 	
+	def value(self, move: mem_key_type) -> float:
+		if move in self.memoryArr:
+			return self.memoryArr[move]
+		if self.table is not None:
+			return self.table.lookup(move[0]).get(move[1], 0.)
+		return 0.
+
+	def __add(self, move: mem_key_type, delta: float) -> None:
+		self.memoryArr[move] = self.value(move) + delta
+		self.deltas[move] = self.deltas.get(move, 0) + delta
+
+	@staticmethod
+	def join(models: list['dynamicPlayer']) -> 'dynamicPlayer':
+		"""
+		The table of the first model is taken as it is and the deltas of the rest are added to it,
+		so they should have started from the table of the first one. The sum goes in the order of the models
+
+		Returns: a new player with the merged table
+		"""
+		ret = dynamicPlayer(startFresh=True, seed=models[0].seed)
+		ret.table = models[0].table
+		ret.memoryArr = dict(models[0].memoryArr)
+		ret.deltas = dict(models[0].deltas)
+		for model in models[1:]:
+			for move, delta in model.deltas.items():
+				ret.__add(move, delta)
+		return ret
+
+	def train_parallel(self, seeds: list[int], rounds: int,
+			enemy_factory: Callable[[int], iplayer.IPlayer] = iplayer.RandomPlayer, workers: Optional[int] = None) -> None:
+		"""
+		Trains a shard of `rounds` rounds (a game on each side) for every seed in worker processes,
+		all of them starting from the current table, and joins them into this player.
+		`enemy_factory` - picklable function creating the enemy of a shard from its seed.
+		The result only depends on the table and the seeds, not on the number of workers
+		"""
+		# workers open the saved table themselves, only the changed values are sent to them
+		table_path = None if self.table is None else str(self.table.path)
+		with ProcessPoolExecutor(workers, initializer=_init_shard_worker, initargs=(table_path, self.memoryArr)) as executor:
+			shards = list(executor.map(_train_shard, seeds, [rounds] * len(seeds), [enemy_factory] * len(seeds)))
+
+		trained = []
+		for seed, deltas in zip(seeds, shards):
+			shard = dynamicPlayer(startFresh=True, seed=seed)
+			shard.deltas = deltas
+			trained.append(shard)
+		joined = self.join([self] + trained)
+		self.memoryArr, self.deltas = joined.memoryArr, joined.deltas
+
 	def save_model(self, path: str) -> None:
 		path = path or "dynamic_learning_agent"
-		with open(path+".dynamicProgrammingSave", "wb") as f:
-			pickle.dump(self.memoryArr, f)
+		DynamicTable.write(path + ".dynamicTable", *_merge(self.table, self.memoryArr))
+		# the saved table already has all the changed values.
+		self.table = DynamicTable(path + ".dynamicTable")
+		self.memoryArr = {}
 			
 	def load_model(self, path: str) -> bool:
 		path = path or "dynamic_learning_agent"
-		try:
-			with open(path+".dynamicProgrammingSave", "rb") as f:
-				self.memoryArr = pickle.load(f)
-			return True
-		except FileNotFoundError:
-			return False
+		if os.path.isdir(path + ".dynamicTable"):
+			self.table = DynamicTable(path + ".dynamicTable")
+			self.memoryArr = {}
+		else:
+			# tables saved before the columnar format are still read, `convert` saves them in it.
+			try:
+				with open(path+".dynamicProgrammingSave", "rb") as f:
+					self.memoryArr = _pickle_to_moves(pickle.load(f))
+			except FileNotFoundError:
+				return False
+			self.table = None
+		self.deltas = {}
+		return True
 	
 	def __str__(self) -> str:
-		return "Dynamic Learning Agent"
\ No newline at end of file
+		return "Dynamic Learning Agent"
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Converts pickled dynamic player tables into the columnar format")
+	parser.add_argument("paths", nargs="+", help="save paths without the .dynamicProgrammingSave suffix")
+	args = parser.parse_args()
+
+	for path in args.paths:
+		print(f"{path}: {convert(path)} moves")
+
+if __name__ == "__main__":
+	main()
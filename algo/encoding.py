@@ -0,0 +1,52 @@
+"""
+Vectorised one-hot encoding of many boards at once.
+
+Boards are given packed, as a batch of either
+* `Board.code` values - array of shape (B,) of 64-bit integers
+* `int(board)` bytes - array of shape (B, 21) of uint8 (`bytes(board)`, shape (B, 23), works as well)
+
+The result is the same as stacking `Board.to_tensor` / `Board.to_tensor3d` of every board.
+"""
+
+import numpy as np
+import torch
+
+_K = torch.arange(18)
+# Index of square k in the flattened `to_tensor` and `to_tensor3d` layouts
+_INDEX_2D = _K * 5
+_INDEX_3D = (_K % 3) * 30 + (_K // 3) * 5
+
+def pieces(codes: np.ndarray | torch.Tensor) -> torch.Tensor:
+	"""
+	Returns: tensor of shape (B, 18) with `piece + 2` of every square
+	"""
+	if isinstance(codes, np.ndarray):
+		# Codes fit into 57 bits and torch is much happier with signed integers
+		codes = torch.from_numpy(codes.astype(np.int64))
+
+	if codes.dim() == 1:
+		codes = codes.long()[:, None]
+		positive = (codes >> _K) & 1
+		negative = (codes >> (_K + 18)) & 1
+		kings = (codes >> (_K + 36)) & 1
+		return 2 + (positive - negative) * (1 + kings)
+
+	# The pieces are always the last 18 bytes
+	return codes[:, -18:].long()
+
+def encode_batch(codes: np.ndarray | torch.Tensor, device, flipped: bool | list[bool] | np.ndarray | torch.Tensor = False, three_d: bool = False) -> torch.Tensor:
+	"""
+	`flipped` could be given for every board separately
+
+	Returns: tensor of shape (B, 90), or (B, 3, 6, 5) if `three_d`
+	"""
+	digits = pieces(codes)
+	n = digits.shape[0]
+
+	flipped_rows = torch.as_tensor(flipped, dtype=torch.bool).expand(n)
+	# Rotating the board by 180 degrees maps square k onto 17 - k and negates the pieces
+	digits = torch.where(flipped_rows[:, None], 4 - digits.flip(1), digits)
+
+	index = digits + (_INDEX_3D if three_d else _INDEX_2D)
+	ret = torch.zeros(n, 90, dtype=torch.float32, device=device).scatter_(1, index.to(device), 1)
+	return ret.view(n, 3, 6, 5) if three_d else ret
@@ -1,17 +1,19 @@
 import random
+import numpy as np
 from abc import ABC, abstractmethod
 from typing import Callable
 from os import PathLike
 
 from .board import Board, GameState
+from .vector_board import VectorBoard
 
 class IPlayer(ABC):
 	@abstractmethod
 	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
 		pass
 
-	def do_round(self, enemy: 'IPlayer') -> bool:
-		board = Board()
+	def do_round(self, enemy: 'IPlayer', board_type: type[Board] = Board) -> bool:
+		board = board_type()
 		while True:
 			if board.game_state != GameState.NOT_OVER:
 				return board.game_state == GameState.POSITIVE_WINS
@@ -23,6 +25,46 @@ class IPlayer(ABC):
 			s, e = enemy.decide_move(board)
 			board.make_move(s, e)
 
+	def decide_moves(self, boards: VectorBoard, games: np.ndarray) -> np.ndarray:
+		"""
+		Batched `decide_move` for the given games of `boards`, asks `decide_move` game by game unless overridden
+
+		Returns: `VectorBoard` action for every game
+		"""
+		return np.array([boards.action(*self.decide_move(boards.board(i))) for i in games], dtype=np.int64)
+
+	def do_rounds(self, enemy: 'IPlayer', n_games: int, n_parallel: int = 256) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Plays `n_games` games like `do_round`, `n_parallel` of them at once on a `VectorBoard`
+
+		Returns: final `GameState` value and number of moves of every game
+		"""
+		boards = VectorBoard(min(n_games, n_parallel))
+		active = np.ones(boards.n_games, dtype=bool)
+		started = boards.n_games
+		states: list[np.ndarray] = []
+		lengths: list[np.ndarray] = []
+
+		while active.any():
+			# Idle slots just make any correct move
+			actions = boards.legal_moves().argmax(1)
+			for player, sign in ((self, 1), (enemy, -1)):
+				games = np.flatnonzero(active & (boards.turn == sign))
+				if len(games):
+					actions[games] = player.decide_moves(boards, games)
+
+			result = boards.make_moves(actions)
+			finished = np.flatnonzero(active & (result.finished != GameState.NOT_OVER.value))
+			states.append(result.finished[finished])
+			lengths.append(result.lengths[finished])
+
+			# Reset slots start new games while there are games left
+			restarted = min(len(finished), n_games - started)
+			active[finished[restarted:]] = False
+			started += restarted
+
+		return np.concatenate(states), np.concatenate(lengths)
+
 class UserInput(IPlayer):
 	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
 		raise NotImplementedError("Should be handled by UI side")
@@ -53,19 +95,34 @@ class RandomPlayer(IRandomPlayer):
 		super().__init__(seed)
 
 	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
+		possible_ends: dict[tuple[int, int], list[tuple[int, int]]] = {}
+		for move in board.legal_moves().tolist():
+			start, end = Board.decode_move(move)
+			possible_ends.setdefault(start, []).append(end)
+
+		# All the pieces are shuffled, not only the ones that can move, so the random stream stays the same
 		possible_starts = list(board.get_possible_pos())
 		self.random.shuffle(possible_starts)
 
 		for start in possible_starts:
-			possible_ends_gen = board.get_correct_moves(start)
-			first_end = next(possible_ends_gen, None)
-			if not first_end:
-				continue
-			end = self.random.choice([first_end] + list(possible_ends_gen))
-			return start, end
+			if start in possible_ends:
+				return start, self.random.choice(possible_ends[start])
 		
 		raise ValueError("Tried to ask for a move when there are no possible moves")
 
+	def decide_moves(self, boards: VectorBoard, games: np.ndarray) -> np.ndarray:
+		# Same distribution as `decide_move`: a random piece that can move and then a random move of it
+		rng = np.random.default_rng(self.seed)
+
+		legal = boards.legal_moves()[games].reshape(-1, 18, 4)
+		movable = legal.any(2)
+		start = np.where(movable, rng.random(movable.shape), -1).argmax(1)
+		directions = legal[np.arange(len(games)), start]
+		direction = np.where(directions, rng.random(directions.shape), -1).argmax(1)
+
+		self.seed = int(rng.integers(0, 1<<16 - 1, endpoint=True))
+		return start * 4 + direction
+
 	def __str__(self) -> str:
 		return "Random player"
 	
@@ -0,0 +1,233 @@
+"""
+Round-robin league of all the models in a directory, rated with Elo.
+
+	python -m algo.league models -n 1000 -o testing/league.pkl
+
+Every `.pth` file takes part, with its layer sizes read from the checkpoint.
+Files named `ddqn*` are played as `ddq_learning.QLearning`, the rest as `q_learning.QLearning`.
+The random player takes part as well and anchors the ratings at `ANCHOR_RATING`.
+
+Every pair plays `n_games` games on each side, the first `--opening-plies` moves of every game are random
+(seeded like the shards). The trained players are deterministic, so without them a pair of models would play
+the same game on each side over and over, which tells no more than a single game. Results are stored by the hashes of the model files,
+so renamed models keep their results and adding a model only plays its own pairings.
+Byte-identical model files are a single participant, listed under all their names.
+The league file is updated after every shard, an interrupted league continues from it with the same command.
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from itertools import combinations
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Optional
+
+from .tournament import TournamentStats, model_layer_sizes, shard_sizes, _init_worker, _load_pickle, _play_shard
+
+ANCHOR_RATING = 1000.
+
+def file_hash(path: PathLike | str) -> str:
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()[:16]
+
+@dataclass
+class Participant:
+	name: str
+	spec: str
+	# Hash of the model file, results are stored by it
+	key: str
+
+def discover(models_dir: PathLike | str, include_random: bool = True) -> list[Participant]:
+	"""
+	Byte-identical model files are a single participant, named after all of them
+	"""
+	ret: dict[str, Participant] = {"random": Participant("Random player", "random", "random")} if include_random else {}
+	for path in sorted(Path(models_dir).glob("*.pth")):
+		key = file_hash(path)
+		if key in ret:
+			ret[key].name += f" = {path.stem}"
+			continue
+		kind = "ddqn" if path.name.startswith("ddqn") else "dqn"
+		layer_sizes = ",".join(str(size) for size in model_layer_sizes(path))
+		ret[key] = Participant(path.stem, f"{kind}:{path}:{layer_sizes}", key)
+	return list(ret.values())
+
+def _unique(participants: list[Participant]) -> list[Participant]:
+	# The first participant of every key
+	ret: dict[str, Participant] = {}
+	for participant in participants:
+		ret.setdefault(participant.key, participant)
+	return list(ret.values())
+
+@dataclass
+class League:
+	n_games: int
+	seed: int
+	shard_size: int
+	# Random moves at the start of every game, see `tournament.RandomOpening`
+	opening_plies: int = 0
+	# Results by (player key, enemy key, player sign), the player key is always the smaller one
+	results: dict[tuple[str, str, int], TournamentStats] = field(default_factory=dict)
+
+	def stats(self, player: Participant, enemy: Participant, sign: int) -> TournamentStats:
+		key = (player.key, enemy.key, sign)
+		if key not in self.results:
+			self.results[key] = TournamentStats(player.spec, enemy.spec, sign, self.seed, self.shard_size, self.opening_plies)
+		return self.results[key]
+
+	def ratings(self, participants: list[Participant]) -> dict[str, float]:
+		"""
+		Elo ratings of the participants fitted to all their results at once (Bradley-Terry model, draws count as half a win),
+		so they do not depend on the order the games were played in
+
+		Returns: rating by participant key
+		"""
+		participants = _unique(participants)
+		index = {participant.key: i for i, participant in enumerate(participants)}
+		n = len(participants)
+		scores = np.zeros((n, n))
+		games = np.zeros((n, n))
+		for (player, enemy, _), stats in self.results.items():
+			# Leagues played before the participants were deduplicated could have games of a model against itself
+			if player not in index or enemy not in index or player == enemy:
+				continue
+			i, j = index[player], index[enemy]
+			scores[i, j] += stats.wins + stats.draws / 2
+			scores[j, i] += stats.losses + stats.draws / 2
+			games[i, j] += stats.games
+			games[j, i] += stats.games
+
+		# A virtual draw in every pairing keeps the ratings finite for players without wins
+		played = games > 0
+		scores += played / 2
+		games += played
+
+		gammas = np.ones(n)
+		total_scores = scores.sum(1)
+		for _ in range(10000):
+			expected = (games / (gammas[:, None] + gammas[None, :])).sum(1)
+			new_gammas = np.where(expected > 0, total_scores / np.maximum(expected, 1e-12), 1.)
+			new_gammas /= np.exp(np.log(new_gammas).mean())
+			converged = np.abs(new_gammas - gammas).max() < 1e-10
+			gammas = new_gammas
+			if converged:
+				break
+
+		ratings = 400 * np.log10(gammas)
+		anchor = ratings[index["random"]] if "random" in index else ratings.mean()
+		return {participant.key: float(ratings[i] - anchor + ANCHOR_RATING) for i, participant in enumerate(participants)}
+
+	def table(self, participants: list[Participant]) -> str:
+		participants = _unique(participants)
+		ratings = self.ratings(participants)
+		rows = []
+		for participant in participants:
+			wins = draws = games = 0
+			for (player, enemy, _), stats in self.results.items():
+				if player not in ratings or enemy not in ratings or player == enemy:
+					continue
+				if participant.key == player:
+					wins, draws, games = wins + stats.wins, draws + stats.draws, games + stats.games
+				elif participant.key == enemy:
+					wins, draws, games = wins + stats.losses, draws + stats.draws, games + stats.games
+			score = (wins + draws / 2) / games if games else 0.
+			rows.append((ratings[participant.key], participant.name, score, games))
+
+		rows.sort(reverse=True)
+		return "\n".join(
+			f"{place:>3}. {rating:7.1f}  {score:8.3%}  {games:>8}  {name}"
+			for place, (rating, name, score, games) in enumerate(rows, 1)
+		)
+
+	def save(self, path: PathLike | str) -> None:
+		# Written aside first, so an interrupted league never leaves a broken file
+		tmp_path = f"{path}.tmp"
+		with open(tmp_path, "wb") as f:
+			pickle.dump(self, f)
+		os.replace(tmp_path, path)
+
+	@staticmethod
+	def load(path: PathLike | str) -> 'League':
+		return _load_pickle(path, __name__)
+
+def run_league(participants: list[Participant], league: League, workers: Optional[int] = None, n_parallel: int = 256,
+		path: Optional[PathLike | str] = None, on_shard: Optional[Callable[[League], None]] = None) -> League:
+	"""
+	Plays all the shards of `league`, that are not played yet, in worker processes
+	"""
+	tasks: dict[tuple[str, str, int], list[tuple[int, int]]] = {}
+	specs: dict[tuple[str, str, int], tuple[str, str]] = {}
+	for player, enemy in combinations(sorted(_unique(participants), key=lambda participant: participant.key), 2):
+		for sign in (1, -1):
+			stats = league.stats(player, enemy, sign)
+			shards = [(shard, size) for shard, size in shard_sizes(league.n_games, league.shard_size) if shard not in stats.shards]
+			if shards:
+				tasks[(player.key, enemy.key, sign)] = shards
+				specs[(player.key, enemy.key, sign)] = (player.spec, enemy.spec)
+
+	if not tasks:
+		return league
+
+	with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+		futures = {
+			executor.submit(_play_shard, specs[key], shard, size, key[2], league.seed, n_parallel, league.opening_plies): key
+			for key, shards in tasks.items()
+			for shard, size in shards
+		}
+		for future in as_completed(futures):
+			shard, states, lengths = future.result()
+			stats = league.results[futures[future]]
+			shard_stats = TournamentStats(stats.player, stats.enemy, stats.sign, stats.seed, stats.shard_size, stats.opening_plies, shards={shard})
+			shard_stats.add_games(states, lengths)
+			stats.merge(shard_stats)
+
+			if path is not None:
+				league.save(path)
+			if on_shard is not None:
+				on_shard(league)
+	return league
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Plays a round-robin league of all the models in a directory")
+	parser.add_argument("models", nargs="?", default="models")
+	parser.add_argument("-n", "--games", type=int, default=1000, help="games of every pair on each side")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--shard-size", type=int, default=500)
+	parser.add_argument("--workers", type=int, default=None)
+	parser.add_argument("--parallel", type=int, default=256, help="games played at once by every worker")
+	parser.add_argument("--opening-plies", type=int, default=4, help="random moves at the start of every game, 0 for none")
+	parser.add_argument("--no-random", action="store_true", help="do not add the random player")
+	parser.add_argument("-o", "--output", default="testing/league.pkl", help="league file, also used to resume the league")
+	args = parser.parse_args()
+
+	participants = discover(args.models, not args.no_random)
+	league = League(args.games, args.seed, args.shard_size, args.opening_plies)
+	if os.path.exists(args.output):
+		league = League.load(args.output)
+		settings = (league.n_games, league.seed, league.shard_size, league.opening_plies)
+		if settings != (args.games, args.seed, args.shard_size, args.opening_plies):
+			raise ValueError(f"{args.output} was played with other settings, use another output file")
+
+	keys = {participant.key for participant in participants}
+	# Both sides of every pair of distinct participants
+	total = len(keys) * (len(keys) - 1) * args.games
+	def on_shard(league: League) -> None:
+		played = sum(stats.games for (player, enemy, _), stats in league.results.items() if player != enemy and {player, enemy} <= keys)
+		print(f"{played}/{total} games played", flush=True)
+
+	run_league(participants, league, args.workers, args.parallel, args.output, on_shard)
+	print(league.table(participants))
+
+if __name__ == "__main__":
+	# Run through the package module, so the saved league is of `algo.league.League` and not of `__main__`
+	from algo.league import main
+	main()
@@ -0,0 +1,250 @@
+"""
+Monte Carlo tree search (PUCT) guided by the trained models.
+
+	player = MCTSPlayer(ddq_learning.QLearning("models/ddqn.pth"), time_limit=0.5)
+
+Worker threads share one tree. Every worker selects `batch_size` leaves at once, marked with a virtual loss,
+so that the other selections spread over the tree, and evaluates all of them with a single forward pass
+of `evaluate_children`: the children values give the priors of the leaf moves and the best one is the leaf value.
+The tree below the played moves is kept for the next `decide_move`.
+"""
+
+import math
+import threading
+import time
+import numpy as np
+
+from typing import Optional
+
+from . import iplayer
+from .board import Board, GameState
+from .vector_board import VectorBoard
+from . import q_learning, ddq_learning
+
+_KING_VALUE = 1.5
+
+class _Node:
+	__slots__ = ("code", "moves_since_last_capture", "turn", "action", "parent", "prior",
+		"visits", "value_sum", "virtual", "children", "terminal", "pending")
+
+	def __init__(self, code: int, moves_since_last_capture: int, turn: int, action: int = -1,
+			parent: Optional['_Node'] = None, prior: float = 1.) -> None:
+		self.code = code
+		self.moves_since_last_capture = moves_since_last_capture
+		self.turn = turn
+		# Move leading from the parent, a `VectorBoard` action
+		self.action = action
+		self.parent = parent
+		self.prior = prior
+
+		self.visits = 0
+		# Sum of the values for the side that made the move into the node (the one to move at the parent)
+		self.value_sum = 0.
+		self.virtual = 0
+		self.children: list['_Node'] = []
+		# Value of a finished game for the positive player
+		self.terminal: Optional[float] = None
+		# Being evaluated by a worker
+		self.pending = False
+
+class MCTSPlayer(iplayer.IPlayer):
+	def __init__(
+		self,
+		evaluator: q_learning.QLearning | ddq_learning.QLearning,
+		playouts: Optional[int] = 800,
+		time_limit: Optional[float] = None,
+		batch_size: int = 16,
+		n_threads: int = 2,
+		c_puct: float = 1.5,
+		virtual_loss: float = 1.,
+		prior_temperature: float = 1.,
+		value_scale: float = 3.,
+		material_weight: float = 1.
+	) -> None:
+		"""
+		`playouts` and `time_limit` (seconds) bound every move, the search stops at the first one reached.
+		Leaf values are `tanh((best child value + material_weight * material) / value_scale)` for the side to move
+		"""
+		super().__init__()
+		if playouts is None and time_limit is None:
+			raise ValueError("Either playouts or time_limit should be given")
+		self.evaluator = evaluator
+		self.playouts = playouts
+		self.time_limit = time_limit
+		self.batch_size = batch_size
+		self.n_threads = n_threads
+		self.c_puct = c_puct
+		self.virtual_loss = virtual_loss
+		self.prior_temperature = prior_temperature
+		self.value_scale = value_scale
+		self.material_weight = material_weight
+		# `q_learning` values are rewarded by the captures of the negative player,
+		# `ddq_learning` ones are for the side to move (its boards are flipped)
+		self.__negative_values = isinstance(evaluator, q_learning.QLearning)
+
+		# Statistics of the last `decide_move`
+		self.simulations = 0
+		self.simulations_per_second = 0.
+
+		self.__root: Optional[_Node] = None
+		self.__lock = threading.Lock()
+		self.__deadline = 0.
+		self.__target = 0
+
+	def __select(self, root: _Node) -> Optional[list[_Node]]:
+		"""
+		Returns: path from the root to a leaf, with the virtual loss added, None if the leaf is being evaluated
+		"""
+		path = [root]
+		node = root
+		while node.children:
+			sqrt_visits = math.sqrt(node.visits + node.virtual)
+			best_score = -math.inf
+			for child in node.children:
+				visits = child.visits + child.virtual
+				q = (child.value_sum - self.virtual_loss * child.virtual) / visits if visits else 0.
+				score = q + self.c_puct * child.prior * sqrt_visits / (1 + visits)
+				if score > best_score:
+					best_score, node = score, child
+			path.append(node)
+
+		if node.pending:
+			return None
+		for visited in path:
+			visited.virtual += 1
+		return path
+
+	@staticmethod
+	def __backup(path: list[_Node], value: float) -> None:
+		# `value` is for the positive player
+		for node in path:
+			node.virtual -= 1
+			node.visits += 1
+			if node.parent is not None:
+				node.value_sum += value * node.parent.turn
+
+	def __evaluate(self, leaves: list[_Node]) -> list[float]:
+		"""
+		Expands the leaves
+
+		Returns: value of every leaf for the positive player
+		"""
+		boards = VectorBoard.from_codes(
+			np.array([leaf.code for leaf in leaves], dtype=np.uint64),
+			np.array([leaf.moves_since_last_capture for leaf in leaves])
+		)
+		ret = [0.] * len(leaves)
+		playing = []
+		for i, (leaf, state) in enumerate(zip(leaves, boards.game_state.tolist())):
+			if state == GameState.NOT_OVER.value:
+				playing.append(i)
+			else:
+				leaf.terminal = 0. if state == GameState.DRAW.value else float(state)
+				ret[i] = leaf.terminal
+		if not playing:
+			return ret
+
+		games = np.array(playing)
+		children, values = self.evaluator.evaluate_children(boards, games)
+		values = values.cpu().numpy().astype(np.float64)
+		if self.__negative_values:
+			values = values * -boards.turn[games][children.parent]
+
+		codes = children.codes().tolist()
+		moves_since_last_capture = children.moves_since_last_capture.tolist()
+		turns = children.turn.tolist()
+		actions = children.action.tolist()
+		material = (np.where(np.abs(boards.pieces) == 2, _KING_VALUE, 1.) * np.sign(boards.pieces)).sum(1) * boards.turn
+
+		bounds = np.flatnonzero(np.diff(children.parent)) + 1
+		starts = np.concatenate([[0], bounds])
+		ends = np.concatenate([bounds, [len(children.parent)]])
+		for k, start, end in zip(playing, starts.tolist(), ends.tolist()):
+			leaf = leaves[k]
+			logits = values[start:end] / self.prior_temperature
+			priors = np.exp(logits - logits.max())
+			priors /= priors.sum()
+			leaf.children = [
+				_Node(codes[j], moves_since_last_capture[j], turns[j], actions[j], leaf, float(prior))
+				for j, prior in zip(range(start, end), priors)
+			]
+			value = math.tanh((values[start:end].max() + self.material_weight * material[k]) / self.value_scale)
+			ret[k] = value * leaf.turn
+		return ret
+
+	def __done(self) -> bool:
+		if self.playouts is not None and self.simulations >= self.__target:
+			return True
+		return self.time_limit is not None and time.perf_counter() > self.__deadline
+
+	def __worker(self, root: _Node) -> None:
+		while True:
+			with self.__lock:
+				if self.__done():
+					return
+				paths: list[list[_Node]] = []
+				for _ in range(self.batch_size):
+					path = self.__select(root)
+					if path is None:
+						break
+					leaf = path[-1]
+					if leaf.terminal is not None:
+						self.__backup(path, leaf.terminal)
+						self.simulations += 1
+						continue
+					leaf.pending = True
+					paths.append(path)
+			if not paths:
+				# All the leaves are being evaluated by the other workers
+				time.sleep(1e-4)
+				continue
+
+			# The forward pass runs without the lock, so the other workers could select meanwhile
+			values = self.__evaluate([path[-1] for path in paths])
+
+			with self.__lock:
+				for path, value in zip(paths, values):
+					path[-1].pending = False
+					self.__backup(path, value)
+				self.simulations += len(paths)
+
+	def __find_root(self, board: Board) -> _Node:
+		code, moves_since_last_capture = board.code, board.moves_since_last_capture
+		# The position is looked for in the kept tree, after our move and the enemy's one (or a few more in multi-jumps)
+		candidates = [] if self.__root is None else [self.__root]
+		for _ in range(5):
+			for node in candidates:
+				if node.code == code and node.moves_since_last_capture == moves_since_last_capture:
+					node.parent = None
+					return node
+			candidates = [child for node in candidates for child in node.children]
+		return _Node(code, moves_since_last_capture, board.turn_sign)
+
+	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
+		root = self.__find_root(board)
+		self.__root = root
+		if not len(board.legal_moves()):
+			raise ValueError("Tried to ask for a move when there are no possible moves")
+
+		self.simulations = 0
+		self.__target = self.playouts or 0
+		start_time = time.perf_counter()
+		self.__deadline = start_time + (self.time_limit or 0.)
+
+		# The root is expanded first, so it is never a leaf of a batch
+		if not root.children:
+			self.__evaluate([root])
+			root.visits = max(root.visits, 1)
+
+		workers = [threading.Thread(target=self.__worker, args=(root,)) for _ in range(self.n_threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.simulations_per_second = self.simulations / max(time.perf_counter() - start_time, 1e-9)
+		best = max(root.children, key=lambda child: child.visits)
+		return VectorBoard.from_codes(np.array([root.code], dtype=np.uint64)).move(0, best.action)
+
+	def __str__(self) -> str:
+		return f"MCTS player ({self.evaluator})"
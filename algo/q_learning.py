@@ -3,11 +3,15 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-import copy
+import numpy as np
+
 import pathlib
-from dataclasses import dataclass
+
+from typing import Optional
 
 from . import iplayer
+from .vector_board import VectorBoard, VectorChildren, segment_argmax
+from .encoding import encode_batch
 from .board import Board, GameState
 
 class QLearning(iplayer.IPlayer):
@@ -27,17 +31,18 @@ class QLearning(iplayer.IPlayer):
 			self.device = device
 
 		def forward(self, board: Board) -> torch.Tensor:
-			state = board.to_tensor(self.device)
+			return self.forward_tensor(board.to_tensor(self.device))
+
+		def forward_tensor(self, state: torch.Tensor) -> torch.Tensor:
+			"""Works both for a single encoded board and for a batch of them"""
 			for layer in self.layers[:-1]:
 				state = F.relu(layer(state))
 			return self.layers[-1](state)
-	
-	@dataclass
-	class Action:
-		action: tuple[tuple[int, int], tuple[int, int]]
-		value: torch.Tensor
 		
-	def __init__(self, model_path: str = "dqn.pth", layer_sizes: list[int] = [90, 50, 50, 1]) -> None:
+	def __init__(self, model_path: str = "dqn.pth", layer_sizes: list[int] = [90, 50, 50, 1], state_dict: Optional[dict] = None) -> None:
+		"""
+		`state_dict` - weights already loaded from `model_path`, the model uses them instead of copies
+		"""
 		super().__init__()
 
 		self.__model_path = model_path
@@ -46,17 +51,55 @@ class QLearning(iplayer.IPlayer):
 
 		self.device = torch.device("cpu")
 		self.model = self.DQN(device=self.device, layer_sizes=layer_sizes)
-		self.model.load_state_dict(torch.load(model_path))
+		if state_dict is None:
+			self.model.load_state_dict(torch.load(model_path))
+		else:
+			self.model.load_state_dict(state_dict, assign=True)
 	
+	def evaluate_moves(self, board: Board) -> tuple[list[tuple[tuple[int, int], tuple[int, int]]], torch.Tensor]:
+		"""
+		Returns all correct moves and their values, computed with a single forward pass
+		"""
+		moves: list[tuple[tuple[int, int], tuple[int, int]]] = []
+		children: list[bytes] = []
+		immediate_rewards: list[float] = []
+
+		# Children are visited in place on a single copy of the board
+		next_state = board.copy()
+		for s, e in map(Board.decode_move, board.legal_moves().tolist()):
+			move = next_state.make_move(s, e)
+			immediate_rewards.append(bool(move.captured) * next_state.turn_sign)
+			children.append(bytes(next_state))
+			next_state.undo_move(move)
+			moves.append((s, e))
+
+		with torch.inference_mode():
+			values = self.model.forward_tensor(Board.to_tensor_batch(children, self.device)).view(-1)
+			values = values * self.DQN.GAMMA + torch.tensor(immediate_rewards, device=self.device)
+		return moves, values
+
 	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
-		ret: list[QLearning.Action] = []
-		for s in board.get_possible_pos():
-			for e in board.get_correct_moves(s):
-				next_state = copy.deepcopy(board)
-				immediate_reward = torch.tensor([bool(next_state.make_move(s, e).captured) * next_state.turn_sign], device=self.device)
-				value = self.model(next_state) * self.DQN.GAMMA + immediate_reward
-				ret.append(QLearning.Action((s, e), value))
-		return max(ret, key=lambda x: x.value.item()).action
+		moves, values = self.evaluate_moves(board)
+		return moves[int(values.argmax())]
+
+	def evaluate_children(self, boards: VectorBoard, games: np.ndarray) -> tuple[VectorChildren, torch.Tensor]:
+		"""
+		Batched `evaluate_moves` of the given games, computed with a single forward pass
+
+		Returns: all the children of the games and their values
+		"""
+		children = boards.children(games)
+		immediate_rewards = (children.captured > 0) * children.turn
+
+		with torch.inference_mode():
+			values = self.model.forward_tensor(encode_batch(children.pieces + 2, self.device)).view(-1)
+			values = values * self.DQN.GAMMA + torch.from_numpy(immediate_rewards.astype(np.float32)).to(self.device)
+		return children, values
+
+	def decide_moves(self, boards: VectorBoard, games: np.ndarray) -> np.ndarray:
+		children, values = self.evaluate_children(boards, games)
+		best = segment_argmax(values, torch.from_numpy(children.parent).to(self.device), len(games))
+		return children.action[best.cpu().numpy()]
 
 	def __str__(self) -> str:
 		return f"{self.__model_file_name} ({self.__layer_sizes})"
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Dense indexes of the positions, for tables kept in flat arrays instead of dicts keyed by `int(board)`.
+
+	index = ranking.rank(board)  # 0 <= index < ranking.N_POSITIONS
+	board = ranking.unrank(index)
+
+A position is the pieces on the squares and the side to move. The should capture flags follow from the pieces,
+so they are not a part of the index and `unrank` computes them. Positions are all the placements of at most
+`MAX_PIECES` pieces of every side, with no men on their promotion rows.
+
+Positions are grouped by their piece counts, groups with fewer pieces first. Inside a group they are numbered
+in the lexicographic order of the squares (in `Board.__iter__` order), using the number of ways
+the rest of the squares could be filled with the remaining pieces.
+"""
+
+import numpy as np
+
+from itertools import product
+
+from .board import Board, _SQUARES
+from .vector_board import _moves, _pack, _unpack
+
+MAX_PIECES = 6
+
+# Pieces in the order of the ranking, the empty square first
+_VALUES = np.array([0, -2, -1, 1, 2], dtype=np.int8)
+# Column of every piece value (-2..2) in the counts, the empty square has none
+_COLUMN = {-2: 0, -1: 1, 1: 2, 2: 3}
+_ORDER = np.zeros(5, dtype=np.int8)
+_ORDER[_VALUES + 2] = np.arange(5)
+
+_ROW = np.array([y for _, y in _SQUARES])
+# _ALLOWED[k, piece + 2] - if the piece may stand on square k, men are promoted on the last row
+_ALLOWED = np.ones((18, 5), dtype=bool)
+_ALLOWED[_ROW == 0, 1 + 2] = False
+_ALLOWED[_ROW == Board.SIZE - 1, -1 + 2] = False
+
+_RADIX = MAX_PIECES + 1
+_UNITS = np.array([_RADIX ** 3, _RADIX ** 2, _RADIX, 1], dtype=np.int64)
+
+def _flat(counts: np.ndarray) -> np.ndarray:
+	# Index of the counts (negative kings, negative men, positive men, positive kings) in the `_WAYS` rows
+	return counts @ _UNITS
+
+def _count_ways() -> np.ndarray:
+	# _WAYS[k, _flat(counts)] - number of ways to fill the squares k.. with exactly these pieces
+	ret = np.zeros((19, _RADIX ** 4), dtype=np.int64)
+	all_counts = np.array(list(product(range(_RADIX), repeat=4)), dtype=np.int64)
+	flat = _flat(all_counts)
+	ret[18, 0] = 1
+	for k in range(17, -1, -1):
+		ret[k, flat] = ret[k + 1, flat]
+		for value, column in _COLUMN.items():
+			if not _ALLOWED[k, value + 2]:
+				continue
+			has = all_counts[:, column] > 0
+			ret[k, flat[has]] += ret[k + 1, flat[has] - _UNITS[column]]
+	return ret
+
+_WAYS = _count_ways()
+
+def _group_counts() -> np.ndarray:
+	ret = [
+		counts for counts in product(range(_RADIX), repeat=4)
+		if counts[0] + counts[1] <= MAX_PIECES and counts[2] + counts[3] <= MAX_PIECES
+	]
+	ret.sort(key=lambda counts: (sum(counts), counts))
+	return np.array(ret, dtype=np.int64)
+
+GROUP_COUNTS = _group_counts()
+"""Counts of (negative kings, negative men, positive men, positive kings) of every group"""
+GROUP_SIZES = _WAYS[0, _flat(GROUP_COUNTS)] * 2
+GROUP_OFFSETS = np.concatenate([[0], np.cumsum(GROUP_SIZES)])
+N_POSITIONS = int(GROUP_OFFSETS[-1])
+
+_GROUP_BY_FLAT = np.full(_RADIX ** 4, -1, dtype=np.int64)
+_GROUP_BY_FLAT[_flat(GROUP_COUNTS)] = np.arange(len(GROUP_COUNTS))
+
+def _counts(pieces: np.ndarray) -> np.ndarray:
+	return np.stack([(pieces == value).sum(1) for value in _COLUMN], 1).astype(np.int64)
+
+def rank_pieces(pieces: np.ndarray, turn: np.ndarray) -> np.ndarray:
+	"""
+	`pieces` - (N, 18) array of the pieces on the squares, `turn` - side to move of every position
+
+	Returns: index of every position
+	"""
+	pieces = np.asarray(pieces, dtype=np.int8)
+	remaining = _counts(pieces)
+	if (remaining > MAX_PIECES).any() or (remaining[:, :2].sum(1) > MAX_PIECES).any() or (remaining[:, 2:].sum(1) > MAX_PIECES).any():
+		raise ValueError(f"More than {MAX_PIECES} pieces of a side")
+	if not _ALLOWED[np.arange(18), pieces + 2].all():
+		raise ValueError("A man on its promotion row")
+
+	group = _GROUP_BY_FLAT[_flat(remaining)]
+	ret = np.zeros(len(pieces), dtype=np.int64)
+	for k in range(18):
+		order = _ORDER[pieces[:, k] + 2]
+		# Every piece before the one on the square adds all the ways to fill the rest after it
+		for i, value in enumerate(_VALUES):
+			if not _ALLOWED[k, value + 2]:
+				continue
+			before = order > i
+			if value:
+				before &= remaining[:, _COLUMN[value]] > 0
+				ret[before] += _WAYS[k + 1, _flat(remaining[before]) - _UNITS[_COLUMN[value]]]
+			else:
+				ret[before] += _WAYS[k + 1, _flat(remaining[before])]
+		for value, column in _COLUMN.items():
+			remaining[pieces[:, k] == value, column] -= 1
+
+	return GROUP_OFFSETS[group] + ret * 2 + (np.asarray(turn) > 0)
+
+def unrank_pieces(indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Returns: (pieces, turn) of every index, as taken by `rank_pieces`
+	"""
+	indexes = np.asarray(indexes, dtype=np.int64)
+	if ((indexes < 0) | (indexes >= N_POSITIONS)).any():
+		raise ValueError(f"Indexes should be in [0, {N_POSITIONS})")
+
+	group = np.searchsorted(GROUP_OFFSETS, indexes, side="right") - 1
+	rest = indexes - GROUP_OFFSETS[group]
+	turn = np.where(rest % 2, 1, -1).astype(np.int8)
+	rest //= 2
+	remaining = GROUP_COUNTS[group].copy()
+
+	pieces = np.zeros((len(indexes), 18), dtype=np.int8)
+	for k in range(18):
+		undecided = np.ones(len(indexes), dtype=bool)
+		for i, value in enumerate(_VALUES):
+			if not _ALLOWED[k, value + 2]:
+				continue
+			if value:
+				available = undecided & (remaining[:, _COLUMN[value]] > 0)
+				ways = np.zeros(len(indexes), dtype=np.int64)
+				ways[available] = _WAYS[k + 1, _flat(remaining[available]) - _UNITS[_COLUMN[value]]]
+			else:
+				ways = np.where(undecided, _WAYS[k + 1, _flat(remaining)], 0)
+			chosen = undecided & (rest < ways)
+			pieces[chosen, k] = value
+			undecided &= ~chosen
+			rest[undecided] -= ways[undecided]
+		for value, column in _COLUMN.items():
+			remaining[pieces[:, k] == value, column] -= 1
+
+	return pieces, turn
+
+def rank_codes(codes: np.ndarray) -> np.ndarray:
+	"""
+	Returns: index of every `Board.code`, the should capture flags are ignored
+	"""
+	pieces, turn, _ = _unpack(np.asarray(codes, dtype=np.uint64))
+	return rank_pieces(pieces, turn)
+
+def unrank_codes(indexes: np.ndarray) -> np.ndarray:
+	"""
+	Returns: `Board.code` of every index, with the should capture flags of its pieces
+	"""
+	pieces, turn = unrank_pieces(indexes)
+	should_capture = np.stack([_moves(pieces, np.full(len(pieces), sign))[0].any(1) for sign in (-1, 1)], 1)
+	return _pack(pieces, turn, should_capture)
+
+def rank(board: Board) -> int:
+	return int(rank_codes(np.array([board.code], dtype=np.uint64))[0])
+
+def unrank(index: int) -> Board:
+	return Board.from_code(int(unrank_codes(np.array([index]))[0]))
@@ -0,0 +1,279 @@
+"""
+Replay buffer of the training transitions, kept in preallocated ring arrays instead of lists of `Board` objects.
+
+	memory = ReplayBuffer(1 << 20, prioritized=True)
+	memory.add(board, VectorBoard.action(start, end), reward, next_board)
+	batch = memory.sample(128, device)
+	...
+	memory.update_priorities(batch.indexes, td_errors)
+
+Boards are stored packed, as `Board.code` and the draw counter, moves are `VectorBoard` actions.
+Once the buffer is full the oldest transitions are overwritten.
+
+With `path` the arrays are memory mapped files in that directory, so the buffer could be larger than RAM:
+* `<field>.bin` - one raw array per field of `_FIELDS`
+* `meta.json` - capacity, next slot and number of the stored transitions, written by `flush`
+
+Prioritised sampling draws the transitions proportionally to `priority ** alpha` from a sum tree,
+new transitions get the highest priority seen so far.
+"""
+
+import json
+import os
+import numpy as np
+import torch
+
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+from .board import Board, GameState
+from .encoding import encode_batch
+
+_FIELDS = {
+	"codes": np.uint64,
+	"moves_since_last_capture": np.uint8,
+	"actions": np.uint8,
+	"rewards": np.float32,
+	"next_codes": np.uint64,
+	"next_moves_since_last_capture": np.uint8,
+	"dones": np.bool_,
+	"priorities": np.float32,
+}
+
+_TURN_BIT = np.uint64(1 << 54)
+
+class SumTree:
+	"""
+	Binary tree over `capacity` leaves, every inner node holds the sum of its children
+	"""
+
+	def __init__(self, capacity: int) -> None:
+		# Leaves are the last `size` nodes, node i has children 2i and 2i + 1
+		self.size = 1 << max(capacity - 1, 0).bit_length()
+		self.nodes = np.zeros(2 * self.size, dtype=np.float64)
+
+	@property
+	def total(self) -> float:
+		return float(self.nodes[1])
+
+	def __getitem__(self, leaves: np.ndarray) -> np.ndarray:
+		return self.nodes[np.asarray(leaves) + self.size]
+
+	def update(self, leaves: np.ndarray, values: np.ndarray) -> None:
+		nodes = np.asarray(leaves, dtype=np.int64) + self.size
+		self.nodes[nodes] = values
+		if len(nodes) == 1:
+			# A single leaf (every `ReplayBuffer.add`) is much cheaper to walk up without the array operations
+			node = int(nodes[0]) // 2
+			tree = self.nodes
+			while node:
+				tree[node] = tree[2 * node] + tree[2 * node + 1]
+				node //= 2
+			return
+		while len(nodes) and nodes[0] > 1:
+			nodes = np.unique(nodes // 2)
+			self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+	def find(self, prefixes: np.ndarray) -> np.ndarray:
+		"""
+		Returns: leaf of every prefix sum, the first one whose cumulative sum exceeds it
+		"""
+		prefixes = np.array(prefixes, dtype=np.float64)
+		nodes = np.ones(len(prefixes), dtype=np.int64)
+		for _ in range(self.size.bit_length() - 1):
+			left = self.nodes[2 * nodes]
+			right = prefixes >= left
+			prefixes -= np.where(right, left, 0.)
+			nodes = 2 * nodes + right
+		return nodes - self.size
+
+@dataclass
+class ReplayBatch:
+	# Slots of the transitions, for `ReplayBuffer.update_priorities`
+	indexes: np.ndarray
+	codes: np.ndarray
+	moves_since_last_capture: np.ndarray
+	next_codes: np.ndarray
+	next_moves_since_last_capture: np.ndarray
+
+	# Encoded boards, as `encode_batch` gives them
+	states: torch.Tensor
+	next_states: torch.Tensor
+	actions: torch.Tensor
+	rewards: torch.Tensor
+	dones: torch.Tensor
+	# Importance sampling weights, normalized by the largest one in the batch (all ones for uniform sampling)
+	weights: torch.Tensor
+
+class ReplayBuffer:
+	def __init__(
+		self,
+		capacity: int,
+		path: Optional[PathLike | str] = None,
+		prioritized: bool = False,
+		alpha: float = 0.6,
+		epsilon: float = 1e-3,
+		seed: Optional[int] = None
+	) -> None:
+		"""
+		`path` - directory of the memory mapped arrays, an existing buffer there is opened and continued.
+		`epsilon` is added to the priorities, so that every transition could still be sampled
+		"""
+		self.capacity = capacity
+		self.prioritized = prioritized
+		self.alpha = alpha
+		self.epsilon = epsilon
+		self.path = None if path is None else Path(path)
+		self.random = np.random.default_rng(seed)
+
+		# Next slot to write and number of the stored transitions
+		self.position = 0
+		self.size = 0
+
+		if self.path is None:
+			for name, dtype in _FIELDS.items():
+				setattr(self, name, np.zeros(capacity, dtype=dtype))
+		else:
+			self.path.mkdir(parents=True, exist_ok=True)
+			existing = (self.path / "meta.json").exists()
+			if existing:
+				with open(self.path / "meta.json") as f:
+					meta = json.load(f)
+				if meta["capacity"] != capacity:
+					raise ValueError(f"The buffer in {path} has capacity {meta['capacity']}, not {capacity}")
+				self.position, self.size = meta["position"], meta["size"]
+			for name, dtype in _FIELDS.items():
+				setattr(self, name, np.memmap(self.path / f"{name}.bin", dtype=dtype, mode="r+" if existing else "w+", shape=(capacity,)))
+
+		self.tree: Optional[SumTree] = None
+		self.max_priority = 1.
+		if prioritized:
+			self.tree = SumTree(capacity)
+			if self.size:
+				stored = np.asarray(self.priorities[:self.size], dtype=np.float64)
+				self.tree.update(np.arange(self.size), stored ** alpha)
+				self.max_priority = float(stored.max())
+
+	def __len__(self) -> int:
+		return self.size
+
+	def add(self, state: Board, action: int, reward: float, next_state: Board) -> None:
+		"""
+		`action` - `VectorBoard` action of the move made in `state`, the transition is done if `next_state` is over
+		"""
+		i = self.position
+		self.codes[i] = state.code
+		self.moves_since_last_capture[i] = state.moves_since_last_capture
+		self.actions[i] = action
+		self.rewards[i] = reward
+		self.next_codes[i] = next_state.code
+		self.next_moves_since_last_capture[i] = next_state.moves_since_last_capture
+		self.dones[i] = next_state.game_state != GameState.NOT_OVER
+		self.__added(np.array([i]))
+
+	def extend(
+		self,
+		codes: np.ndarray,
+		moves_since_last_capture: np.ndarray,
+		actions: np.ndarray,
+		rewards: np.ndarray,
+		next_codes: np.ndarray,
+		next_moves_since_last_capture: np.ndarray,
+		dones: np.ndarray
+	) -> None:
+		"""
+		Batched `add` of packed transitions, e.g. collected on a `VectorBoard`
+		"""
+		n = len(codes)
+		if not n:
+			return
+		if n > self.capacity:
+			# Only the last ones would be left anyway
+			skipped = n - self.capacity
+			self.position = (self.position + skipped) % self.capacity
+			self.size = min(self.size + skipped, self.capacity)
+			codes, moves_since_last_capture, actions, rewards, next_codes, next_moves_since_last_capture, dones = (
+				values[skipped:] for values in (codes, moves_since_last_capture, actions, rewards, next_codes, next_moves_since_last_capture, dones)
+			)
+			n = self.capacity
+
+		indexes = (self.position + np.arange(n)) % self.capacity
+		self.codes[indexes] = codes
+		self.moves_since_last_capture[indexes] = moves_since_last_capture
+		self.actions[indexes] = actions
+		self.rewards[indexes] = rewards
+		self.next_codes[indexes] = next_codes
+		self.next_moves_since_last_capture[indexes] = next_moves_since_last_capture
+		self.dones[indexes] = dones
+		self.__added(indexes)
+
+	def __added(self, indexes: np.ndarray) -> None:
+		self.position = (int(indexes[-1]) + 1) % self.capacity
+		self.size = min(self.size + len(indexes), self.capacity)
+		self.priorities[indexes] = self.max_priority
+		if self.tree is not None:
+			self.tree.update(indexes, np.full(len(indexes), self.max_priority ** self.alpha))
+
+	def update_priorities(self, indexes: np.ndarray, errors: np.ndarray | torch.Tensor) -> None:
+		"""
+		`errors` - TD errors of the sampled transitions, their absolute values are the new priorities
+		"""
+		if isinstance(errors, torch.Tensor):
+			errors = errors.detach().cpu().numpy()
+		priorities = np.abs(errors).astype(np.float64) + self.epsilon
+		self.priorities[indexes] = priorities
+		self.max_priority = max(self.max_priority, float(priorities.max()))
+		if self.tree is not None:
+			self.tree.update(indexes, priorities ** self.alpha)
+
+	def sample(self, batch_size: int, device, beta: float = 0.4, flipped: bool = False, three_d: bool = False) -> ReplayBatch:
+		"""
+		`beta` - importance sampling exponent of the prioritised sampling.
+		`flipped` - boards with the positive side to move are rotated, as `ddq_learning` models see them
+
+		Returns: transitions drawn with replacement
+		"""
+		if not self.size:
+			raise ValueError("Tried to sample from an empty buffer")
+
+		if self.tree is None:
+			indexes = self.random.integers(0, self.size, batch_size)
+			weights = np.ones(batch_size, dtype=np.float32)
+		else:
+			# One draw from every of the `batch_size` equal parts of the total priority
+			total = self.tree.total
+			prefixes = (np.arange(batch_size) + self.random.random(batch_size)) * (total / batch_size)
+			indexes = np.minimum(self.tree.find(np.minimum(prefixes, np.nextafter(total, 0))), self.size - 1)
+			probabilities = self.tree[indexes] / total
+			weights = (self.size * probabilities) ** -beta
+			weights = (weights / weights.max()).astype(np.float32)
+
+		codes = np.asarray(self.codes[indexes])
+		next_codes = np.asarray(self.next_codes[indexes])
+		return ReplayBatch(
+			indexes=indexes,
+			codes=codes,
+			moves_since_last_capture=np.asarray(self.moves_since_last_capture[indexes]),
+			next_codes=next_codes,
+			next_moves_since_last_capture=np.asarray(self.next_moves_since_last_capture[indexes]),
+			states=encode_batch(codes, device, flipped and (codes & _TURN_BIT) > 0, three_d),
+			next_states=encode_batch(next_codes, device, flipped and (next_codes & _TURN_BIT) > 0, three_d),
+			actions=torch.from_numpy(np.asarray(self.actions[indexes], dtype=np.int64)).to(device),
+			rewards=torch.from_numpy(np.asarray(self.rewards[indexes])).to(device),
+			dones=torch.from_numpy(np.asarray(self.dones[indexes])).to(device),
+			weights=torch.from_numpy(weights).to(device),
+		)
+
+	def flush(self) -> None:
+		"""
+		Writes the memory mapped arrays and `meta.json`, does nothing for a buffer in RAM
+		"""
+		if self.path is None:
+			return
+		for name in _FIELDS:
+			getattr(self, name).flush()
+		with open(self.path / "meta.json.tmp", "w") as f:
+			json.dump({"capacity": self.capacity, "position": self.position, "size": self.size}, f)
+		os.replace(self.path / "meta.json.tmp", self.path / "meta.json")
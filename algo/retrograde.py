@@ -0,0 +1,243 @@
+"""
+Retrograde analysis of the positions enumerated by `algo.brute_force`.
+
+	python -m algo.retrograde states --workers 8
+
+Every position is labeled as a win, a loss or a draw for the side to move, with the distance to the end of the game.
+Moves never change the number of pieces unless they capture, and the draw counter grows by one with every
+other move, so a slice of positions with the same pieces (and all the draw counter values) is solved
+by going over the counter from `Board.DRAW_NON_CAPTURE_MOVES - 1` down to 0, using captures into already solved
+slices with fewer pieces. Slices with the same total number of pieces are solved in parallel.
+
+The result of a position can only get better for the winning side with a lower counter, so it is stored per position,
+next to the graph arrays:
+* `value.bin` (int8) - 1 if the side to move wins with the counter at 0, -1 if it loses, 0 for a draw
+* `limit.bin` (uint8) - the highest counter, for which the value still holds, the game is a draw above it
+* `distance.bin` (uint16) - number of moves till the end of the game with the counter at 0
+* `best.bin` (uint8) - child of the best move up to `limit` (the fastest win, the longest loss)
+* `draw_best.bin` (uint8) - child of a move keeping the draw above `limit`
+* `solution.json` - solved slices, an interrupted run continues with the unsolved ones
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+from . import iplayer
+from .board import Board
+from .brute_force import StateGraph
+from .vector_board import VectorBoard
+
+_NO_MOVE = 255
+# Scores of the moves, a lower one is better: wins by distance, then draws, then losses by reversed distance
+_DRAW_SCORE = 1 << 20
+
+_TABLES = {
+	"value": np.int8,
+	"limit": np.uint8,
+	"distance": np.uint16,
+	"best": np.uint8,
+	"draw_best": np.uint8,
+}
+
+_TURN_BIT = np.uint64(1 << 54)
+_SIDE_MASK = np.uint64((1 << 18) - 1)
+
+def _piece_counts(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Returns: numbers of the positive and the negative pieces of every code
+	"""
+	codes = codes.astype(np.uint64)
+	return np.bitwise_count(codes & _SIDE_MASK), np.bitwise_count((codes >> np.uint64(18)) & _SIDE_MASK)
+
+class Solution:
+	"""
+	Solver results, memory mapped and indexed by the `StateGraph` node
+	"""
+
+	def __init__(self, path: PathLike | str, writable: bool = False) -> None:
+		self.path = Path(path)
+		n_nodes = len(StateGraph(path))
+		for name, dtype in _TABLES.items():
+			setattr(self, name, np.memmap(self.path / f"{name}.bin", dtype=dtype, mode="r+" if writable else "r", shape=(n_nodes,)))
+
+	def result(self, node: int, moves_since_last_capture: int) -> int:
+		"""
+		Returns: 1 if the side to move wins, -1 if it loses, 0 for a draw
+		"""
+		return int(self.value[node]) if moves_since_last_capture <= self.limit[node] else 0
+
+	def best_child(self, node: int, moves_since_last_capture: int) -> Optional[int]:
+		"""
+		Returns: position of the best move among the children of the node, None if the game is over
+		"""
+		ret = self.best[node] if moves_since_last_capture <= self.limit[node] else self.draw_best[node]
+		return None if ret == _NO_MOVE else int(ret)
+
+def _solve_slice(path: PathLike | str, nodes: np.ndarray) -> None:
+	graph = StateGraph(path)
+	solution = Solution(path, writable=True)
+	n = len(nodes)
+
+	codes = np.asarray(graph.codes[nodes])
+	starts = np.asarray(graph.offsets[nodes])
+	counts = np.asarray(graph.offsets[nodes + 1]) - starts
+	parents = np.repeat(np.arange(n), counts)
+	edges = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+	children = np.asarray(graph.children[edges])
+	child_codes = np.asarray(graph.codes[children])
+
+	positive, negative = _piece_counts(codes)
+	child_positive, child_negative = _piece_counts(child_codes)
+	capture = child_positive + child_negative < (positive + negative)[parents]
+	# Child values are stored for its side to move, which is the same one only while a multi-jump goes on
+	same_turn = (child_codes & _TURN_BIT) == (codes[parents] & _TURN_BIT)
+	child_sign = np.where(same_turn, 1, -1).astype(np.int8)
+	# Captured children are in other slices, their index into this one is never used but should still be in range
+	local_children = np.where(capture, 0, np.searchsorted(nodes, children))
+
+	# Captures lead into solved slices with the counter reset to 0
+	capture_value = np.where(capture, np.asarray(solution.value[np.where(capture, children, 0)]) * child_sign, 0)
+	capture_distance = np.where(capture, np.asarray(solution.distance[np.where(capture, children, 0)]), 0).astype(np.int64)
+
+	# Same checks as `Board.game_state`, positions without moves are lost
+	own, enemy = np.where(codes & _TURN_BIT, positive, negative), np.where(codes & _TURN_BIT, negative, positive)
+	terminal = (own == 0) | (enemy == 0) | (counts == 0)
+	terminal_value = np.where((own > 0) & (enemy == 0), 1, -1).astype(np.int8)
+	group_starts = (np.cumsum(counts) - counts)[counts > 0]
+
+	# Results of the previous counter value, above the last one the game is a draw
+	value = np.zeros(n, dtype=np.int8)
+	distance = np.zeros(n, dtype=np.int64)
+	win_limit = np.full(n, -1, dtype=np.int16)
+	loss_limit = np.full(n, -1, dtype=np.int16)
+	win_best = np.full(n, _NO_MOVE, dtype=np.uint8)
+	draw_best = np.full(n, _NO_MOVE, dtype=np.uint8)
+	best = np.full(n, _NO_MOVE, dtype=np.uint8)
+
+	for counter in range(Board.DRAW_NON_CAPTURE_MOVES - 1, -1, -1):
+		child_value = np.where(capture, capture_value, value[local_children] * child_sign)
+		child_distance = np.where(capture, capture_distance, distance[local_children])
+		score = np.where(child_value == 1, child_distance, np.where(child_value == 0, _DRAW_SCORE, 2 * _DRAW_SCORE - child_distance))
+
+		min_score = np.full(n, _DRAW_SCORE, dtype=np.int64)
+		min_score[counts > 0] = np.minimum.reduceat(score, group_starts)
+		# The first child with the best score
+		best_edges = np.flatnonzero(score == min_score[parents])
+		first_parents, first = np.unique(parents[best_edges], return_index=True)
+		best[:] = _NO_MOVE
+		best[first_parents] = best_edges[first] - (np.cumsum(counts) - counts)[first_parents]
+
+		value = np.where(min_score < _DRAW_SCORE, 1, np.where(min_score == _DRAW_SCORE, 0, -1)).astype(np.int8)
+		distance = np.where(value == 1, min_score + 1, np.where(value == -1, 2 * _DRAW_SCORE - min_score + 1, 0))
+		value = np.where(terminal, terminal_value, value)
+		distance = np.where(terminal, 0, distance)
+		best[terminal] = _NO_MOVE
+
+		# The move winning with the highest counter wins with all the lower ones as well
+		new_wins = (value == 1) & (win_limit < 0)
+		win_limit[new_wins] = counter
+		win_best[new_wins] = best[new_wins]
+		loss_limit[(value == -1) & (loss_limit < 0)] = counter
+		# And the move keeping the draw with the lowest counter keeps it with the higher ones
+		draw_best = np.where(value == 0, best, draw_best)
+
+	solution.value[nodes] = value
+	solution.limit[nodes] = np.where(terminal, Board.DRAW_NON_CAPTURE_MOVES - 1,
+		np.where(value == 1, win_limit, np.where(value == -1, loss_limit, Board.DRAW_NON_CAPTURE_MOVES - 1)))
+	solution.distance[nodes] = np.minimum(distance, np.iinfo(np.uint16).max)
+	solution.best[nodes] = np.where(value == 1, win_best, best)
+	solution.draw_best[nodes] = np.where(value == 0, _NO_MOVE, draw_best)
+	for name in _TABLES:
+		getattr(solution, name).flush()
+
+class Solver:
+	def __init__(self, path: PathLike | str, workers: Optional[int] = None) -> None:
+		self.path = Path(path)
+		self.workers = workers
+		graph = StateGraph(path)
+		if not graph.finished:
+			raise ValueError(f"The enumeration in {path} is not finished")
+
+		if (self.path / "solution.json").exists():
+			with open(self.path / "solution.json") as f:
+				self.solved: set[tuple[int, int]] = {tuple(piece_counts) for piece_counts in json.load(f)["solved"]}
+		else:
+			self.solved = set()
+			for name, dtype in _TABLES.items():
+				np.zeros(len(graph), dtype=dtype).tofile(self.path / f"{name}.bin")
+
+		positive, negative = _piece_counts(np.asarray(graph.codes))
+		self.slices: dict[tuple[int, int], np.ndarray] = {}
+		order = np.lexsort((negative, positive))
+		keys = np.stack([positive[order], negative[order]], 1)
+		bounds = np.flatnonzero(np.any(np.diff(keys, axis=0), axis=1)) + 1
+		for group in np.split(order, bounds):
+			self.slices[(int(positive[group[0]]), int(negative[group[0]]))] = np.sort(group)
+
+	def __commit(self) -> None:
+		with open(self.path / "solution.json.tmp", "w") as f:
+			json.dump({"solved": sorted(self.solved)}, f)
+		os.replace(self.path / "solution.json.tmp", self.path / "solution.json")
+
+	def run(self, verbose: bool = True) -> None:
+		totals = sorted({sum(piece_counts) for piece_counts in self.slices})
+		with ProcessPoolExecutor(self.workers) as executor:
+			for total in totals:
+				todo = [piece_counts for piece_counts in self.slices if sum(piece_counts) == total and piece_counts not in self.solved]
+				if not todo:
+					continue
+
+				start_time = time.perf_counter()
+				futures = {piece_counts: executor.submit(_solve_slice, self.path, self.slices[piece_counts]) for piece_counts in todo}
+				for piece_counts, future in futures.items():
+					future.result()
+					self.solved.add(piece_counts)
+				self.__commit()
+
+				if verbose:
+					n_nodes = sum(len(self.slices[piece_counts]) for piece_counts in todo)
+					elapsed = time.perf_counter() - start_time
+					print(f"{total} pieces: {len(todo)} slices, {n_nodes} positions, {n_nodes / elapsed:.0f} positions/s", flush=True)
+
+class PerfectPlayer(iplayer.IPlayer):
+	"""
+	Plays the moves of the solved database, the positions should come from the enumerated graph
+	"""
+
+	def __init__(self, path: PathLike | str = "states") -> None:
+		super().__init__()
+		self.graph = StateGraph(path)
+		self.solution = Solution(path)
+
+	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
+		node = int(self.graph.index(np.array([board.code], dtype=np.uint64))[0])
+		if node < 0:
+			raise ValueError("The position is not in the solved graph")
+
+		child = self.solution.best_child(node, board.moves_since_last_capture)
+		if child is None:
+			raise ValueError("Tried to ask for a move when there are no possible moves")
+		action = int(self.graph.actions[self.graph.offsets[node] + child])
+		return VectorBoard.from_codes(np.array([board.code], dtype=np.uint64)).move(0, action)
+
+	def __str__(self) -> str:
+		return "Perfect player"
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Solves the enumerated positions")
+	parser.add_argument("path", nargs="?", default="states", help="output of algo.brute_force")
+	parser.add_argument("--workers", type=int, default=None)
+	args = parser.parse_args()
+
+	Solver(args.path, args.workers).run()
+
+if __name__ == "__main__":
+	main()
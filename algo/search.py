@@ -0,0 +1,265 @@
+"""
+Alpha-beta search with iterative deepening, for playing the trained models (or a material count) with lookahead.
+
+	player = SearchPlayer(ddq_learning.QLearning("models/ddqn.pth"), time_limit=0.5)
+
+Leaves are scored by the material count, refined by the evaluator with a single forward pass of `evaluate_moves`
+over all their children.
+Moves are ordered by the transposition table move, captures and promotions, killer moves and the history heuristic.
+"""
+
+import time
+
+from typing import Optional
+
+from . import iplayer
+from .board import Board, GameState
+from .vector_board import VectorBoard
+from . import q_learning, ddq_learning
+
+Move = tuple[tuple[int, int], tuple[int, int]]
+
+WIN_SCORE = 10000.
+# Scores above it are won (or lost) games, closer wins are worth more
+_WON = WIN_SCORE - 1000
+_KING_VALUE = 1.5
+
+# Transposition table bound types
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+# Keeps the draw counter in the table keys, positions close to the draw are not the same
+_COUNTER_KEY = 0x9E3779B97F4A7C15
+_MASK_64 = (1 << 64) - 1
+_SIDE_MASK = (1 << 18) - 1
+
+class _OutOfBudget(Exception):
+	pass
+
+class TranspositionTable:
+	"""
+	Fixed number of entries indexed by the low bits of the key. An entry is replaced by a deeper search,
+	or by any search once it is left from an older move
+	"""
+
+	def __init__(self, size_bits: int = 20) -> None:
+		size = 1 << size_bits
+		self.mask = size - 1
+		self.keys: list[int] = [-1] * size
+		self.depths: list[int] = [-1] * size
+		self.values: list[float] = [0.] * size
+		self.bounds: list[int] = [_EXACT] * size
+		self.moves: list[Optional[Move]] = [None] * size
+		self.generations: list[int] = [0] * size
+		self.generation = 0
+
+	def probe(self, key: int) -> Optional[tuple[int, float, int, Optional[Move]]]:
+		"""
+		Returns: (depth, value, bound, best move) of the key, None if it is not stored
+		"""
+		i = key & self.mask
+		if self.keys[i] != key:
+			return None
+		return self.depths[i], self.values[i], self.bounds[i], self.moves[i]
+
+	def store(self, key: int, depth: int, value: float, bound: int, move: Optional[Move]) -> None:
+		i = key & self.mask
+		if self.keys[i] == key or depth >= self.depths[i] or self.generations[i] != self.generation:
+			self.keys[i] = key
+			self.depths[i] = depth
+			self.values[i] = value
+			self.bounds[i] = bound
+			self.moves[i] = move
+			self.generations[i] = self.generation
+
+class SearchPlayer(iplayer.IPlayer):
+	def __init__(
+		self,
+		evaluator: Optional[q_learning.QLearning | ddq_learning.QLearning] = None,
+		time_limit: Optional[float] = 1.,
+		node_limit: Optional[int] = None,
+		max_depth: int = 64,
+		tt_size_bits: int = 20,
+		material_weight: float = 5.
+	) -> None:
+		"""
+		`evaluator` - agent, whose `evaluate_moves` values score the leaves. The models were trained against
+		the random player and their values are not reliable on their own deep in a search, so the material count
+		times `material_weight` is added to them. `time_limit` (seconds) and `node_limit` bound every move,
+		the deepest finished iteration gives the move
+		"""
+		super().__init__()
+		self.evaluator = evaluator
+		self.material_weight = material_weight
+		# `q_learning` models are trained as the negative player, so only its moves are scored by them
+		# and the search goes one move deeper otherwise. `ddq_learning` ones score both sides (its boards are flipped)
+		self.__leaf_sign = -1 if isinstance(evaluator, q_learning.QLearning) else None
+		self.time_limit = time_limit
+		self.node_limit = node_limit
+		self.max_depth = max_depth
+		self.table = TranspositionTable(tt_size_bits)
+
+		# Statistics of the last `decide_move`
+		self.depth = 0
+		self.nodes = 0
+		self.score = 0.
+
+		self.__killers: list[list[Optional[Move]]] = []
+		# __history[turn_sign > 0][VectorBoard action]
+		self.__history: list[list[int]] = [[0] * 72, [0] * 72]
+		self.__deadline = 0.
+
+	def __key(self, board: Board) -> int:
+		return board.zobrist ^ (board.moves_since_last_capture * _COUNTER_KEY & _MASK_64)
+
+	@staticmethod
+	def __material(board: Board) -> float:
+		code = board.code
+		positive, negative, kings = code & _SIDE_MASK, code >> 18 & _SIDE_MASK, code >> 36 & _SIDE_MASK
+		ret = positive.bit_count() - negative.bit_count() + \
+			(_KING_VALUE - 1) * ((positive & kings).bit_count() - (negative & kings).bit_count())
+		return ret * board.turn_sign
+
+	@staticmethod
+	def __terminal_score(board: Board, ply: int) -> float:
+		state = board.game_state
+		if state == GameState.DRAW:
+			return 0.
+		return (WIN_SCORE - ply) if state.value == board.turn_sign else -(WIN_SCORE - ply)
+
+	def __ordered_moves(self, board: Board, ply: int, tt_move: Optional[Move]) -> list[Move]:
+		moves = list(map(Board.decode_move, board.legal_moves().tolist()))
+		if len(moves) < 2:
+			return moves
+
+		killers = self.__killers[ply] if ply < len(self.__killers) else []
+		history = self.__history[board.turn_sign > 0]
+		last_row = 0 if board.turn_sign > 0 else Board.SIZE - 1
+
+		def priority(move: Move) -> tuple[int, int]:
+			s, e = move
+			if move == tt_move:
+				return (4, 0)
+			tactical = abs(e[0] - s[0]) == 2 or (abs(board[s]) == 1 and e[1] == last_row)
+			return (2 if tactical else 1 if move in killers else 0, history[VectorBoard.action(s, e)])
+
+		moves.sort(key=priority, reverse=True)
+		return moves
+
+	def __count_node(self) -> None:
+		self.nodes += 1
+		if self.node_limit is not None and self.nodes >= self.node_limit:
+			raise _OutOfBudget()
+		if self.time_limit is not None and self.nodes % 256 == 0 and time.perf_counter() > self.__deadline:
+			raise _OutOfBudget()
+
+	def __leaf(self, board: Board, ply: int) -> float:
+		"""
+		Returns: value of the position for the side to move
+		"""
+		if self.evaluator is None:
+			return self.__material(board)
+
+		moves, values = self.evaluator.evaluate_moves(board)
+		scores = (values + self.material_weight * self.__material(board)).tolist()
+		# Finished games are scored exactly instead of by the model
+		child = board.copy()
+		for i, (s, e) in enumerate(moves):
+			move = child.make_move(s, e)
+			if child.game_state != GameState.NOT_OVER:
+				score = self.__terminal_score(child, ply + 1)
+				scores[i] = score if child.turn_sign == board.turn_sign else -score
+			child.undo_move(move)
+
+		return max(scores)
+
+	def __search(self, board: Board, depth: int, alpha: float, beta: float, ply: int) -> float:
+		self.__count_node()
+		if board.game_state != GameState.NOT_OVER:
+			return self.__terminal_score(board, ply)
+		if depth <= 0 and (self.__leaf_sign is None or board.turn_sign == self.__leaf_sign):
+			return self.__leaf(board, ply)
+
+		key = self.__key(board)
+		entry = self.table.probe(key)
+		tt_move = None
+		if entry is not None:
+			entry_depth, value, bound, tt_move = entry
+			# Won scores are stored relative to the node
+			if abs(value) > _WON:
+				value -= ply if value > 0 else -ply
+			if entry_depth >= depth and (
+				bound == _EXACT or (bound == _LOWER and value >= beta) or (bound == _UPPER and value <= alpha)
+			):
+				return value
+
+		original_alpha = alpha
+		best_value = -float("inf")
+		best_move = None
+		for s, e in self.__ordered_moves(board, ply, tt_move):
+			move = board.make_move(s, e)
+			# The same side moves again in the middle of a multi-jump
+			if board.turn_sign == move.turn_sign:
+				value = self.__search(board, depth - 1, alpha, beta, ply + 1)
+			else:
+				value = -self.__search(board, depth - 1, -beta, -alpha, ply + 1)
+			board.undo_move(move)
+
+			if value > best_value:
+				best_value, best_move = value, (s, e)
+			alpha = max(alpha, value)
+			if alpha >= beta:
+				if not move.captured:
+					while len(self.__killers) <= ply:
+						self.__killers.append([None, None])
+					killers = self.__killers[ply]
+					if killers[0] != (s, e):
+						killers[1], killers[0] = killers[0], (s, e)
+				self.__history[board.turn_sign > 0][VectorBoard.action(s, e)] += depth * depth
+				break
+
+		bound = _UPPER if best_value <= original_alpha else _LOWER if best_value >= beta else _EXACT
+		stored = best_value + (ply if best_value > _WON else -ply if best_value < -_WON else 0)
+		self.table.store(key, depth, stored, bound, best_move)
+		return best_value
+
+	def __search_root(self, board: Board, depth: int, first: Optional[Move]) -> tuple[float, Move]:
+		alpha, beta = -float("inf"), float("inf")
+		best_move = None
+		for s, e in self.__ordered_moves(board, 0, first):
+			move = board.make_move(s, e)
+			if board.turn_sign == move.turn_sign:
+				value = self.__search(board, depth - 1, alpha, beta, 1)
+			else:
+				value = -self.__search(board, depth - 1, -beta, -alpha, 1)
+			board.undo_move(move)
+
+			if best_move is None or value > alpha:
+				alpha, best_move = value, (s, e)
+		return alpha, best_move
+
+	def decide_move(self, board: Board) -> Move:
+		board = board.copy()
+		self.__deadline = time.perf_counter() + (self.time_limit or 0.)
+		self.__killers = []
+		self.table.generation += 1
+		self.nodes = 0
+
+		moves = list(map(Board.decode_move, board.legal_moves().tolist()))
+		if not moves:
+			raise ValueError("Tried to ask for a move when there are no possible moves")
+		best_move = moves[0]
+		self.depth, self.score = 0, 0.
+
+		for depth in range(1, self.max_depth + 1):
+			try:
+				self.score, best_move = self.__search_root(board, depth, best_move)
+			except _OutOfBudget:
+				break
+			self.depth = depth
+			# Nothing changes once the result is known
+			if abs(self.score) > _WON:
+				break
+		return best_move
+
+	def __str__(self) -> str:
+		evaluator = "material" if self.evaluator is None else str(self.evaluator)
+		return f"Search player ({evaluator})"
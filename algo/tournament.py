@@ -0,0 +1,304 @@
+"""
+Parallel evaluation of one player against another.
+
+	python -m algo.tournament "dqn:models/#4 DQN 90_50_50_1 t.g. #3 84.448%.pth" random -n 50000 -o testing/dqn4_stats.pkl
+
+Games are split into shards of a fixed size, played by a pool of worker processes.
+Every shard is seeded from (seed, shard index) only, so the results do not depend on the number of workers,
+and an interrupted run continues from the shards already merged into the stats file.
+
+Player specs:
+* `random`
+* `dqn:<model path>[:<layer sizes>]`, e.g. `dqn:models/dqn_y87_90_52_1.pth:90,52,1`, read from the model if not given
+* `ddqn:<model path>[:<layer sizes>]`
+* `dynamic[:<save path without the .dynamicTable or .dynamicProgrammingSave suffix>]`
+
+The Q-learning players always make the same move in the same position, so without `--opening-plies`
+all the games of two of them on the same sides are the same game.
+With it the first moves of every game are random, seeded like the shards.
+"""
+
+import argparse
+import math
+import os
+import pickle
+import re
+import numpy as np
+import torch
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from os import PathLike
+from typing import Callable, Iterator, Optional
+
+from .board import Board, GameState
+from .iplayer import IPlayer, IRandomPlayer, RandomPlayer
+from .vector_board import VectorBoard
+from . import q_learning as ql
+from . import ddq_learning as ddqn
+from . import dynamicProgramming as dp
+
+_LAYER_SIZES = re.compile(r":(\d+(?:,\d+)+)$")
+
+class _Unpickler(pickle.Unpickler):
+	# Files written by the CLI before it ran through the package have the classes of `__main__`
+	def __init__(self, file, module: str) -> None:
+		super().__init__(file)
+		self.module = module
+
+	def find_class(self, module: str, name: str):
+		return super().find_class(self.module if module == "__main__" else module, name)
+
+def _load_pickle(path: PathLike | str, module: str):
+	"""
+	Loads a pickle, classes of `__main__` are taken from `module`
+	"""
+	with open(path, "rb") as f:
+		return _Unpickler(f, module).load()
+
+def model_layer_sizes(path: PathLike | str) -> list[int]:
+	"""
+	Returns: layer sizes of a saved `QLearning.DQN`, as expected by `QLearning`
+	"""
+	state_dict = torch.load(path, map_location="cpu")
+	weights = [state_dict[f"layers.{i}.weight"] for i in range(len(state_dict) // 2)]
+	return [weights[0].shape[1]] + [weight.shape[0] for weight in weights]
+
+def make_player(spec: str, seed: int = 0) -> IPlayer:
+	"""
+	Creates a player from its spec, see the module docstring
+	"""
+	kind, _, path = spec.partition(":")
+	layer_sizes: Optional[list[int]] = None
+	match = _LAYER_SIZES.search(path)
+	if match:
+		layer_sizes = [int(size) for size in match.group(1).split(",")]
+		path = path[:match.start()]
+
+	if kind == "random":
+		return RandomPlayer(seed)
+	if kind == "dynamic":
+		ret = dp.dynamicPlayer(seed=seed)
+		if path and not ret.load_model(path):
+			raise FileNotFoundError(f"No dynamic player save at {path}")
+		return ret
+	if kind in ("dqn", "ddqn") and path:
+		module = ql if kind == "dqn" else ddqn
+		return module.QLearning(path, layer_sizes or model_layer_sizes(path))
+
+	raise ValueError(f"Unknown player spec: {spec}")
+
+class RandomOpening(IPlayer):
+	"""
+	Lets the first `plies` moves of every game (of both sides) be random and `player` make the rest of them
+	"""
+
+	def __init__(self, player: IPlayer, plies: int, seed: int) -> None:
+		self.player = player
+		self.plies = plies
+		self.random = RandomPlayer(seed)
+
+	def decide_move(self, board: Board) -> tuple[tuple[int, int], tuple[int, int]]:
+		# A single board does not know how many moves were made
+		return self.player.decide_move(board)
+
+	def decide_moves(self, boards: VectorBoard, games: np.ndarray) -> np.ndarray:
+		opening = boards.moves[games] < self.plies
+		ret = np.zeros(len(games), dtype=np.int64)
+		if opening.any():
+			ret[opening] = self.random.decide_moves(boards, games[opening])
+		if not opening.all():
+			ret[~opening] = self.player.decide_moves(boards, games[~opening])
+		return ret
+
+	def __str__(self) -> str:
+		return f"{self.player} after {self.plies} random moves"
+
+def shard_seed(seed: int, shard: int, player: int) -> int:
+	return int(np.random.SeedSequence([seed, shard, player]).generate_state(1)[0])
+
+def shard_sizes(n_games: int, shard_size: int) -> list[tuple[int, int]]:
+	"""
+	Returns: (shard index, number of games) of every shard
+	"""
+	return [
+		(shard, min(shard_size, n_games - shard * shard_size))
+		for shard in range(math.ceil(n_games / shard_size))
+	]
+
+@dataclass
+class TournamentStats:
+	"""
+	Results of `player` against `enemy`, `player` playing for `sign`
+	"""
+	player: str
+	enemy: str
+	sign: int
+	seed: int
+	shard_size: int
+	# Random moves at the start of every game, see `RandomOpening`
+	opening_plies: int = 0
+
+	wins: int = 0
+	draws: int = 0
+	losses: int = 0
+	# lengths[n] - number of games that took n moves
+	lengths: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+	shards: set[int] = field(default_factory=set)
+
+	@property
+	def games(self) -> int:
+		return self.wins + self.draws + self.losses
+
+	@property
+	def win_rate(self) -> float:
+		return self.wins / self.games if self.games else 0.
+
+	def confidence_interval(self, z: float = 1.96) -> tuple[float, float]:
+		"""
+		Returns: Wilson score interval of the win rate, 95% by default
+		"""
+		n = self.games
+		if not n:
+			return 0., 1.
+		p = self.win_rate
+		center = p + z * z / (2 * n)
+		margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+		return (center - margin) / (1 + z * z / n), (center + margin) / (1 + z * z / n)
+
+	def is_same_run(self, other: 'TournamentStats') -> bool:
+		return (self.player, self.enemy, self.sign, self.seed, self.shard_size, self.opening_plies) == \
+			(other.player, other.enemy, other.sign, other.seed, other.shard_size, other.opening_plies)
+
+	def add_games(self, states: np.ndarray, lengths: np.ndarray) -> None:
+		self.wins += int((states == self.sign).sum())
+		self.losses += int((states == -self.sign).sum())
+		self.draws += int((states == GameState.DRAW.value).sum())
+		self.__add_lengths(np.bincount(lengths))
+
+	def merge(self, other: 'TournamentStats') -> None:
+		assert self.is_same_run(other) and not self.shards & other.shards
+		self.wins += other.wins
+		self.draws += other.draws
+		self.losses += other.losses
+		self.__add_lengths(other.lengths)
+		self.shards |= other.shards
+
+	def __add_lengths(self, lengths: np.ndarray) -> None:
+		size = max(len(self.lengths), len(lengths))
+		self.lengths = np.pad(self.lengths, (0, size - len(self.lengths))) + \
+			np.pad(lengths, (0, size - len(lengths)))
+
+	def save(self, path: PathLike | str) -> None:
+		# Written aside first, so an interrupted run never leaves a broken file
+		tmp_path = f"{path}.tmp"
+		with open(tmp_path, "wb") as f:
+			pickle.dump(self, f)
+		os.replace(tmp_path, path)
+
+	@staticmethod
+	def load(path: PathLike | str) -> 'TournamentStats':
+		return _load_pickle(path, __name__)
+
+	def __str__(self) -> str:
+		low, high = self.confidence_interval()
+		mean_length = (self.lengths * np.arange(len(self.lengths))).sum() / max(self.games, 1)
+		return f"{self.player} vs {self.enemy}: " \
+			f"W {self.wins} D {self.draws} L {self.losses}, " \
+			f"win rate {self.win_rate:.3%} [{low:.3%}, {high:.3%}], mean length {mean_length:.1f}"
+
+# Players of the worker process by (spec, index in the game), created once and reused by all its shards
+_players: dict[tuple[str, int], IPlayer] = {}
+
+def _init_worker() -> None:
+	# Workers already run in parallel, extra torch threads only fight over the cores
+	torch.set_num_threads(1)
+
+def _play_shard(specs: tuple[str, str], shard: int, n_games: int, sign: int, seed: int, n_parallel: int,
+		opening_plies: int = 0) -> tuple[int, np.ndarray, np.ndarray]:
+	players: list[IPlayer] = []
+	for i, spec in enumerate(specs):
+		if (spec, i) not in _players:
+			_players[(spec, i)] = make_player(spec)
+		player = _players[(spec, i)]
+		if isinstance(player, IRandomPlayer):
+			player.seed = shard_seed(seed, shard, i)
+			player.random.seed(player.seed)
+		players.append(player)
+	if opening_plies:
+		players = [RandomOpening(player, opening_plies, shard_seed(seed, shard, 2 + i)) for i, player in enumerate(players)]
+
+	player, enemy = players
+	positive, negative = (player, enemy) if sign == 1 else (enemy, player)
+	states, lengths = positive.do_rounds(negative, n_games, n_parallel)
+	return shard, states, lengths
+
+def play_shards(player: str, enemy: str, n_games: int, sign: int = -1, seed: int = 0, shard_size: int = 1000,
+		workers: Optional[int] = None, n_parallel: int = 256, skip: set[int] = set(), opening_plies: int = 0) -> Iterator[TournamentStats]:
+	"""
+	Plays `n_games` games of `player` against `enemy` (both given by spec) in worker processes
+
+	Returns: stats of every shard, as soon as it is finished
+	"""
+	shards = [(shard, size) for shard, size in shard_sizes(n_games, shard_size) if shard not in skip]
+	if not shards:
+		return
+
+	with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+		futures = [
+			executor.submit(_play_shard, (player, enemy), shard, size, sign, seed, n_parallel, opening_plies)
+			for shard, size in shards
+		]
+		for future in as_completed(futures):
+			shard, states, lengths = future.result()
+			ret = TournamentStats(player, enemy, sign, seed, shard_size, opening_plies, shards={shard})
+			ret.add_games(states, lengths)
+			yield ret
+
+def run_tournament(player: str, enemy: str, n_games: int, sign: int = -1, seed: int = 0, shard_size: int = 1000,
+		workers: Optional[int] = None, n_parallel: int = 256, path: Optional[PathLike | str] = None,
+		on_shard: Optional[Callable[[TournamentStats], None]] = None, opening_plies: int = 0) -> TournamentStats:
+	"""
+	Same as `play_shards`, but merges the shards into a single stats object.
+	If `path` is given, the stats are saved there after every shard and the shards already saved are not replayed
+	"""
+	ret = TournamentStats(player, enemy, sign, seed, shard_size, opening_plies)
+	if path is not None and os.path.exists(path):
+		saved = TournamentStats.load(path)
+		if saved.is_same_run(ret):
+			ret = saved
+
+	for shard_stats in play_shards(player, enemy, n_games, sign, seed, shard_size, workers, n_parallel, ret.shards, opening_plies):
+		ret.merge(shard_stats)
+		if path is not None:
+			ret.save(path)
+		if on_shard is not None:
+			on_shard(ret)
+	return ret
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Plays one player against another in parallel")
+	parser.add_argument("player", help="player spec, see the module docstring")
+	parser.add_argument("enemy", help="enemy spec")
+	parser.add_argument("-n", "--games", type=int, default=50000)
+	parser.add_argument("--sign", type=int, choices=(-1, 1), default=-1, help="side of the player, positive moves first")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--shard-size", type=int, default=1000)
+	parser.add_argument("--workers", type=int, default=None)
+	parser.add_argument("--parallel", type=int, default=256, help="games played at once by every worker")
+	parser.add_argument("--opening-plies", type=int, default=0, help="random moves at the start of every game")
+	parser.add_argument("-o", "--output", default=None, help="stats pickle, also used to resume the run")
+	args = parser.parse_args()
+
+	stats = run_tournament(
+		args.player, args.enemy, args.games, args.sign, args.seed, args.shard_size,
+		args.workers, args.parallel, args.output,
+		lambda stats: print(f"{stats.games}/{args.games} {stats}", flush=True),
+		args.opening_plies
+	)
+	print(stats)
+
+if __name__ == "__main__":
+	# Run through the package module, so the saved stats are of `algo.tournament.TournamentStats` and not of `__main__`
+	from algo.tournament import main
+	main()
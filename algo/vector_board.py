@@ -0,0 +1,312 @@
+import numpy as np
+import torch
+
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from .board import Board, GameState, _s, _SQUARES, _INDEX, _DIRECTIONS, _STEP, _JUMP, _PIECE_DIRECTIONS
+from .bitboard import _SHIFTS
+
+# Action a moves the piece from square a // 4 in direction a % 4 (`_DIRECTIONS` order).
+# Same as `Board.get_correct_moves`, it is a jump if there is an enemy on the way and a step otherwise
+N_ACTIONS = 18 * 4
+_ACTION_SQUARE = np.arange(N_ACTIONS) // 4
+_ACTION_STEP = np.array([_STEP[a % 4][a // 4] for a in range(N_ACTIONS)])
+_ACTION_JUMP = np.array([_JUMP[a % 4][a // 4] for a in range(N_ACTIONS)])
+# Off board targets are clipped to a valid square and masked out by the `_OK` masks
+_ACTION_STEP_OK = _ACTION_STEP >= 0
+_ACTION_JUMP_OK = _ACTION_JUMP >= 0
+_ACTION_CAPTURE_OK = _ACTION_STEP_OK & _ACTION_JUMP_OK
+_ACTION_STEP_CLIPPED = np.maximum(_ACTION_STEP, 0)
+_ACTION_JUMP_CLIPPED = np.maximum(_ACTION_JUMP, 0)
+
+# _MAN_ALLOWED[sign > 0, a] - if a man of the sign may move in the direction of action a, kings move anywhere
+_MAN_ALLOWED = np.array([
+	[a % 4 in _PIECE_DIRECTIONS[2 + sign] for a in range(N_ACTIONS)]
+	for sign in (-1, 1)
+])
+_ROW = np.array([y for _, y in _SQUARES])
+
+_START = np.array([-1] * 6 + [0] * 6 + [1] * 6, dtype=np.int8)
+
+def _side(sign: np.ndarray) -> np.ndarray:
+	# Column of `VectorBoard.should_capture` for the sign
+	return (sign > 0).astype(np.intp)
+
+_BITS = np.uint64(1) << np.arange(18, dtype=np.uint64)
+_FULL = np.uint64((1 << 18) - 1)
+
+def _pack(pieces: np.ndarray, turn: np.ndarray, should_capture: np.ndarray) -> np.ndarray:
+	# Same layout as `Board.code`
+	positive = (pieces > 0).astype(np.uint64) @ _BITS
+	negative = (pieces < 0).astype(np.uint64) @ _BITS
+	kings = (np.abs(pieces) == 2).astype(np.uint64) @ _BITS
+	return positive | negative << np.uint64(18) | kings << np.uint64(36) | \
+		(turn > 0).astype(np.uint64) << np.uint64(54) | \
+		should_capture[:, 0].astype(np.uint64) << np.uint64(55) | \
+		should_capture[:, 1].astype(np.uint64) << np.uint64(56)
+
+def _shift(masks: np.ndarray, d: int) -> np.ndarray:
+	# Same as `bitboard._shift`, for arrays of masks
+	ret = np.zeros_like(masks)
+	for src_mask, delta in _SHIFTS[d]:
+		moved = masks & np.uint64(src_mask)
+		ret |= moved << np.uint64(delta) if delta > 0 else moved >> np.uint64(-delta)
+	return ret
+
+def _has_capture(men: np.ndarray, kings: np.ndarray, enemy: np.ndarray, empty: np.ndarray, sign: int) -> np.ndarray:
+	# Same as `BitBoard.__has_capture`, for arrays of masks
+	ret = np.zeros(len(men), dtype=bool)
+	for d in range(4):
+		movers = kings | men if d in _PIECE_DIRECTIONS[2 + sign] else kings
+		ret |= (_shift(_shift(movers, d) & enemy, d) & empty) != 0
+	return ret
+
+def _unpack(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	codes = codes.astype(np.uint64)[:, None]
+	positive = (codes >> np.arange(18, dtype=np.uint64)) & np.uint64(1)
+	negative = (codes >> np.arange(18, 36, dtype=np.uint64)) & np.uint64(1)
+	kings = (codes >> np.arange(36, 54, dtype=np.uint64)) & np.uint64(1)
+	pieces = ((positive.astype(np.int8) - negative.astype(np.int8)) * (1 + kings.astype(np.int8))).astype(np.int8)
+
+	flags = codes[:, 0]
+	turn = np.where((flags >> np.uint64(54)) & np.uint64(1), 1, -1).astype(np.int8)
+	should_capture = np.stack([(flags >> np.uint64(55)) & np.uint64(1), (flags >> np.uint64(56)) & np.uint64(1)], 1).astype(bool)
+	return pieces, turn, should_capture
+
+def _moves(pieces: np.ndarray, sign: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Returns: (captures, steps) masks of shape (N, N_ACTIONS) for the pieces of `sign` in every game
+	"""
+	# Pieces are multiplied by the sign, so own men are 1 and own kings are 2
+	sign = sign.astype(np.int8)[:, None]
+	own = pieces[:, _ACTION_SQUARE] * sign
+	movable = (own == 2) | ((own == 1) & _MAN_ALLOWED[_side(sign[:, 0])])
+
+	step = pieces[:, _ACTION_STEP_CLIPPED] * sign
+	jump = pieces[:, _ACTION_JUMP_CLIPPED]
+	captures = movable & _ACTION_CAPTURE_OK & (step < 0) & (jump == 0)
+	steps = movable & _ACTION_STEP_OK & (step == 0)
+	return captures, steps
+
+# There are no captures in the starting position
+_START_LEGAL = _moves(_START[None], np.ones(1))[1][0]
+
+def segment_argmax(values: torch.Tensor, segments: torch.Tensor, n: int) -> torch.Tensor:
+	"""
+	`values` are grouped into `n` segments by their (sorted) segment index.
+
+	Returns: index of the first maximal value of every segment
+	"""
+	max_values = torch.full((n,), -torch.inf, dtype=values.dtype, device=values.device) \
+		.scatter_reduce(0, segments, values, "amax")
+	positions = torch.arange(len(values), device=values.device)
+	candidates = torch.where(values == max_values[segments], positions, len(values))
+	return torch.full((n,), len(values), device=values.device).scatter_reduce(0, segments, candidates, "amin")
+
+@dataclass
+class VectorMoveResult:
+	captured: np.ndarray
+	promoted: np.ndarray
+	# `GameState` value of the games, that have just ended, 0 for the rest
+	finished: np.ndarray
+	# Number of moves made in the games, that have just ended
+	lengths: np.ndarray
+
+@dataclass
+class VectorChildren:
+	"""
+	All states reachable with one move from some games of a `VectorBoard`
+	"""
+	# Position of the parent game in the `games` given to `VectorBoard.children`
+	parent: np.ndarray
+	action: np.ndarray
+	pieces: np.ndarray
+	turn: np.ndarray
+	should_capture: np.ndarray
+	moves_since_last_capture: np.ndarray
+	captured: np.ndarray
+	promoted: np.ndarray
+
+	def codes(self) -> np.ndarray:
+		"""
+		Returns: `Board.code` of every child
+		"""
+		return _pack(self.pieces, self.turn, self.should_capture)
+
+	def __getitem__(self, index: np.ndarray) -> 'VectorChildren':
+		"""
+		Returns: the children at the given positions, `parent` is kept as is
+		"""
+		return VectorChildren(*(getattr(self, field.name)[index] for field in fields(self)))
+
+class VectorBoard:
+	"""
+	N games stored as NumPy arrays and played in lockstep, with the same rules as `Board`
+	(the should capture rule is always enabled).
+
+	Moves are `N_ACTIONS` action indexes, see `VectorBoard.action`.
+	Finished games are reset automatically by `make_moves`, unless `auto_reset` is disabled.
+	"""
+
+	def __init__(self, n_games: int, auto_reset: bool = True) -> None:
+		self.n_games = n_games
+		self.auto_reset = auto_reset
+
+		self.pieces = np.tile(_START, (n_games, 1))
+		self.turn = np.ones(n_games, dtype=np.int8)
+		# [:, 0] - negative player should capture, [:, 1] - positive one
+		self.should_capture = np.zeros((n_games, 2), dtype=bool)
+		self.moves_since_last_capture = np.zeros(n_games, dtype=np.int16)
+		self.game_state = np.zeros(n_games, dtype=np.int8)
+		self.moves = np.zeros(n_games, dtype=np.int32)
+
+		self.__legal_moves: Optional[np.ndarray] = None
+
+	def reset(self, games: Optional[np.ndarray] = None) -> None:
+		games = np.arange(self.n_games) if games is None else games
+		self.pieces[games] = _START
+		self.turn[games] = 1
+		self.should_capture[games] = False
+		self.moves_since_last_capture[games] = 0
+		self.game_state[games] = GameState.NOT_OVER.value
+		self.moves[games] = 0
+		if self.__legal_moves is not None:
+			self.__legal_moves[games] = _START_LEGAL
+
+	@staticmethod
+	def __legal(pieces: np.ndarray, turn: np.ndarray, should_capture: np.ndarray) -> np.ndarray:
+		captures, steps = _moves(pieces, turn)
+		return captures | (steps & ~should_capture[np.arange(len(turn)), _side(turn)][:, None])
+
+	def legal_moves(self) -> np.ndarray:
+		"""
+		Returns: mask of shape (N, N_ACTIONS) of the correct moves of the side to move
+		"""
+		if self.__legal_moves is None:
+			self.__legal_moves = self.__legal(self.pieces, self.turn, self.should_capture)
+		return self.__legal_moves
+
+	@staticmethod
+	def __apply(pieces: np.ndarray, turn: np.ndarray, should_capture: np.ndarray, moves_since_last_capture: np.ndarray, actions: np.ndarray):
+		# Array version of `Board.make_move`, the arguments are left untouched
+		rows = np.arange(len(actions))
+		pieces = pieces.copy()
+
+		start = _ACTION_SQUARE[actions]
+		step = _ACTION_STEP[actions]
+		piece = pieces[rows, start]
+
+		had_to_capture = should_capture[rows, _side(turn)]
+		end = np.where(had_to_capture, _ACTION_JUMP[actions], step)
+
+		captured = np.where(had_to_capture, np.abs(pieces[rows, step]), 0).astype(np.int8)
+		pieces[rows[had_to_capture], step[had_to_capture]] = 0
+		moves_since_last_capture = np.where(had_to_capture, 0, moves_since_last_capture + 1).astype(np.int16)
+
+		promoted = ((piece == 1) & (_ROW[end] == 0)) | ((piece == -1) & (_ROW[end] == Board.SIZE - 1))
+		pieces[rows, start] = 0
+		pieces[rows, end] = np.where(promoted, 2 * piece, piece)
+
+		# The should capture flags are computed on bit masks, same as in `BitBoard`
+		masks = {piece: (pieces == piece).astype(np.uint64) @ _BITS for piece in (-2, -1, 1, 2)}
+		positive, negative = masks[1] | masks[2], masks[-1] | masks[-2]
+		empty = ~(positive | negative) & _FULL
+		should_capture = np.stack([
+			_has_capture(masks[-1], masks[-2], positive, empty, -1),
+			_has_capture(masks[1], masks[2], negative, empty, 1),
+		], 1)
+
+		# The turn is kept, if the same piece could capture again
+		at_end = _BITS[end]
+		capture_again = had_to_capture & should_capture[rows, _side(turn)] & np.where(
+			turn > 0,
+			_has_capture(masks[1] & at_end, masks[2] & at_end, negative, empty, 1),
+			_has_capture(masks[-1] & at_end, masks[-2] & at_end, positive, empty, -1),
+		)
+		turn = np.where(capture_again, turn, -turn).astype(np.int8)
+
+		return pieces, turn, should_capture, moves_since_last_capture, captured, promoted
+
+	@staticmethod
+	def __game_state(pieces: np.ndarray, turn: np.ndarray, legal_moves: np.ndarray, moves_since_last_capture: np.ndarray) -> np.ndarray:
+		has_moves = legal_moves.any(1)
+		own_pieces = (np.sign(pieces) == turn[:, None]).any(1)
+		enemy_pieces = (np.sign(pieces) == -turn[:, None]).any(1)
+
+		# Same checks as `Board.game_state`, from the least important one
+		ret = np.where(has_moves, GameState.NOT_OVER.value, -turn)
+		ret = np.where(enemy_pieces, ret, turn)
+		ret = np.where(own_pieces, ret, -turn)
+		ret = np.where(moves_since_last_capture >= Board.DRAW_NON_CAPTURE_MOVES, GameState.DRAW.value, ret)
+		return ret.astype(np.int8)
+
+	def make_moves(self, actions: np.ndarray) -> VectorMoveResult:
+		"""
+		Makes a move in every game. **Warning**: no checks are performed, see `Board.make_move`
+		"""
+		self.pieces, self.turn, self.should_capture, self.moves_since_last_capture, captured, promoted = self.__apply(
+			self.pieces, self.turn, self.should_capture, self.moves_since_last_capture, actions)
+		self.__legal_moves = self.__legal(self.pieces, self.turn, self.should_capture)
+		self.game_state = self.__game_state(self.pieces, self.turn, self.__legal_moves, self.moves_since_last_capture)
+		self.moves += 1
+
+		ret = VectorMoveResult(captured, promoted, self.game_state.copy(), self.moves.copy())
+		finished = ret.finished != GameState.NOT_OVER.value
+		ret.lengths[~finished] = 0
+		if self.auto_reset and finished.any():
+			self.reset(np.flatnonzero(finished))
+		return ret
+
+	def children(self, games: np.ndarray) -> VectorChildren:
+		"""
+		The games must not be over.
+
+		Returns: all states reachable with one correct move from the given games,
+		ordered by game and then by action (the order of `Board.get_possible_pos` and `Board.get_correct_moves`)
+		"""
+		parent, actions = np.nonzero(self.legal_moves()[games])
+		game = games[parent]
+		pieces, turn, should_capture, moves_since_last_capture, captured, promoted = self.__apply(
+			self.pieces[game], self.turn[game], self.should_capture[game], self.moves_since_last_capture[game], actions)
+		return VectorChildren(parent, actions, pieces, turn, should_capture, moves_since_last_capture, captured, promoted)
+
+	def codes(self) -> np.ndarray:
+		"""
+		Returns: `Board.code` of every game
+		"""
+		return _pack(self.pieces, self.turn, self.should_capture)
+
+	@classmethod
+	def from_codes(cls, codes: np.ndarray, moves_since_last_capture: Optional[np.ndarray] = None) -> 'VectorBoard':
+		"""
+		Creates games from `Board.code` values, `auto_reset` is disabled
+		"""
+		ret = cls(len(codes), auto_reset=False)
+		ret.pieces, ret.turn, ret.should_capture = _unpack(codes)
+		if moves_since_last_capture is not None:
+			ret.moves_since_last_capture = moves_since_last_capture.astype(np.int16)
+		ret.game_state = cls.__game_state(ret.pieces, ret.turn, ret.legal_moves(), ret.moves_since_last_capture)
+		return ret
+
+	@staticmethod
+	def action(start: tuple[int, int], end: tuple[int, int]) -> int:
+		direction = _DIRECTIONS.index((_s(end[0] - start[0]), _s(end[1] - start[1])))
+		return _INDEX[start[0], start[1]] * 4 + direction
+
+	def move(self, game: int, action: int) -> tuple[tuple[int, int], tuple[int, int]]:
+		"""
+		Returns: (start, end) of the action in the given game, as expected by `Board.make_move`
+		"""
+		step = _ACTION_STEP[action]
+		is_jump = _s(self.pieces[game, step]) == -self.turn[game]
+		return _SQUARES[_ACTION_SQUARE[action]], _SQUARES[_ACTION_JUMP[action] if is_jump else step]
+
+	def board(self, game: int) -> Board:
+		return Board.from_num_repr(bytes([
+			True,
+			int(self.moves_since_last_capture[game]),
+			int(self.turn[game] == 1),
+			int(self.should_capture[game, 0]),
+			int(self.should_capture[game, 1]),
+		]) + (self.pieces[game] + 2).astype(np.uint8).tobytes())
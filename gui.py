@@ -7,18 +7,23 @@ from imgui.integrations.glfw import GlfwRenderer
 
 import sys
 from time import sleep
-import json
 
-import algo.board
 import algo.iplayer as iplayer
 
 from gui_parts.utils import disabled_block
 from gui_parts.ui_state import UIState
 from gui_parts.tree_vis import TreeVis
 from gui_parts.models_menu import ModelsMenu
+from gui_parts.render_model import RenderModel
+
+# Longest wait for events with the event driven redraw
+IDLE_REDRAW_TIMEOUT = 1.
+# Frames drawn without waiting after every wake up, imgui needs a few of them to settle hover and popup states
+SETTLE_FRAMES = 2
 		
 
-def draw_board(state: UIState, pos: tuple[float, float], available_size: tuple[float, float], gap_portion: float = 0.07) -> None:
+def draw_board(state: UIState, render: RenderModel, pos: tuple[float, float], available_size: tuple[float, float], gap_portion: float = 0.07) -> None:
+	waiting_user_input = state.waiting_user_input
 	used_size = min(available_size)
 	d = 10
 	size = (used_size - (state.board.SIZE + 1) * d) / (state.board.SIZE * (1 + gap_portion) + gap_portion)
@@ -31,7 +36,6 @@ def draw_board(state: UIState, pos: tuple[float, float], available_size: tuple[f
 		for x in range(6):
 			pos = (x, y)
 			piece = state.board[pos]
-			sign = algo.board._s(piece)
 			imgui.set_cursor_pos_x(x_c)
 			imgui.set_cursor_pos_y(y_c)
 
@@ -62,7 +66,7 @@ def draw_board(state: UIState, pos: tuple[float, float], available_size: tuple[f
 			if piece == 0:
 				imgui.image_button(state.textures[0].enabled_texture_id, size - 2, size)
 			else:
-				if sign == state.board.turn_sign and state.waiting_user_input and next(state.board.get_correct_moves(pos), None):
+				if waiting_user_input and pos in render.movable:
 					imgui.image_button(state.textures[piece].enabled_texture_id, size - 2, size)
 				else:
 					imgui.image_button(state.textures[piece].disabled_texture_id, size - 2, size)
@@ -101,19 +105,31 @@ def main():
 
 	# INIT STAGE
 	state = UIState()
+	state.wake = glfw.post_empty_event
+	render = RenderModel(state)
 	imgui.get_io().font_global_scale = 1.5
 
 	tree_vis = TreeVis(state)
 	models_menu = ModelsMenu(state)
 
 	# MAIN LOOP
+	# The first frames are drawn at once
+	settle_frames = SETTLE_FRAMES
 	while not glfw.window_should_close(window):
-		glfw.poll_events()
+		timeout = state.time_to_update()
+		if state.event_driven_redraw and not settle_frames and (timeout is None or timeout > 0):
+			glfw.wait_events_timeout(IDLE_REDRAW_TIMEOUT if timeout is None else min(timeout, IDLE_REDRAW_TIMEOUT))
+			settle_frames = SETTLE_FRAMES
+		else:
+			glfw.poll_events()
+			settle_frames = max(settle_frames - 1, 0)
 		impl.process_inputs()
+		state.update()
+		render.update()
 
 		imgui.new_frame()
 
-		turn_name = "positive" if state.board.turn_sign > 0 else "negative"
+		turn_name = render.turn_name
 
 		# Board window
 		# https://github.com/ocornut/imgui/issues/6872
@@ -122,6 +138,7 @@ def main():
 		imgui.set_window_position(10, 50, imgui.ONCE)
 		draw_board(
 			state,
+			render,
 			imgui.get_cursor_pos(),
 			imgui.get_content_region_available()
 		)
@@ -154,24 +171,28 @@ def main():
 			imgui.set_window_size(500, 600)
 			imgui.set_window_position(510, 50, imgui.APPEARING)
 
-			_, state.board.enable_update_should_capture = imgui.checkbox(
+			changed, value = imgui.checkbox(
 				"Enable should capture rule", state.board.enable_update_should_capture)
+			if changed:
+				state.set_should_capture_rule(value)
 
 			imgui.separator()
-			imgui.text(f"{state.board.game_state}, turn: {turn_name}")
-			imgui.text(f"Turns without captures: {state.board.moves_since_last_capture}")
+			imgui.text(f"{render.game_state}, turn: {turn_name}")
+			imgui.text(f"Turns without captures: {render.moves_since_last_capture}")
 
 			imgui.separator()
-			imgui.text(f"Computer working: {state.worker_thread_is_working}")
+			imgui.text(f"Computer working: {state.computer_is_working}, thinking: {state.computer_is_thinking}")
+			if state.computer_status:
+				imgui.text(state.computer_status)
 
-			with disabled_block(state.worker_thread_is_working or not state.can_do_computer_step):
+			with disabled_block(state.computer_is_working or not state.can_do_computer_step):
 				if imgui.button("Computer step"):
-					state.worker_thread_event.set()
+					state.start_computer()
 			
-			with disabled_block(not state.worker_thread_is_working):
+			with disabled_block(not state.computer_is_working):
 				imgui.same_line()
 				if imgui.button("Stop computer"):
-					state.worker_thread_is_working = False
+					state.stop_computer()
 			
 
 			if imgui.button("Reset board"):
@@ -185,9 +206,16 @@ def main():
 			_, state.automatic_computer_step = imgui.checkbox(
 				"Automatic computer step", state.automatic_computer_step)
 
+			_, state.event_driven_redraw = imgui.checkbox(
+				"Redraw only on events", state.event_driven_redraw)
+
+			imgui.set_next_item_width(imgui.get_content_region_available_width() * 0.4)
+			_, state.computer_step_delay = imgui.slider_float(
+				"Computer step delay", state.computer_step_delay, 0, 5)
+
 			imgui.set_next_item_width(imgui.get_content_region_available_width() * 0.4)
-			_, state.worker_thread_delay = imgui.slider_float(
-				"Computer step delay", state.worker_thread_delay, 0, 5)
+			_, state.computer_time_limit = imgui.slider_float(
+				"Computer time limit (s)", state.computer_time_limit, 1, 120)
 
 			# Players selection
 			imgui.separator()
@@ -213,21 +241,18 @@ def main():
 						player_names
 					)
 					if changed:
-						state.player_i[i] = new_val
+						state.select_player(i, new_val)
 			
 			imgui.separator()
-			imgui.text(f"Board hash: {int(state.board)}")
-			imgui.text(f"State:\n{state.board}")
+			imgui.text(f"Board hash: {render.board_hash}")
+			imgui.text(f"State:\n{render.board_str}")
 
 			imgui.separator()
-			imgui.text(f"Should capture:\npositive: {state.board.check_should_capture(1)}\nnegative: {state.board.check_should_capture(-1)}")
+			imgui.text(f"Should capture:\npositive: {render.should_capture[1]}\nnegative: {render.should_capture[-1]}")
 
 			imgui.separator()
 			imgui.text("Correct moves cache:")
-			imgui.text(json.dumps(
-				{repr(k): v for (k,v) in state.board.get_correct_moves_cache().items()},
-				indent=2
-			))
+			imgui.text(render.correct_moves_cache)
 			
 			imgui.separator()
 			changed, value = imgui.slider_float("Scale", imgui.get_io().font_global_scale, 0.3, 2.0)
@@ -245,7 +270,8 @@ def main():
 		imgui.render()
 		impl.render(imgui.get_draw_data())
 		glfw.swap_buffers(window)
-		sleep(10e-3)
+		if not state.event_driven_redraw:
+			sleep(10e-3)
 
 	del state
 	impl.shutdown()
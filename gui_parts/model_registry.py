@@ -0,0 +1,136 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Optional
+
+import torch
+
+from algo.iplayer import IPlayer
+
+class LoadState(Enum):
+	NOT_LOADED = 0
+	LOADING = 1
+	LOADED = 2
+	FAILED = 3
+
+@dataclass
+class PlayerDescriptor:
+	"""
+	What is known about a player before it is created
+	"""
+	name: str
+	# Creates the player, called on the loading thread
+	factory: Callable[[], IPlayer]
+	# Cheap players are created at once
+	eager: bool = False
+
+class StateDictCache:
+	"""
+	LRU cache of the loaded checkpoints by the hashes of their files, identical checkpoints share the same tensors
+	"""
+
+	def __init__(self, size: int = 8) -> None:
+		self.size = size
+		self.__state_dicts: OrderedDict[str, dict] = OrderedDict()
+		self.__lock = threading.Lock()
+
+	def load(self, path: str) -> dict:
+		with open(path, "rb") as f:
+			data = f.read()
+		digest = hashlib.sha256(data).hexdigest()
+
+		with self.__lock:
+			if digest in self.__state_dicts:
+				self.__state_dicts.move_to_end(digest)
+				return self.__state_dicts[digest]
+
+		state_dict = torch.load(io.BytesIO(data), map_location="cpu")
+		with self.__lock:
+			state_dict = self.__state_dicts.setdefault(digest, state_dict)
+			self.__state_dicts.move_to_end(digest)
+			if len(self.__state_dicts) > self.size:
+				self.__state_dicts.popitem(last=False)
+		return state_dict
+
+class ModelRegistry:
+	"""
+	Players of the GUI by their indexes, every player is created on a background thread when it is first asked for
+	"""
+
+	def __init__(self, descriptors: list[PlayerDescriptor], on_loaded: Callable[[], None] = lambda: None) -> None:
+		"""
+		`on_loaded` - called on the loading thread after every loading, finished or failed
+		"""
+		self.descriptors = descriptors
+		self.on_loaded = on_loaded
+		self.__players: list[Optional[IPlayer]] = [
+			descriptor.factory() if descriptor.eager else None
+			for descriptor in descriptors
+		]
+		self.__loading: dict[int, Future] = {}
+		self.__errors: dict[int, BaseException] = {}
+		self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model loading")
+
+	def __len__(self) -> int:
+		return len(self.descriptors)
+
+	def __collect(self, index: int) -> None:
+		# Takes the player of a finished loading
+		future = self.__loading.get(index)
+		if future is None or not future.done():
+			return
+		del self.__loading[index]
+		error = future.exception()
+		if error is None:
+			self.__players[index] = future.result()
+		else:
+			self.__errors[index] = error
+
+	def state(self, index: int) -> LoadState:
+		self.__collect(index)
+		if self.__players[index] is not None:
+			return LoadState.LOADED
+		if index in self.__loading:
+			return LoadState.LOADING
+		if index in self.__errors:
+			return LoadState.FAILED
+		return LoadState.NOT_LOADED
+
+	def error(self, index: int) -> Optional[BaseException]:
+		return self.__errors.get(index)
+
+	def request(self, index: int) -> None:
+		"""
+		Starts creating the player unless it is already there, being created or failed to be created
+		"""
+		if self.state(index) == LoadState.NOT_LOADED:
+			future = self.__executor.submit(self.descriptors[index].factory)
+			future.add_done_callback(lambda _: self.on_loaded())
+			self.__loading[index] = future
+
+	def get(self, index: int) -> Optional[IPlayer]:
+		"""
+		Returns: the player, `None` while it is not loaded yet (the loading is started then)
+		"""
+		self.request(index)
+		return self.__players[index]
+
+	def loaded(self) -> list[IPlayer]:
+		for index in list(self.__loading):
+			self.__collect(index)
+		return [player for player in self.__players if player is not None]
+
+	def name(self, index: int) -> str:
+		state = self.state(index)
+		if state == LoadState.LOADING:
+			return f"{self.descriptors[index].name} (loading...)"
+		if state == LoadState.FAILED:
+			return f"{self.descriptors[index].name} (failed)"
+		return self.descriptors[index].name
+
+	def shutdown(self) -> None:
+		self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,7 @@
 import imgui
 
 from .ui_state import UIState
+from .utils import disabled_block
 from algo.iplayer import IPlayer, IRandomPlayer, ITrainablePlayer
 
 class ModelsMenu:
@@ -16,7 +17,8 @@ class ModelsMenu:
 		self.training_enemy_index = state.player_i[-1]
 
 	def reset_seeds(self) -> None:
-		for player in self.state.players:
+		# Players loaded later keep their own seeds
+		for player in self.state.players.loaded():
 			if isinstance(player, IRandomPlayer):
 				player.seed = self.__all_training_seeds_input
 
@@ -44,7 +46,9 @@ class ModelsMenu:
 				"##all_training_seeds_input", self.__all_training_seeds_input)
 
 
-			selected_model = self.state.players[self.selected_model]
+			selected_model = self.state.players.get(self.selected_model)
+			if selected_model is None:
+				imgui.text(self.state.get_player_list_name(self.selected_model))
 
 			if isinstance(selected_model, ITrainablePlayer):
 				imgui.separator()
@@ -59,11 +63,14 @@ class ModelsMenu:
 				_, self.training_steps = imgui.input_int(
 					"##training_steps", self.training_steps)
 				
+				enemy = self.state.players.get(self.training_enemy_index)
 				imgui.same_line()
-				if imgui.button("Do training"):
+				with disabled_block(enemy is None):
+					clicked = imgui.button("Do training")
+				if clicked and enemy is not None:
 					for i in range(self.training_steps):
-						selected_model.do_training_round(self.state.players[self.training_enemy_index], 1)
-						selected_model.do_training_round(self.state.players[self.training_enemy_index], -1)
+						selected_model.do_training_round(enemy, 1)
+						selected_model.do_training_round(enemy, -1)
 					
 					selected_model.save_model("")
 
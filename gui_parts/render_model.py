@@ -0,0 +1,47 @@
+import json
+from typing import Optional
+
+from algo.board import Board, GameState
+from .ui_state import UIState
+
+class RenderModel:
+	"""
+	Data the windows show about the board, recomputed only when `UIState.board_version` changes instead of every frame
+	"""
+
+	def __init__(self, state: UIState) -> None:
+		self.state = state
+		self.__board_version: Optional[int] = None
+		self.__selected_pos: Optional[tuple] = None
+
+		self.movable: set[tuple[int, int]] = set()
+		self.game_state = GameState.NOT_OVER
+		self.turn_name = ""
+		self.moves_since_last_capture = 0
+		self.board_hash = 0
+		self.board_str = ""
+		self.should_capture: dict[int, bool] = {}
+		self.correct_moves_cache = ""
+
+	def update(self) -> None:
+		board = self.state.board
+		if self.__board_version != self.state.board_version:
+			self.__board_version = self.state.board_version
+			# Pieces of the player to move that have a correct move
+			self.movable = {Board.decode_move(move)[0] for move in board.legal_moves().tolist()}
+			self.game_state = board.game_state
+			self.turn_name = "positive" if board.turn_sign > 0 else "negative"
+			self.moves_since_last_capture = board.moves_since_last_capture
+			self.board_hash = int(board)
+			self.board_str = str(board)
+			self.should_capture = {sign: board.check_should_capture(sign) for sign in (1, -1)}
+			self.__selected_pos = None
+		elif self.__selected_pos == self.state.selected_pos:
+			return
+
+		# Selecting a piece fills the cache of its correct moves
+		self.__selected_pos = self.state.selected_pos
+		self.correct_moves_cache = json.dumps(
+			{repr(k): v for (k,v) in board.get_correct_moves_cache().items()},
+			indent=2
+		)
@@ -1,20 +1,37 @@
 import imgui
+import numpy as np
 
-import pickle
 import pathlib
+import queue
+import threading
+from collections import OrderedDict
 from typing import Optional
 
 from algo.board import Board
+from algo.brute_force import StateGraph
 from .ui_state import UIState
 from .utils import ROOT_DIR
 
 class TreeVis:
-	def __init__(self, state: UIState) -> None:
+	# Number of nodes whose decoded parents and children are kept
+	CACHE_SIZE = 1024
+
+	def __init__(self, state: UIState, graph_path: pathlib.Path = ROOT_DIR / "states") -> None:
+		"""
+		`graph_path` - directory of the graph enumerated by `algo.brute_force`
+		"""
 		self.ui_state = state
-		self.parent_tree: Optional[dict[int, set[int]]] = None
-		self.__parent_tree_size = 0
+		self.graph_path = graph_path
+		self.graph: Optional[StateGraph] = None
+		self.__status = ""
 		self.show_window = False
 
+		self.__neighbourhoods: OrderedDict[int, tuple[list[Board], list[Board]]] = OrderedDict()
+		self.__neighbourhoods_lock = threading.Lock()
+		# Selected nodes, `None` stops the prefetch thread
+		self.__prefetch_queue: queue.Queue[Optional[int]] = queue.Queue()
+		self.__prefetch_thread: Optional[threading.Thread] = None
+
 		self.__me_integer_input = "1461501724784805657539772557023077283449775784707"
 
 		self.parents: list[Board] = [Board()]
@@ -51,37 +68,75 @@ class TreeVis:
 			self.select_me(board)
 
 	def load_tree(self) -> None:
-		with open(ROOT_DIR / "parent_tree.pickle", "rb") as f:
-			self.parent_tree = pickle.load(f)
-		
-		assert self.parent_tree
-		self.__parent_tree_size = len(self.parent_tree)
+		# Only the memory maps are opened, the pages are read when the nodes are visited
+		try:
+			graph = StateGraph(self.graph_path)
+		except FileNotFoundError:
+			self.__status = f"No graph in {self.graph_path}, enumerate it with python -m algo.brute_force"
+			return
+		if not graph.finished:
+			self.__status = f"The enumeration in {self.graph_path} is not finished yet"
+			return
+
+		self.graph = graph
+		self.__status = ""
+		self.__prefetch_queue = queue.Queue()
+		self.__prefetch_thread = threading.Thread(target=self.__prefetch, args=(graph,), daemon=True)
+		self.__prefetch_thread.start()
 		self.select_me(Board())
 
 	def unload_tree(self) -> None:
-		del self.parent_tree
-		self.parent_tree = None
-		self.__parent_tree_size = 0
+		if self.__prefetch_thread is not None:
+			self.__prefetch_queue.put(None)
+			self.__prefetch_thread.join()
+			self.__prefetch_thread = None
+		with self.__neighbourhoods_lock:
+			self.__neighbourhoods.clear()
+		self.graph = None
+
+	def __neighbourhood(self, graph: StateGraph, node: int) -> tuple[list[Board], list[Board]]:
+		"""
+		Returns: parents and children of the node, from the cache when they were already decoded
+		"""
+		with self.__neighbourhoods_lock:
+			if node in self.__neighbourhoods:
+				self.__neighbourhoods.move_to_end(node)
+				return self.__neighbourhoods[node]
+
+		ret = (
+			[graph.board(parent) for parent in graph.parents_of(node).tolist()],
+			[graph.board(child) for child in graph.children_of(node).tolist()]
+		)
+		with self.__neighbourhoods_lock:
+			self.__neighbourhoods[node] = ret
+			if len(self.__neighbourhoods) > self.CACHE_SIZE:
+				self.__neighbourhoods.popitem(last=False)
+		return ret
+
+	def __prefetch(self, graph: StateGraph) -> None:
+		# Decodes the neighbourhoods of the nodes next to the selected one, the ones that could be clicked next
+		while (node := self.__prefetch_queue.get()) is not None:
+			for neighbour in np.concatenate([graph.parents_of(node), graph.children_of(node)]).tolist():
+				if not self.__prefetch_queue.empty():
+					# Another node was selected meanwhile
+					break
+				self.__neighbourhood(graph, neighbour)
 	
 	def select_me(self, board: Board) -> None:
 		self.me = board
 
-		if not self.parent_tree:
+		if self.graph is None:
 			return
 
-		board_int = int(board)
-		self.__me_int = board_int
+		self.__me_int = int(board)
 
-		if board_int in self.parent_tree:
-			self.parents = [
-				Board.from_num_repr(parent_int) for parent_int in 
-					self.parent_tree[board_int]
-			]
+		node = int(self.graph.index(np.array([board.code], dtype=np.uint64))[0])
+		if node < 0:
+			self.parents, self.children = [], []
+			return
 
-		self.children = [
-			Board.from_num_repr(child_int) for child_int, child_parent_ints in 
-				self.parent_tree.items() if board_int in child_parent_ints
-		]
+		self.parents, self.children = self.__neighbourhood(self.graph, node)
+		self.__prefetch_queue.put(node)
 
 	def draw(self):
 		if not self.show_window:
@@ -91,8 +146,8 @@ class TreeVis:
 			imgui.set_window_size(800, 600)
 			self.show_window = is_open
 
-			if imgui.button("Load tree" if self.parent_tree is None else "Unload tree"):
-				if self.parent_tree is None:
+			if imgui.button("Load tree" if self.graph is None else "Unload tree"):
+				if self.graph is None:
 					self.load_tree()
 				else:
 					self.unload_tree()
@@ -104,7 +159,9 @@ class TreeVis:
 			imgui.same_line()
 			_, self.__me_integer_input = imgui.input_text("Me", self.__me_integer_input)
 
-			imgui.text(f"Number of states saved: {self.__parent_tree_size}")
+			if self.__status:
+				imgui.text(self.__status)
+			imgui.text(f"Number of states saved: {0 if self.graph is None else len(self.graph)}")
 			imgui.text(f"Current state: {self.__me_int}")
 			
 			w, h = imgui.get_content_region_available()
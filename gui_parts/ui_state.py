@@ -1,16 +1,49 @@
 import threading
-from typing import Optional
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+from time import perf_counter
 from math import exp
 import glob
 
 from .utils import ImageTexture, ROOT_DIR
+from .model_registry import LoadState, ModelRegistry, PlayerDescriptor, StateDictCache
 from algo.board import Board, GameState, _s
 from algo import iplayer
 import algo.dynamicProgramming as dp
 import algo.q_learning as ql
 import algo.ddq_learning as ddqn
 
+class CancelToken:
+	"""
+	Set by the UI thread once the move an agent is asked for is not needed anymore
+	"""
+
+	def __init__(self) -> None:
+		self.__event = threading.Event()
+
+	def cancel(self) -> None:
+		self.__event.set()
+
+	@property
+	def cancelled(self) -> bool:
+		return self.__event.is_set()
+
+@dataclass
+class _Thinking:
+	player: iplayer.IPlayer
+	future: Future
+	token: CancelToken
+	# `UIState.board_version` the move is asked for
+	board_version: int
+	deadline: float
+
+def _think(player: iplayer.IPlayer, board: Board, token: CancelToken) -> Optional[tuple[tuple[int, int], tuple[int, int]]]:
+	# Requests cancelled while waiting for the previous ones are skipped
+	if token.cancelled:
+		return None
+	return player.decide_move(board)
+
 class UIState:
 	def __init__(self) -> None:
 		self.show_settings: bool = True
@@ -26,53 +59,89 @@ class UIState:
 
 		self.automatic_computer_step: bool = True
 
+		# Frames are only drawn after events instead of all the time, see `time_to_update`
+		self.event_driven_redraw: bool = True
+		# Wakes the UI thread up when the work of a background thread is done, set by the GUI
+		self.wake: Callable[[], None] = lambda: None
+
 		self.selected_pos: Optional[tuple[
 			tuple[int, int],
 			set[tuple[int, int]]
 		]] = None
 
+		# Only the cheap players are created at once, the models are loaded when they are first selected
+		self.state_dicts = StateDictCache()
 		self.player_i: dict[int, int] = { 1: 0, -1: 6 }
-		self.players: list[iplayer.IPlayer] = [
-			iplayer.UserInput(),
-			iplayer.RandomPlayer(),
-			dp.dynamicPlayer(),
-			ql.QLearning(str(ROOT_DIR / "models/#1 DQN 90_50_50_1 76.908%.pth")),
-			ql.QLearning(str(ROOT_DIR / "models/#2 DQN 90_50_20_1 59.670%.pth"), [90, 50, 20, 1]),
-			ql.QLearning(str(ROOT_DIR / "models/#3 DQN 90_50_50_1 77.732%.pth")),
-			ql.QLearning(str(ROOT_DIR / "models/#4 DQN 90_50_50_1 t.g. #3 84.448%.pth")),
-			ql.QLearning(str(ROOT_DIR / "models/#5 DQN 90_52_1 78.628%.pth"), [90, 52, 1]),
-			ql.QLearning(str(ROOT_DIR / "models/dqn_y87_90_52_1.pth"), [90, 52, 1]),
-			ql.QLearning(str(ROOT_DIR / "models/dqn_y89_90_52_1.pth"), [90, 52, 1]),
-			ql.QLearning(str(ROOT_DIR / "models/dqn_y99_90_52_1.pth"), [90, 52, 1]),
-			ddqn.QLearning(str(ROOT_DIR / "models/ddqn87 90 50 50 1 q_1 tuned on ddqn86.pth"), [90, 50, 50, 1]),
-			ddqn.QLearning(str(ROOT_DIR / "models/ddqn86 90 50 50 1 q_2 tuned on ddqn86.pth"), [90, 50, 50, 1]),
-			ddqn.QLearning(str(ROOT_DIR / "models/ddqn85 90 50 50 1 q_2 tuned on dqn86.pth based on ddqn87.pth"), [90, 50, 50, 1]),
-		]
-
-		self.worker_thread_event = threading.Event()
-		self.worker_thread_is_running = True
-		self.worker_thread_is_working = False
-		self.worker_thread_delay = .7
-		self.worker_thread = threading.Thread(
-			target=self.worker_thread_function,
-			daemon=True
-		)
-		self.worker_thread.start()
+		self.players = ModelRegistry(on_loaded=lambda: self.wake(), descriptors=[
+			PlayerDescriptor("User input", iplayer.UserInput, eager=True),
+			PlayerDescriptor("Random player", iplayer.RandomPlayer, eager=True),
+			PlayerDescriptor("Dynamic Learning Agent", dp.dynamicPlayer),
+			self.__q_learning(ql, "models/#1 DQN 90_50_50_1 76.908%.pth"),
+			self.__q_learning(ql, "models/#2 DQN 90_50_20_1 59.670%.pth", [90, 50, 20, 1]),
+			self.__q_learning(ql, "models/#3 DQN 90_50_50_1 77.732%.pth"),
+			self.__q_learning(ql, "models/#4 DQN 90_50_50_1 t.g. #3 84.448%.pth"),
+			self.__q_learning(ql, "models/#5 DQN 90_52_1 78.628%.pth", [90, 52, 1]),
+			self.__q_learning(ql, "models/dqn_y87_90_52_1.pth", [90, 52, 1]),
+			self.__q_learning(ql, "models/dqn_y89_90_52_1.pth", [90, 52, 1]),
+			self.__q_learning(ql, "models/dqn_y99_90_52_1.pth", [90, 52, 1]),
+			self.__q_learning(ddqn, "models/ddqn87 90 50 50 1 q_1 tuned on ddqn86.pth"),
+			self.__q_learning(ddqn, "models/ddqn86 90 50 50 1 q_2 tuned on ddqn86.pth"),
+			self.__q_learning(ddqn, "models/ddqn85 90 50 50 1 q_2 tuned on dqn86.pth based on ddqn87.pth"),
+		])
+		for index in self.player_i.values():
+			self.players.request(index)
+
+		# Agents think on copies of the board in a single thread, so that calls of the same agent never overlap,
+		# and their moves are made by `update` on the UI thread
+		self.computer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="computer")
+		self.computer_is_working = False
+		self.computer_step_delay = .7
+		self.computer_time_limit = 30.
+		self.computer_status = ""
+		self.__thinking: Optional[_Thinking] = None
+		self.__next_step_time = 0.
 
 		self.board: Board
 		self.number_of_moves: int
+		# Changed with every change of the board, the moves of the agents are only made on the board they were asked for
+		self.board_version = 0
 		self.reset_board()
 
 	def reset_board(self) -> None:
 		self.selected_pos = None
 		self.board = Board()
 		self.number_of_moves = 0
+		self.board_version += 1
+		self.__cancel_thinking()
+
+	def make_move(self, start: tuple[int, int], end: tuple[int, int]) -> None:
+		self.board.make_move(start, end)
+		self.number_of_moves += 1
+		self.board_version += 1
+
+	def set_should_capture_rule(self, enabled: bool) -> None:
+		self.board.enable_update_should_capture = enabled
+		self.board_version += 1
 
-	def get_player(self, sign: int) -> iplayer.IPlayer:
-		return self.players[self.player_i[sign]]
+	def __q_learning(self, module, path: str, layer_sizes: list[int] = [90, 50, 50, 1]) -> PlayerDescriptor:
+		path = ROOT_DIR / path
+		return PlayerDescriptor(
+			f"{path.name} ({layer_sizes})",
+			lambda: module.QLearning(str(path), layer_sizes, self.state_dicts.load(str(path)))
+		)
+
+	def get_player(self, sign: int) -> Optional[iplayer.IPlayer]:
+		"""
+		Returns: the player, `None` while it is being loaded
+		"""
+		return self.players.get(self.player_i[sign])
+
+	def select_player(self, sign: int, index: int) -> None:
+		self.player_i[sign] = index
+		self.players.request(index)
 
 	def get_player_list_name(self, index: int) -> str:
-		return f"{self.players[index]}"
+		return self.players.name(index)
 
 	@property
 	def game_is_going(self) -> bool:
@@ -88,21 +157,24 @@ class UIState:
 		return self.game_is_going and \
 			not isinstance(self.get_player(self.board.turn_sign), iplayer.UserInput)
 
+	@property
+	def computer_is_thinking(self) -> bool:
+		return self.__thinking is not None
+
 	# Handlers
 	def on_pressed_tile(self, pos: tuple[int, int]) -> Optional[str]:
-		if self.worker_thread_event.is_set():
+		if self.computer_is_thinking:
 			return "Computer is currently thinking..."
 
 		if not self.waiting_user_input:
 			return
 
 		if self.selected_pos and pos in self.selected_pos[1]:
-			self.board.make_move(self.selected_pos[0], pos)
-			self.number_of_moves += 1
+			self.make_move(self.selected_pos[0], pos)
 			self.selected_pos = None
 
 			if self.automatic_computer_step and not self.waiting_user_input:
-				self.worker_thread_event.set()
+				self.start_computer()
 
 			return
 
@@ -118,29 +190,106 @@ class UIState:
 			set(self.board.get_correct_moves(pos))
 		)
 
-	def worker_thread_function(self) -> None:
-		while self.worker_thread_event.wait():
-			self.worker_thread_event.clear()
+	def start_computer(self) -> None:
+		"""
+		Computer players make moves until it is the user's turn or the game is over
+		"""
+		self.selected_pos = None
+		self.computer_status = ""
+		self.computer_is_working = True
+		self.__next_step_time = 0.
+
+	def stop_computer(self) -> None:
+		"""
+		Stops at once, the move being thought about is thrown away
+		"""
+		self.computer_is_working = False
+		self.__cancel_thinking()
+
+	def __cancel_thinking(self) -> None:
+		if self.__thinking is not None:
+			self.__thinking.token.cancel()
+			self.__thinking = None
+
+	def time_to_update(self) -> Optional[float]:
+		"""
+		Returns: seconds until `update` has something to do by itself, `None` if only input events or `wake` could change anything
+		"""
+		if self.__thinking is not None:
+			# Finished moves wake the UI thread up earlier
+			return max(self.__thinking.deadline - perf_counter(), 0.)
+		if not self.computer_is_working:
+			return None
+		if not self.can_do_computer_step:
+			return 0.
+		if self.get_player(self.board.turn_sign) is None:
+			# Loaded players wake the UI thread up
+			return None
+		return max(self.__next_step_time - perf_counter(), 0.)
 
-			if not self.worker_thread_is_running:
+	def update(self) -> None:
+		"""
+		Called by the UI thread every frame: makes the move of the agent once it is known and asks for the next one
+		"""
+		now = perf_counter()
+		thinking = self.__thinking
+		if thinking is not None:
+			if not thinking.future.done():
+				if now > thinking.deadline:
+					self.stop_computer()
+					self.computer_status = f"{thinking.player} did not move in {self.computer_time_limit:g} s"
 				return
 
-			self.selected_pos = None
+			self.__thinking = None
+			error = thinking.future.exception()
+			if error is not None:
+				self.computer_is_working = False
+				self.computer_status = f"{thinking.player} failed: {error!r}"
+				return
+			if thinking.board_version != self.board_version:
+				return
 
-			self.worker_thread_is_working = True
-			while self.worker_thread_is_working and self.can_do_computer_step:
-				start, end = self.get_player(self.board.turn_sign).decide_move(self.board)
-				
-				self.board.make_move(start, end)
-				self.number_of_moves += 1
-
-				if self.worker_thread_delay:
-					sleep(1e-3 * (exp(self.worker_thread_delay) - 1))
-			
-			self.worker_thread_is_working = False
+			start, end = thinking.future.result()
+			if not self.board.is_move_correct(start, end):
+				self.computer_is_working = False
+				self.computer_status = f"{thinking.player} made an incorrect move {start} -> {end}"
+				return
+			self.make_move(start, end)
+			self.__next_step_time = now + 1e-3 * (exp(self.computer_step_delay) - 1)
+
+		if not self.computer_is_working:
+			return
+		if not self.can_do_computer_step:
+			self.computer_is_working = False
+			return
+		if now < self.__next_step_time:
+			return
+
+		player = self.get_player(self.board.turn_sign)
+		if player is None:
+			index = self.player_i[self.board.turn_sign]
+			if self.players.state(index) == LoadState.FAILED:
+				self.computer_is_working = False
+				self.computer_status = f"{self.players.descriptors[index].name} failed to load: {self.players.error(index)!r}"
+			else:
+				self.computer_status = f"Loading {self.players.descriptors[index].name}..."
+			return
+		self.computer_status = ""
+		token = CancelToken()
+		self.__thinking = _Thinking(
+			player,
+			self.__submit(player, token),
+			token,
+			self.board_version,
+			now + self.computer_time_limit
+		)
 	
+	def __submit(self, player: iplayer.IPlayer, token: CancelToken) -> Future:
+		future = self.computer_executor.submit(_think, player, self.board.copy(), token)
+		future.add_done_callback(lambda _: self.wake())
+		return future
+
 	def __del__(self) -> None:
-		self.worker_thread_is_running = False
-		self.worker_thread_pause_requested = True
-		self.worker_thread_event.set()
-		self.worker_thread.join()
\ No newline at end of file
+		self.__cancel_thinking()
+		self.computer_executor.shutdown(wait=False, cancel_futures=True)
+		self.players.shutdown()
\ No newline at end of file